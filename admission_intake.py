@@ -0,0 +1,151 @@
+import unicodedata
+import pandas as pd
+from sqlalchemy import select, literal, literal_column, any_, bindparam, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert, ARRAY
+from sqlalchemy.types import Integer
+from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Any, Dict, List, Tuple
+from models import Paciente, Admision, HojaRutaExamenes, ProtocoloDetalle, EstadoAdmision, EstadoExamen
+
+# --- CARGA MASIVA DE ADMISIONES (CAMPAÑAS CORPORATIVAS) ---
+# Una campaña llega como planilla (CSV / XLSX) con un trabajador por fila.
+# Todo se registra en una sola transacción con inserciones por lotes:
+#   1. Upsert de pacientes (INSERT ... ON CONFLICT, multi-VALUES)
+#   2. Admisiones (multi-VALUES con RETURNING)
+#   3. Hoja de ruta: un único INSERT ... SELECT que cruza admisiones x exámenes del protocolo
+
+REQUIRED_COLUMNS = ["numero_documento", "nombres", "apellidos", "fecha_nacimiento"]
+OPTIONAL_COLUMNS = ["tipo_documento", "genero", "email", "telefono", "puesto_postula"]
+
+# Encabezados alternativos habituales en las planillas de los clientes
+COLUMN_ALIASES = {
+    "dni": "numero_documento",
+    "documento": "numero_documento",
+    "nro_documento": "numero_documento",
+    "nombre": "nombres",
+    "apellido": "apellidos",
+    "fecha_nac": "fecha_nacimiento",
+    "nacimiento": "fecha_nacimiento",
+    "sexo": "genero",
+    "correo": "email",
+    "celular": "telefono",
+    "puesto": "puesto_postula",
+    "cargo": "puesto_postula",
+}
+
+# Columnas de paciente que el upsert actualiza si vienen informadas
+PATIENT_UPDATE_COLUMNS = ["nombres", "apellidos", "fecha_nacimiento", "genero", "email", "telefono"]
+
+def _normalize_header(header: Any) -> str:
+    decomposed = unicodedata.normalize("NFKD", str(header))
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c)).strip().lower()
+    key = "_".join(plain.replace(".", " ").split())
+    return COLUMN_ALIASES.get(key, key)
+
+def read_campaign_file(uploaded_file) -> pd.DataFrame:
+    """Lee la planilla como texto (evita que el DNI pierda ceros a la izquierda)"""
+    name = getattr(uploaded_file, "name", str(uploaded_file)).lower()
+    if name.endswith((".xlsx", ".xls")):
+        df = pd.read_excel(uploaded_file, dtype=str)
+    else:
+        df = pd.read_csv(uploaded_file, dtype=str, sep=None, engine="python")
+    df.columns = [_normalize_header(c) for c in df.columns]
+    return df
+
+def parse_campaign(df: pd.DataFrame) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Valida la planilla y devuelve (filas válidas, errores por fila)"""
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        return [], [f"Faltan columnas obligatorias: {', '.join(missing)}"]
+
+    columns = REQUIRED_COLUMNS + [c for c in OPTIONAL_COLUMNS if c in df.columns]
+    data = df[columns].apply(lambda col: col.str.strip()).replace({"": None})
+    data = data.where(data.notna(), None)
+    fechas = pd.to_datetime(data["fecha_nacimiento"], errors="coerce", dayfirst=True)
+
+    rows, errors, seen = [], [], set()
+    for pos, (record, fecha) in enumerate(zip(data.to_dict("records"), fechas), start=2):  # fila 1 = encabezado
+        doc = record["numero_documento"]
+        if not all(record[c] for c in ("numero_documento", "nombres", "apellidos")):
+            errors.append(f"Fila {pos}: documento, nombres y apellidos son obligatorios")
+            continue
+        if pd.isna(fecha):
+            errors.append(f"Fila {pos}: fecha de nacimiento inválida ({record['fecha_nacimiento']})")
+            continue
+        if doc in seen:
+            errors.append(f"Fila {pos}: documento {doc} repetido en la planilla")
+            continue
+        seen.add(doc)
+        record["fecha_nacimiento"] = fecha.date()
+        rows.append(record)
+    return rows, errors
+
+def bulk_register_admissions(db: Session, rows: List[Dict[str, Any]], company_id: int, protocol_id: int, user_id=None) -> Dict[str, Any]:
+    """
+    Registra una campaña completa. No hace commit: el llamador controla la transacción.
+    Devuelve los conteos y los pacientes creados (para el índice de DNI).
+    """
+    # Un documento repetido haría fallar el upsert ("cannot affect row a second time")
+    rows = list({r["numero_documento"]: r for r in rows}.values())
+    if not rows:
+        return {"pacientes_nuevos": [], "pacientes_actualizados": 0, "admisiones": 0, "examenes": 0}
+
+    # 1. Upsert de pacientes. (xmax = 0) distingue filas insertadas de actualizadas.
+    patient_rows = [{
+        "tipo_documento": r.get("tipo_documento") or "DNI",
+        "numero_documento": r["numero_documento"],
+        "nombres": r["nombres"],
+        "apellidos": r["apellidos"],
+        "fecha_nacimiento": r["fecha_nacimiento"],
+        "genero": r.get("genero"),
+        "email": r.get("email"),
+        "telefono": r.get("telefono"),
+    } for r in rows]
+    stmt = pg_insert(Paciente)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Paciente.numero_documento],
+        set_={c: func.coalesce(getattr(stmt.excluded, c), getattr(Paciente, c)) for c in PATIENT_UPDATE_COLUMNS}
+    ).returning(Paciente.id, Paciente.numero_documento, literal_column("(xmax = 0)").label("inserted"))
+    upserted = db.execute(stmt, patient_rows).all()
+    patient_ids = {r.numero_documento: r.id for r in upserted}
+    nuevos = [(r.numero_documento, r.id) for r in upserted if r.inserted]
+
+    # 2. Admisiones en lote
+    now = datetime.now()
+    admission_rows = [{
+        "paciente_id": patient_ids[r["numero_documento"]],
+        "empresa_id": company_id,
+        "protocolo_id": protocol_id,
+        "fecha_ingreso": now,
+        "estado_global": EstadoAdmision.EN_CIRCUITO.value,
+        "puesto_postula": r.get("puesto_postula"),
+        "usuario_admision_id": user_id,
+    } for r in rows]
+    admission_ids = db.execute(
+        pg_insert(Admision).returning(Admision.id), admission_rows
+    ).scalars().all()
+
+    # 3. Hoja de ruta: admisiones x exámenes del protocolo, resuelto en el servidor
+    route_select = select(
+        Admision.id,
+        ProtocoloDetalle.examen_id,
+        literal(EstadoExamen.PENDIENTE.value)
+    ).select_from(Admision).join(
+        ProtocoloDetalle, ProtocoloDetalle.protocolo_id == Admision.protocolo_id
+    ).where(
+        Admision.id == any_(bindparam("admission_ids", admission_ids, type_=ARRAY(Integer)))
+    )
+    result = db.execute(
+        pg_insert(HojaRutaExamenes).from_select(
+            [HojaRutaExamenes.admision_id, HojaRutaExamenes.examen_id, HojaRutaExamenes.estado],
+            route_select
+        )
+    )
+
+    return {
+        "pacientes_nuevos": nuevos,
+        "pacientes_actualizados": len(upserted) - len(nuevos),
+        "admisiones": len(admission_ids),
+        "examenes": result.rowcount,
+    }
@@ -0,0 +1,120 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+from config import settings
+
+# Etiquetas de invalidación: cada escritura invalida solo las métricas que dependen de ella
+ADMISIONES = "admisiones"
+EXAMENES = "examenes"
+EMPRESAS = "empresas"
+USUARIOS = "usuarios"
+
+class _KeyLock:
+    """Candado de una clave y cuántas sesiones lo usan: se descarta cuando nadie lo espera"""
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.users = 0
+
+class AggregateCache:
+    """
+    Caché en memoria compartida por todo el proceso (todas las sesiones de Streamlit).
+    Las entradas expiran por TTL o se invalidan explícitamente por etiqueta.
+    Es segura entre hilos y evita recalcular la misma clave en paralelo (single-flight).
+    """
+
+    def __init__(self, default_ttl: float):
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, Any, frozenset]] = {}
+        self._key_locks: Dict[str, _KeyLock] = {}
+        # Generación por etiqueta: una invalidación solo descarta las cargas en vuelo que
+        # dependen de esa etiqueta. clear() sube _cleared, que afecta a todas.
+        self._tag_generations: Dict[str, int] = {}
+        self._cleared = 0
+        self._last_sweep = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Devuelve (encontrado, valor) sin recalcular"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return True, entry[1]
+            self.misses += 1
+            return False, None
+
+    def _generation_locked(self, tags: frozenset) -> Tuple[int, ...]:
+        return (self._cleared,) + tuple(self._tag_generations.get(t, 0) for t in sorted(tags))
+
+    def set(self, key: str, value: Any, tags: Iterable[str] = (), ttl: Optional[float] = None, generation: Optional[Tuple[int, ...]] = None):
+        """
+        Guarda un valor; si desde `generation` (ver generation(tags)) se invalidó alguna de sus
+        etiquetas el valor se descarta por obsoleto
+        """
+        tags = frozenset(tags)
+        now = time.monotonic()
+        expires = now + (self.default_ttl if ttl is None else ttl)
+        with self._lock:
+            if now - self._last_sweep > self.default_ttl:
+                # Claves que no se vuelven a pedir (días anteriores, páginas de listados) no quedan para siempre
+                self._entries = {k: e for k, e in self._entries.items() if e[0] > now}
+                self._last_sweep = now
+            if generation is not None and generation != self._generation_locked(tags):
+                return
+            self._entries[key] = (expires, value, tags)
+
+    def generation(self, tags: Iterable[str] = ()) -> Tuple[int, ...]:
+        """Marca de las etiquetas indicadas, para pasarla a set() al terminar una carga"""
+        with self._lock:
+            return self._generation_locked(frozenset(tags))
+
+    def get_or_load(self, key: str, loader: Callable[[], Any], tags: Iterable[str] = (), ttl: Optional[float] = None) -> Any:
+        """Sirve desde memoria o calcula una sola vez aunque varias sesiones lo pidan a la vez"""
+        found, value = self.get(key)
+        if found:
+            return value
+
+        tags = frozenset(tags)
+        with self._lock:
+            key_lock = self._key_locks.get(key)
+            if key_lock is None:
+                key_lock = self._key_locks[key] = _KeyLock()
+            key_lock.users += 1
+
+        try:
+            with key_lock.lock:
+                # Otra sesión pudo haberlo calculado mientras esperábamos
+                found, value = self.get(key)
+                if found:
+                    return value
+                generation = self.generation(tags)
+                value = loader()
+                self.set(key, value, tags, ttl, generation)
+                return value
+        finally:
+            with self._lock:
+                key_lock.users -= 1
+                if key_lock.users == 0:
+                    del self._key_locks[key]
+
+    def invalidate(self, *tags: str):
+        """Elimina las entradas que dependen de alguna de las etiquetas indicadas"""
+        tags = set(tags)
+        with self._lock:
+            for tag in tags:
+                self._tag_generations[tag] = self._tag_generations.get(tag, 0) + 1
+            stale = [k for k, (_, _, entry_tags) in self._entries.items() if entry_tags & tags]
+            for k in stale:
+                del self._entries[k]
+
+    def clear(self):
+        with self._lock:
+            self._cleared += 1
+            self._entries.clear()
+
+# Instancia única del proceso para los agregados del Panel Gerencial
+dashboard_cache = AggregateCache(settings.DASHBOARD_CACHE_TTL)
@@ -1,8 +1,11 @@
 import streamlit as st
 import time
 import logging
-from database import get_db
+from database import get_db, SessionLocal
 from models import Usuario
+from patient_search import document_index
+from security import verify_password
+from session_auth import start_session, restore_session, end_session
 
 # --- CONFIGURACIÓN INICIAL (Debe ir primero) ---
 st.set_page_config(
@@ -16,6 +19,9 @@ st.set_page_config(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Precarga del índice de DNI (una sola vez por proceso, en segundo plano)
+document_index.warm_up(SessionLocal)
+
 # --- ESTILOS CSS PARA OCULTAR/MOSTRAR MENÚ ---
 def inject_css(authenticated):
     if not authenticated:
@@ -42,6 +48,9 @@ if 'user' not in st.session_state:
 if 'authenticated' not in st.session_state:
     st.session_state.authenticated = False
 
+# Refresco / reconexión: se recupera la sesión desde el token firmado, sin login
+restore_session()
+
 inject_css(st.session_state.authenticated)
 
 # --- LOGIN ---
@@ -59,14 +68,19 @@ def login():
                 db = next(get_db())
                 try:
                     user_db = db.query(Usuario).filter(Usuario.email == email).first()
-                    if user_db and user_db.hashed_password == password:
-                        st.session_state.authenticated = True
-                        st.session_state.user = {
+                    valid, new_hash = verify_password(password, user_db.hashed_password if user_db else None)
+                    if user_db and valid and user_db.activo:
+                        if new_hash:
+                            # Clave legada o con costo obsoleto: se guarda el hash actualizado
+                            user_db.hashed_password = new_hash
+                            db.commit()
+                        start_session({
                             "id": str(user_db.id),
                             "email": user_db.email,
                             "rol": user_db.rol,
-                            "nombre": user_db.nombre_completo
-                        }
+                            "nombre": user_db.nombre_completo,
+                            "token_version": user_db.token_version
+                        })
                         st.success(f"Bienvenido {user_db.nombre_completo}")
                         time.sleep(0.5)
                         st.rerun()
@@ -100,8 +114,7 @@ def sidebar_menu():
         
         st.divider()
         if st.button("Cerrar Sesión", use_container_width=True):
-            st.session_state.authenticated = False
-            st.session_state.user = None
+            end_session()
             st.rerun()
             
     return opcion
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Optional
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- MOTOR ASÍNCRONO (asyncpg) ---
+# Alternativa a database.SessionLocal para lecturas de I/O: varias consultas de una misma
+# página se superponen en un solo hilo en lugar de ejecutarse una tras otra. Se activa con
+# ASYNC_DB_ENABLED; el motor se crea recién en el primer uso, así asyncpg solo es necesario
+# si la opción está encendida. Las escrituras siguen en el motor síncrono (unit_of_work).
+
+_engine_lock = threading.Lock()
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker] = None
+
+def get_async_engine() -> AsyncEngine:
+    global _engine, _session_factory
+    with _engine_lock:
+        if _engine is None:
+            _engine = create_async_engine(
+                settings.ASYNC_DATABASE_URL,
+                pool_size=settings.DB_POOL_SIZE,
+                max_overflow=settings.DB_MAX_OVERFLOW,
+                pool_timeout=settings.DB_POOL_TIMEOUT,
+                pool_recycle=settings.DB_POOL_RECYCLE,
+                pool_pre_ping=settings.DB_POOL_PRE_PING,
+            )
+            # Mismo criterio que SessionLocal: los objetos siguen legibles tras cerrar la sesión
+            _session_factory = async_sessionmaker(_engine, expire_on_commit=False, autoflush=False)
+        return _engine
+
+@asynccontextmanager
+async def async_session():
+    """Sesión asíncrona de solo lectura: una conexión del pool asyncpg por bloque"""
+    get_async_engine()
+    async with _session_factory() as db:
+        yield db
+
+# --- FACHADA SÍNCRONA PARA STREAMLIT ---
+# Las conexiones asyncpg pertenecen al event loop que las abrió, así que todas las corrutinas
+# corren en UN loop persistente del proceso (hilo propio). Los scripts de Streamlit, que son
+# síncronos, le envían trabajo y esperan el resultado.
+
+_loop_lock = threading.Lock()
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-db-loop", daemon=True).start()
+            logger.info("Event loop de la BD asíncrona iniciado")
+        return _loop
+
+def submit(coro: Awaitable[Any]) -> concurrent.futures.Future:
+    """Programa la corrutina en el loop del proceso; el Future es compatible con as_completed()"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_loop())
+
+def run_sync(coro: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+    """Ejecuta la corrutina y bloquea hasta su resultado (llamar desde código síncrono)"""
+    return submit(coro).result(timeout)
@@ -0,0 +1,99 @@
+import time
+import logging
+import threading
+from sqlalchemy.orm import Session
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from models import Empresa, Protocolo, ProtocoloDetalle, ExamenRol
+
+logger = logging.getLogger(__name__)
+
+# --- CACHÉ DEL CATÁLOGO COMERCIAL (EMPRESAS -> PROTOCOLOS -> EXÁMENES) ---
+# Los protocolos cambian muy poco y se leen en cada admisión. La caché guarda una
+# instantánea inmutable y versionada; Configuración la invalida al crear, editar o
+# eliminar. El TTL cubre los cambios hechos desde otros procesos / workers.
+
+class ProtocoloInfo(NamedTuple):
+    id: int
+    nombre: str
+    examenes: Tuple[Tuple[int, Optional[float]], ...]  # (examen_id, precio_acordado)
+
+class CatalogSnapshot(NamedTuple):
+    version: int
+    empresas: Tuple[Tuple[int, str], ...]                  # (id, razon_social) ordenadas por nombre
+    protocolos_por_empresa: Dict[int, Tuple[ProtocoloInfo, ...]]
+    protocolos: Dict[int, ProtocoloInfo]
+    roles: Dict[str, Tuple[int, ...]]                      # rol -> ids de examen (ver models.RolExamen)
+
+class CatalogCache:
+    def __init__(self, ttl: float = 300.0):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._loaded_at = 0.0
+        self._version = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._snapshot = None
+
+    def _load(self, db: Session, version: int) -> CatalogSnapshot:
+        # Cuatro consultas planas (sin lazy loads) para construir el árbol completo
+        empresas = db.query(Empresa.id, Empresa.razon_social).order_by(Empresa.razon_social).all()
+        protocolos = db.query(Protocolo.id, Protocolo.empresa_id, Protocolo.nombre_protocolo).order_by(Protocolo.id).all()
+        detalles = db.query(
+            ProtocoloDetalle.protocolo_id, ProtocoloDetalle.examen_id, ProtocoloDetalle.precio_acordado
+        ).order_by(ProtocoloDetalle.id).all()
+        exam_roles = db.query(ExamenRol.rol, ExamenRol.examen_id).order_by(ExamenRol.examen_id).all()
+
+        examenes: Dict[int, List[Tuple[int, Optional[float]]]] = {}
+        for d in detalles:
+            examenes.setdefault(d.protocolo_id, []).append((d.examen_id, d.precio_acordado))
+
+        por_id = {p.id: ProtocoloInfo(p.id, p.nombre_protocolo, tuple(examenes.get(p.id, ()))) for p in protocolos}
+        por_empresa: Dict[int, List[ProtocoloInfo]] = {}
+        for p in protocolos:
+            por_empresa.setdefault(p.empresa_id, []).append(por_id[p.id])
+        roles: Dict[str, List[int]] = {}
+        for r in exam_roles:
+            roles.setdefault(r.rol, []).append(r.examen_id)
+
+        logger.info(f"Catálogo cargado (v{version}): {len(empresas)} empresas, {len(protocolos)} protocolos")
+        return CatalogSnapshot(
+            version=version,
+            empresas=tuple((e.id, e.razon_social) for e in empresas),
+            protocolos_por_empresa={k: tuple(v) for k, v in por_empresa.items()},
+            protocolos=por_id,
+            roles={k: tuple(v) for k, v in roles.items()},
+        )
+
+    def get(self, db: Session) -> CatalogSnapshot:
+        """Instantánea vigente; solo consulta la BD si fue invalidada o expiró"""
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return snapshot
+            version = self._version
+
+        snapshot = self._load(db, version)
+        with self._lock:
+            # Si hubo una invalidación mientras se cargaba, no se publica la instantánea vieja
+            if version == self._version:
+                self._snapshot = snapshot
+                self._loaded_at = time.monotonic()
+        return snapshot
+
+    def exam_ids(self, db: Session, protocol_id: int) -> List[int]:
+        protocolo = self.get(db).protocolos.get(protocol_id)
+        if protocolo is None:
+            # Protocolo creado en otro proceso: se fuerza la recarga una vez
+            self.invalidate()
+            protocolo = self.get(db).protocolos.get(protocol_id)
+        return [examen_id for examen_id, _ in protocolo.examenes] if protocolo else []
+
+    def exam_ids_for_role(self, db: Session, rol: str) -> Tuple[int, ...]:
+        """Exámenes del catálogo asignados a un rol (p. ej. destino de Triaje)"""
+        return self.get(db).roles.get(rol, ())
+
+# Instancia única del proceso
+catalog_cache = CatalogCache()
@@ -0,0 +1,224 @@
+import re
+import logging
+import threading
+import zipfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
+from fpdf import FPDF
+
+logger = logging.getLogger(__name__)
+
+# --- EMISIÓN MASIVA DE CERTIFICADOS DE APTITUD ---
+# Al cierre de una campaña se emiten cientos de certificados a la vez. Cada certificado
+# es un PDF independiente; se reparten por lotes en un pool de procesos (el render de
+# FPDF es Python puro y no escala con hilos por el GIL) y se escriben en un ZIP a medida
+# que llegan, con un número acotado de lotes en vuelo: nunca se tienen todos en memoria.
+#
+# Este módulo no importa la capa de BD: los procesos hijos solo cargan FPDF y la plantilla.
+# Las filas llegan como diccionarios planos (ver CERTIFICATE_FIELDS).
+
+CERTIFICATE_FIELDS = (
+    "uuid_documento", "aptitud_status", "restricciones", "recomendaciones",
+    "fecha_emision", "fecha_vencimiento",
+    "paciente", "tipo_documento", "numero_documento", "fecha_nacimiento",
+    "empresa", "ruc", "puesto_postula", "fecha_ingreso",
+    "medico", "cmp_colegiatura",
+)
+
+STATUS_COLORS = {
+    "APTO": (46, 125, 50),
+    "APTO CON RESTRICCIONES": (239, 108, 0),
+    "NO APTO": (198, 40, 40),
+}
+
+def _latin1(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        value = value.strftime("%d/%m/%Y")
+    elif isinstance(value, date):
+        value = value.strftime("%d/%m/%Y")
+    return str(value).encode("latin-1", "replace").decode("latin-1")
+
+class CertificateTemplate:
+    """
+    Partes fijas del certificado, preparadas una sola vez por proceso: textos legales ya
+    codificados, etiquetas y geometría. Se usan las fuentes base de PDF (Helvetica), que
+    no se incrustan ni se parsean por documento.
+    """
+
+    def __init__(self, clinic_name: str = "SisoAI - Salud Ocupacional"):
+        self.clinic = _latin1(clinic_name)
+        self.title = _latin1("CERTIFICADO DE APTITUD MÉDICO OCUPACIONAL")
+        self.legal = _latin1(
+            "El médico que suscribe certifica que el trabajador identificado ha sido evaluado "
+            "según el protocolo de exámenes médico ocupacionales contratado por la empresa, "
+            "con el resultado de aptitud que se indica para el puesto de trabajo declarado."
+        )
+        self.labels = {k: _latin1(v) for k, v in {
+            "paciente": "Apellidos y nombres:",
+            "documento": "Documento:",
+            "nacimiento": "Fecha de nacimiento:",
+            "empresa": "Empresa:",
+            "ruc": "RUC:",
+            "puesto": "Puesto al que postula:",
+            "ingreso": "Fecha de evaluación:",
+            "restricciones": "Restricciones:",
+            "recomendaciones": "Recomendaciones:",
+            "vigencia": "Vigente hasta:",
+            "firma": "Firma y sello del médico",
+            "codigo": "Código de verificación:",
+        }.items()}
+
+    def _field(self, pdf: FPDF, label: str, value: str, width: float = 55):
+        pdf.set_font("Helvetica", "B", 10)
+        pdf.cell(width, 7, label, 0, 0)
+        pdf.set_font("Helvetica", "", 10)
+        pdf.cell(0, 7, value, 0, 1)
+
+    def render(self, row: Dict[str, Any]) -> bytes:
+        pdf = FPDF(format="A4")
+        pdf.set_auto_page_break(False)
+        pdf.set_title(self.title)
+        pdf.add_page()
+
+        pdf.set_font("Helvetica", "B", 11)
+        pdf.cell(0, 8, self.clinic, 0, 1, "L")
+        pdf.set_font("Helvetica", "B", 15)
+        pdf.cell(0, 12, self.title, 0, 1, "C")
+        pdf.line(10, pdf.get_y(), 200, pdf.get_y())
+        pdf.ln(4)
+
+        labels = self.labels
+        documento = f"{_latin1(row.get('tipo_documento') or 'DNI')} {_latin1(row.get('numero_documento'))}"
+        self._field(pdf, labels["paciente"], _latin1(row.get("paciente")))
+        self._field(pdf, labels["documento"], documento)
+        self._field(pdf, labels["nacimiento"], _latin1(row.get("fecha_nacimiento")))
+        self._field(pdf, labels["empresa"], _latin1(row.get("empresa")))
+        self._field(pdf, labels["ruc"], _latin1(row.get("ruc")))
+        self._field(pdf, labels["puesto"], _latin1(row.get("puesto_postula")))
+        self._field(pdf, labels["ingreso"], _latin1(row.get("fecha_ingreso")))
+        pdf.ln(4)
+
+        pdf.set_font("Helvetica", "", 10)
+        pdf.multi_cell(0, 6, self.legal)
+        pdf.ln(4)
+
+        status = (row.get("aptitud_status") or "").upper()
+        pdf.set_fill_color(*STATUS_COLORS.get(status, (90, 90, 90)))
+        pdf.set_text_color(255, 255, 255)
+        pdf.set_font("Helvetica", "B", 16)
+        pdf.cell(0, 14, _latin1(status or "SIN CALIFICAR"), 0, 1, "C", fill=True)
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(4)
+
+        for key in ("restricciones", "recomendaciones"):
+            pdf.set_font("Helvetica", "B", 10)
+            pdf.cell(0, 7, labels[key], 0, 1)
+            pdf.set_font("Helvetica", "", 10)
+            pdf.multi_cell(0, 6, _latin1(row.get(key)) or "Ninguna.")
+            pdf.ln(2)
+        self._field(pdf, labels["vigencia"], _latin1(row.get("fecha_vencimiento")))
+
+        pdf.set_y(240)
+        pdf.line(120, pdf.get_y(), 190, pdf.get_y())
+        pdf.set_x(120)
+        pdf.set_font("Helvetica", "", 9)
+        pdf.cell(70, 5, _latin1(row.get("medico")), 0, 2, "C")
+        pdf.cell(70, 5, f"CMP {_latin1(row.get('cmp_colegiatura'))}", 0, 2, "C")
+        pdf.cell(70, 5, labels["firma"], 0, 1, "C")
+
+        pdf.set_y(275)
+        pdf.set_font("Helvetica", "I", 8)
+        pdf.cell(0, 5, f"{labels['codigo']} {_latin1(row.get('uuid_documento'))} - Emitido el {_latin1(row.get('fecha_emision'))}", 0, 0, "C")
+        return bytes(pdf.output())
+
+def certificate_file_name(row: Dict[str, Any]) -> str:
+    documento = re.sub(r"[^0-9A-Za-z-]", "", str(row.get("numero_documento") or "sin-documento"))
+    return f"Certificado_{documento}_{str(row.get('uuid_documento'))[:8]}.pdf"
+
+# --- LADO DEL WORKER ---
+
+_template: Optional[CertificateTemplate] = None
+
+def _init_worker():
+    """Se ejecuta una vez por proceso: la plantilla queda cargada para todos sus lotes"""
+    global _template
+    _template = CertificateTemplate()
+
+def _render_chunk(rows: Sequence[Dict[str, Any]]) -> List[Tuple[str, bytes]]:
+    if _template is None:
+        _init_worker()
+    return [(certificate_file_name(row), _template.render(row)) for row in rows]
+
+# --- POOL DE PROCESOS (UNO POR PROCESO DE STREAMLIT) ---
+
+_pool_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Pool persistente: los procesos (y sus plantillas) se reutilizan entre campañas.
+    'spawn' evita heredar por fork las conexiones y los hilos del servidor.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            _pool_workers = workers
+        return _pool
+
+def write_certificates_zip(
+    rows: Sequence[Dict[str, Any]],
+    out: BinaryIO,
+    workers: int = 4,
+    chunk_size: int = 25,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> int:
+    """
+    Renderiza los certificados y los escribe en `out` como ZIP a medida que se completan.
+    workers=0 renderiza en el proceso actual (lotes pequeños / diagnóstico).
+    Devuelve la cantidad de certificados escritos.
+    """
+    total = len(rows)
+    chunks = (rows[i:i + chunk_size] for i in range(0, total, chunk_size))
+    written = 0
+    # Los PDF ya vienen comprimidos: ZIP_STORED evita gastar CPU en recomprimir
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        if workers <= 0:
+            for chunk in chunks:
+                for name, pdf in _render_chunk(chunk):
+                    zf.writestr(name, pdf)
+                    written += 1
+                if progress:
+                    progress(written, total)
+            return written
+
+        pool = get_pool(workers)
+        pending = deque()
+        # Como máximo dos lotes en vuelo por worker: acota la memoria sin dejar workers ociosos
+        for chunk in chunks:
+            pending.append(pool.submit(_render_chunk, chunk))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            for name, pdf in pending.popleft().result():
+                zf.writestr(name, pdf)
+                written += 1
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                pending.append(pool.submit(_render_chunk, next_chunk))
+            if progress:
+                progress(written, total)
+    logger.info(f"Certificados emitidos: {written}")
+    return written
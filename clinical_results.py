@@ -0,0 +1,204 @@
+import operator
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import cast, func, and_, or_, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+from models import (
+    ResultadoClinico, SignosVitales, Admision, HojaRutaExamenes, CatalogoExamenes,
+    EstadoAdmision, EstadoExamen, VITALS_COLUMNS
+)
+
+# --- ESCRITURA DE RESULTADOS CLÍNICOS ---
+# Un solo INSERT ... ON CONFLICT (admision_id, examen_id) DO UPDATE: sin SELECT previo y
+# sin carrera cuando dos estaciones guardan el mismo examen a la vez. La mezcla de
+# datos_tecnicos se hace en el servidor sobre la fila ya bloqueada (jsonb ||), así que
+# ninguna escritura concurrente pisa las claves de otra.
+
+def upsert_result(
+    db: Session,
+    admision_id: int,
+    examen_id: int,
+    datos_tecnicos: Dict[str, Any],
+    conclusiones: Optional[str] = None,
+    observaciones: Optional[str] = None,
+    conclusiones_update: Optional[str] = None,
+    preserve_observaciones: bool = False,
+) -> int:
+    """
+    Crea o actualiza el resultado del examen y devuelve su id. No hace commit.
+    conclusiones_update reemplaza a conclusiones cuando el resultado ya existía.
+    preserve_observaciones: las observaciones solo se escriben si el resultado no tenía
+    (notas automáticas como la de Triaje no pisan las del médico).
+    """
+    stmt = pg_insert(ResultadoClinico).values(
+        admision_id=admision_id,
+        examen_id=examen_id,
+        datos_tecnicos=datos_tecnicos,
+        conclusiones_examen=conclusiones,
+        observaciones=observaciones,
+    )
+    table = ResultadoClinico.__table__
+    merged = func.coalesce(table.c.datos_tecnicos, cast({}, JSONB)).op("||")(stmt.excluded.datos_tecnicos)
+    set_ = {
+        "datos_tecnicos": merged,
+        "conclusiones_examen": conclusiones_update if conclusiones_update is not None else stmt.excluded.conclusiones_examen,
+    }
+    if observaciones is not None:
+        set_["observaciones"] = func.coalesce(table.c.observaciones, stmt.excluded.observaciones) \
+            if preserve_observaciones else stmt.excluded.observaciones
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ResultadoClinico.admision_id, ResultadoClinico.examen_id],
+        set_=set_,
+    ).returning(ResultadoClinico.id)
+    return db.execute(stmt).scalar_one()
+
+# --- CONSULTAS POR VALORES TÉCNICOS ---
+# Condiciones como tuplas (clave, operador, valor): ("imc", ">", 30), ("od_4000", ">=", 40),
+# ("vision_colores", "=", "Anormal"). Los rangos numéricos usan la misma expresión que los
+# índices de models.RESULT_INDEXED_KEYS; la igualdad usa contención (@>) sobre el índice GIN.
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "=": operator.eq,
+    "!=": operator.ne,
+}
+
+Condition = Tuple[str, str, Any]
+
+def technical_value(key: str):
+    """Valor numérico de una clave de datos_tecnicos (NULL si falta o no es número)"""
+    return func.f_jsonb_num(ResultadoClinico.datos_tecnicos, key)
+
+def technical_condition(key: str, op: str, value: Any):
+    if op not in OPERATORS:
+        raise ValueError(f"Operador no soportado: {op}")
+    if op == "=":
+        # Igualdad exacta (números o textos): datos_tecnicos @> {"key": value}
+        return ResultadoClinico.datos_tecnicos.contains({key: value})
+    if isinstance(value, str):
+        raise ValueError(f"La comparación '{op}' requiere un valor numérico ({key})")
+    # El predicado "? key" permite usar los índices parciales de las claves calientes
+    return and_(
+        ResultadoClinico.datos_tecnicos.has_key(key),
+        OPERATORS[op](technical_value(key), value)
+    )
+
+def _where(conditions: Sequence[Condition], match_all: bool):
+    clauses = [technical_condition(*c) for c in conditions]
+    if not clauses:
+        return None
+    return and_(*clauses) if match_all else or_(*clauses)
+
+def filter_results(
+    db: Session,
+    conditions: Sequence[Condition],
+    match_all: bool = True,
+    examen_ids: Optional[Iterable[int]] = None,
+):
+    """Query de resultados que cumplen todas (o alguna) de las condiciones; el llamador pagina / cuenta"""
+    query = db.query(ResultadoClinico)
+    where = _where(conditions, match_all)
+    if where is not None:
+        query = query.filter(where)
+    if examen_ids is not None:
+        query = query.filter(ResultadoClinico.examen_id.in_(list(examen_ids)))
+    return query
+
+def count_results(db: Session, conditions: Sequence[Condition], match_all: bool = True) -> int:
+    query = db.query(func.count(ResultadoClinico.id))
+    where = _where(conditions, match_all)
+    if where is not None:
+        query = query.filter(where)
+    return query.scalar()
+
+# --- SIGNOS VITALES TIPADOS ---
+
+def _vital_value(value: Any):
+    # Mismo criterio que f_jsonb_num: solo números (bool no cuenta)
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+def upsert_vitals(db: Session, admision_id: int, vitals: Dict[str, Any], user_id=None):
+    """Copia tipada de los signos vitales de Triaje. No hace commit (misma transacción que el resultado)."""
+    values = {c: _vital_value(vitals.get(c)) for c in VITALS_COLUMNS}
+    stmt = pg_insert(SignosVitales).values(
+        admision_id=admision_id,
+        fecha_registro=datetime.now(),
+        registrado_por_id=user_id,
+        **values
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SignosVitales.admision_id],
+        # Una clave ausente en el formulario no borra el valor ya registrado (igual que la mezcla JSONB)
+        set_={
+            "fecha_registro": stmt.excluded.fecha_registro,
+            "registrado_por_id": stmt.excluded.registrado_por_id,
+            **{c: func.coalesce(getattr(stmt.excluded, c), getattr(SignosVitales, c)) for c in VITALS_COLUMNS},
+        },
+    )
+    db.execute(stmt)
+
+def vitals_summary(db: Session, start: datetime, end: datetime) -> Dict[str, Any]:
+    """Estadísticas poblacionales del rango [start, end) en una sola consulta agregada"""
+    sv = SignosVitales
+    row = db.execute(select(
+        func.count().label("evaluados"),
+        func.avg(sv.imc).label("imc_promedio"),
+        func.percentile_cont(0.5).within_group(sv.imc).label("imc_mediana"),
+        func.count().filter(sv.imc >= 30).label("obesidad"),
+        func.count().filter(and_(sv.imc >= 25, sv.imc < 30)).label("sobrepeso"),
+        func.count().filter(or_(sv.pa_sistolica >= 140, sv.pa_diastolica >= 90)).label("hipertension"),
+        func.avg(sv.pa_sistolica).label("pas_promedio"),
+        func.avg(sv.pa_diastolica).label("pad_promedio"),
+        func.avg(sv.frecuencia_cardiaca).label("fc_promedio"),
+        func.count().filter(sv.saturacion < 95).label("saturacion_baja"),
+    ).where(sv.fecha_registro >= start, sv.fecha_registro < end)).one()
+    return dict(row._mapping)
+
+def vitals_columns(db: Session, start: datetime, end: datetime, columns: Sequence[str] = VITALS_COLUMNS) -> Dict[str, np.ndarray]:
+    """Columnas del rango como arreglos NumPy contiguos (float64, NaN donde falta el dato)"""
+    unknown = set(columns) - set(VITALS_COLUMNS)
+    if unknown:
+        raise ValueError(f"Columnas desconocidas: {sorted(unknown)}")
+    stmt = select(*[getattr(SignosVitales, c) for c in columns]).where(
+        SignosVitales.fecha_registro >= start, SignosVitales.fecha_registro < end
+    )
+    df = pd.DataFrame(db.execute(stmt).all(), columns=list(columns))
+    return {c: np.ascontiguousarray(df[c].to_numpy(dtype=np.float64, na_value=np.nan)) for c in columns}
+
+# --- EXÁMENES PENDIENTES DE LA HOJA DE RUTA ---
+# Lectura caliente de Evaluación Médica. Las sentencias se comparten entre la ruta
+# síncrona y la asíncrona (async_database.py).
+
+def active_admission_statement(patient_id: int):
+    return select(Admision.id).where(
+        Admision.paciente_id == patient_id,
+        Admision.estado_global == EstadoAdmision.EN_CIRCUITO.value
+    ).order_by(Admision.fecha_ingreso.desc()).limit(1)
+
+def pending_exams_statement(admission_id: int):
+    return select(HojaRutaExamenes, CatalogoExamenes.nombre).join(
+        CatalogoExamenes, HojaRutaExamenes.examen_id == CatalogoExamenes.id
+    ).where(
+        HojaRutaExamenes.admision_id == admission_id,
+        HojaRutaExamenes.estado != EstadoExamen.REALIZADO.value
+    )
+
+def query_pending_exams(db: Session, patient_id: int) -> Tuple[Optional[int], list]:
+    """(id de la admisión activa, filas (HojaRutaExamenes, nombre)); (None, []) si no hay admisión activa"""
+    admission_id = db.execute(active_admission_statement(patient_id)).scalar()
+    if admission_id is None:
+        return None, []
+    return admission_id, db.execute(pending_exams_statement(admission_id)).all()
+
+async def query_pending_exams_async(db: AsyncSession, patient_id: int) -> Tuple[Optional[int], list]:
+    admission_id = (await db.execute(active_admission_statement(patient_id))).scalar()
+    if admission_id is None:
+        return None, []
+    return admission_id, (await db.execute(pending_exams_statement(admission_id))).all()
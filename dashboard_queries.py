@@ -0,0 +1,286 @@
+import asyncio
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import select, func, and_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Any, Iterable, Iterator, List, NamedTuple, Optional
+from models import Admision, Empresa, HojaRutaExamenes, Paciente, AdmisionStatsHourly as Stats, AdmisionStatsEstado as EstadoStats
+from aggregate_cache import dashboard_cache, ADMISIONES, EXAMENES, EMPRESAS
+from database import get_read_session, release_session
+from config import settings
+import async_database
+
+# --- RANGOS DE FECHA ---
+# Se filtra con rangos semiabiertos [inicio, fin) sobre la columna cruda para que
+# Postgres pueda usar los índices B-tree (func.date / extract no son "sargables").
+
+def day_range(day: date):
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
+
+def month_range(day: date):
+    start = datetime.combine(day.replace(day=1), time.min)
+    next_month = (start + timedelta(days=32)).replace(day=1)
+    return start, next_month
+
+# --- CONSTRUCTORES DE CONSULTAS DEL DASHBOARD ---
+# Cada widget se expresa como un SELECT independiente: el panel los cachea, invalida y
+# carga por separado, y el reporte resumen los combina en una única sentencia.
+# Los conteos de admisiones se leen de los rollups: admision_stats_hourly (una fila
+# por empresa/hora/estado) para los rangos de fechas y admision_stats_estado (una fila
+# por estado) para los totales históricos. Ninguno crece con el historial de admisiones.
+
+def _total():
+    return func.coalesce(func.sum(Stats.total), 0)
+
+def kpis_statement(today: date):
+    """KPIs del día en una sola sentencia (agregados por subconsulta escalar)"""
+    start, end = day_range(today)
+    total_admisiones_hoy = select(_total()).where(
+        Stats.hora >= start,
+        Stats.hora < end
+    ).scalar_subquery()
+
+    atenciones_circuito = select(func.coalesce(func.sum(EstadoStats.total), 0)).where(
+        EstadoStats.estado == "En Circuito"
+    ).scalar_subquery()
+
+    total_empresas = select(func.count(Empresa.id)).scalar_subquery()
+
+    examenes_hoy = select(func.count(HojaRutaExamenes.id)).where(
+        and_(
+            HojaRutaExamenes.estado == "Realizado",
+            HojaRutaExamenes.fecha_realizado >= start,
+            HojaRutaExamenes.fecha_realizado < end
+        )
+    ).scalar_subquery()
+
+    return select(
+        total_admisiones_hoy.label("total_admisiones_hoy"),
+        atenciones_circuito.label("atenciones_circuito"),
+        total_empresas.label("total_empresas"),
+        examenes_hoy.label("examenes_hoy")
+    )
+
+def top_empresas_statement(today: date, limit: int = 5):
+    """Top empresas por admisiones en el mes en curso"""
+    start, end = month_range(today)
+    return select(
+        Empresa.razon_social.label("empresa"),
+        _total().label("admisiones")
+    ).join(Stats, Empresa.id == Stats.empresa_id).where(
+        Stats.hora >= start,
+        Stats.hora < end
+    ).group_by(Empresa.razon_social).order_by(_total().desc()).limit(limit)
+
+def estados_statement():
+    """Conteo de admisiones por estado global (contador histórico, una fila por estado)"""
+    return select(
+        EstadoStats.estado.label("estado"),
+        EstadoStats.total.label("total")
+    ).where(EstadoStats.total > 0)
+
+def flujo_statement(today: date):
+    """Admisiones del día agrupadas por hora"""
+    start, end = day_range(today)
+    hora = func.extract('hour', Stats.hora)
+    return select(
+        hora.label("hora"),
+        _total().label("total")
+    ).where(
+        Stats.hora >= start,
+        Stats.hora < end
+    ).group_by(hora)
+
+def ultimos_statement(limit: int = 10):
+    """Últimos ingresos con paciente y empresa (la hora se formatea en la BD)"""
+    return select(
+        (Paciente.nombres + " " + Paciente.apellidos).label("paciente"),
+        Empresa.razon_social.label("empresa"),
+        func.to_char(Admision.fecha_ingreso, 'HH24:MI').label("hora"),
+        Admision.fecha_ingreso.label("fecha_ingreso")
+    ).join(Admision, Paciente.id == Admision.paciente_id).join(
+        Empresa, Admision.empresa_id == Empresa.id
+    ).order_by(Admision.fecha_ingreso.desc()).limit(limit)
+
+# --- EJECUCIÓN POR WIDGET ---
+# Sentencia + conversión del resultado por widget: la comparten la ruta síncrona
+# (Session) y la asíncrona (AsyncSession), que solo difieren en cómo se ejecuta.
+
+def _parse_kpis(result) -> Dict[str, int]:
+    return {k: (v or 0) for k, v in result.one()._mapping.items()}
+
+def _parse_top_empresas(result) -> List[Dict[str, Any]]:
+    return [{"empresa": r.empresa, "admisiones": r.admisiones} for r in result]
+
+def _parse_estados(result) -> List[Dict[str, Any]]:
+    return [{"estado": r.estado, "total": r.total} for r in result]
+
+def _parse_flujo(result) -> Dict[int, int]:
+    return {int(r.hora): r.total for r in result}
+
+def _parse_ultimos(result) -> List[Dict[str, Any]]:
+    return [{"paciente": r.paciente, "empresa": r.empresa, "hora": r.hora} for r in result]
+
+WIDGET_QUERIES = {
+    "kpis": (kpis_statement, _parse_kpis),
+    "top_empresas": (top_empresas_statement, _parse_top_empresas),
+    "estados": (lambda today: estados_statement(), _parse_estados),
+    "flujo": (flujo_statement, _parse_flujo),
+    "ultimos": (lambda today: ultimos_statement(), _parse_ultimos),
+}
+
+def query_widget(db: Session, widget: str, today: date = None) -> Any:
+    statement, parse = WIDGET_QUERIES[widget]
+    return parse(db.execute(statement(today or date.today())))
+
+async def query_widget_async(db: AsyncSession, widget: str, today: date = None) -> Any:
+    statement, parse = WIDGET_QUERIES[widget]
+    return parse(await db.execute(statement(today or date.today())))
+
+# --- CONSULTA CONSOLIDADA ---
+# Los mismos SELECT por widget combinados en una única sentencia (JSON por widget).
+
+def _json_rows(stmt, order_by=None):
+    """Empaqueta las filas de un SELECT como un arreglo JSON (subconsulta escalar)"""
+    sub = stmt.subquery()
+    rows = sub.table_valued()
+    agg = func.json_agg(aggregate_order_by(rows, order_by(sub.c))) if order_by is not None else func.json_agg(rows)
+    return select(func.coalesce(agg, func.json_build_array())).select_from(sub).scalar_subquery()
+
+def dashboard_statement(today: date):
+    """Todas las métricas del dashboard en una única sentencia"""
+    return kpis_statement(today).add_columns(
+        _json_rows(top_empresas_statement(today), lambda c: c.admisiones.desc()).label("top_empresas"),
+        _json_rows(estados_statement()).label("estados"),
+        _json_rows(flujo_statement(today), lambda c: c.hora).label("flujo"),
+        _json_rows(ultimos_statement(), lambda c: c.fecha_ingreso.desc()).label("ultimos")
+    )
+
+def _parse_dashboard(row) -> Dict[str, Any]:
+    return {
+        "kpis": {
+            "total_admisiones_hoy": row.total_admisiones_hoy or 0,
+            "atenciones_circuito": row.atenciones_circuito or 0,
+            "total_empresas": row.total_empresas or 0,
+            "examenes_hoy": row.examenes_hoy or 0
+        },
+        "top_empresas": [{"empresa": r["empresa"], "admisiones": r["admisiones"]} for r in row.top_empresas],
+        "estados": [{"estado": r["estado"], "total": r["total"]} for r in row.estados],
+        "flujo": {int(r["hora"]): r["total"] for r in row.flujo},
+        "ultimos": [{"paciente": r["paciente"], "empresa": r["empresa"], "hora": r["hora"]} for r in row.ultimos]
+    }
+
+def query_dashboard(db: Session, today: date = None) -> Dict[str, Any]:
+    """
+    Ejecuta la consulta consolidada: una conexión del pool, una ida y vuelta. La usa el
+    reporte resumen (sin streaming); el panel carga por widget (ver stream_widgets).
+    """
+    return _parse_dashboard(db.execute(dashboard_statement(today or date.today())).one())
+
+# --- LECTURA CACHEADA ---
+# Cada widget depende de ciertas tablas; una escritura solo invalida los widgets afectados.
+# Las recargas leen de la réplica cuando está disponible (database.get_read_session).
+WIDGET_TAGS = {
+    "kpis": (ADMISIONES, EXAMENES, EMPRESAS),
+    "top_empresas": (ADMISIONES, EMPRESAS),
+    "estados": (ADMISIONES,),
+    "flujo": (ADMISIONES,),
+    "ultimos": (ADMISIONES,)
+}
+
+def _widget_key(widget: str, today: date) -> str:
+    # Las métricas "de hoy" cambian de clave al cambiar el día
+    return f"dashboard:{widget}:{today.isoformat()}"
+
+async def _read_widget_async(widget: str, today: date) -> Any:
+    async with async_database.async_session() as db:
+        return await query_widget_async(db, widget, today)
+
+def _read_widget(widget: str, today: date) -> Any:
+    if settings.ASYNC_DB_ENABLED:
+        # La consulta corre en el loop de async_database; este hilo solo espera el resultado
+        return async_database.run_sync(_read_widget_async(widget, today))
+    db = get_read_session()
+    try:
+        return query_widget(db, widget, today)
+    except Exception:
+        # Puede ser la sesión del rerun: sin rollback los widgets siguientes fallarían también
+        db.rollback()
+        raise
+    finally:
+        release_session(db)
+
+def cached_widget(widget: str, today: date = None) -> Any:
+    """
+    Un widget individual servido desde la caché del proceso. Si falta, una sola sesión
+    lo recalcula (get_or_load) y las demás esperan su resultado, con cualquiera de los motores.
+    """
+    today = today or date.today()
+    return dashboard_cache.get_or_load(
+        _widget_key(widget, today), lambda: _read_widget(widget, today), WIDGET_TAGS[widget]
+    )
+
+# --- CARGA CONCURRENTE POR WIDGET ---
+# Los widgets que no están en caché se consultan en paralelo, cada uno con su propia
+# conexión del engine compartido, y se entregan en el orden en que terminan. El pool es
+# acotado (settings.DASHBOARD_POOL_WORKERS, por defecto min(4, DB_POOL_SIZE // 2)) para no
+# agotar las conexiones que necesitan los reruns de las demás páginas.
+# La ganancia depende de cuánto pese la espera de la BD frente al trabajo de Python (que el
+# GIL serializa): con la BD local y rollups de ~1-2 ms por widget apenas hay diferencia
+# (ver `utils/benchmark.py dashboard`). DASHBOARD_WORKERS=0 carga en secuencia con la
+# sesión del rerun (un solo checkout).
+
+class WidgetResult(NamedTuple):
+    widget: str
+    value: Any
+    elapsed_ms: float
+    cached: bool
+    error: Optional[str] = None
+
+_widget_pool = (
+    ThreadPoolExecutor(max_workers=settings.DASHBOARD_POOL_WORKERS, thread_name_prefix="dashboard-widget")
+    if settings.DASHBOARD_POOL_WORKERS > 0 else None
+)
+
+def _load_widget(widget: str, today: date) -> WidgetResult:
+    # En un hilo del pool no hay unidad de trabajo: get_read_session() abre una sesión propia
+    start = perf_counter()
+    try:
+        value = cached_widget(widget, today)
+    except Exception as e:
+        return WidgetResult(widget, None, (perf_counter() - start) * 1000, False, str(e))
+    return WidgetResult(widget, value, (perf_counter() - start) * 1000, False)
+
+async def load_widgets_async(widgets: Iterable[str] = tuple(WIDGET_TAGS), today: date = None) -> Dict[str, Any]:
+    """Todos los widgets pedidos, consultados a la vez (sin caché); para la futura API"""
+    today = today or date.today()
+
+    async def load(widget):
+        return widget, await _read_widget_async(widget, today)
+
+    return dict(await asyncio.gather(*(load(w) for w in widgets)))
+
+def stream_widgets(widgets: Iterable[str] = tuple(WIDGET_TAGS), parallel: bool = True) -> Iterator[WidgetResult]:
+    """
+    Entrega cada widget apenas está listo: primero los vigentes en caché, luego los
+    recalculados (ver cached_widget) en el orden en que terminan. Un error no detiene a los demás.
+    parallel=False (o un pool deshabilitado) los recalcula en secuencia en el hilo que llama.
+    """
+    today = date.today()
+    missing = []
+    for widget in widgets:
+        found, value = dashboard_cache.get(_widget_key(widget, today))
+        if found:
+            yield WidgetResult(widget, value, 0.0, True)
+        else:
+            missing.append(widget)
+    if not parallel or _widget_pool is None or len(missing) < 2:
+        for widget in missing:
+            yield _load_widget(widget, today)
+        return
+    for future in as_completed([_widget_pool.submit(_load_widget, w, today) for w in missing]):
+        yield future.result()
@@ -1,12 +1,118 @@
-from sqlalchemy import create_engine
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+import logging
+from typing import Optional
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import QueuePool
 from config import settings
 
-# 1. Crear el motor de conexión
+logger = logging.getLogger(__name__)
+
+# 1. Métricas del pool de conexiones
+# Contadores del proceso actual (cada worker de Streamlit tiene su propio pool)
+class PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checkins = 0
+            self.connects = 0
+            self.overflow_checkouts = 0
+            self.timeouts = 0
+            self.invalidations = 0
+            self.pre_ping_failures = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+            self.since = time.time()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self, pool) -> dict:
+        """Contadores acumulados + estado instantáneo del pool"""
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "desde": self.since,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "conexiones_nuevas": self.connects,
+                "checkouts_en_overflow": self.overflow_checkouts,
+                "timeouts": self.timeouts,
+                "invalidaciones": self.invalidations,
+                "fallos_pre_ping": self.pre_ping_failures,
+                "espera_promedio_ms": (self.wait_total / self.checkouts * 1000) if self.checkouts else 0.0,
+                "espera_max_ms": self.wait_max * 1000,
+                "pool_size": pool.size(),
+                "en_uso": pool.checkedout(),
+                "libres": pool.checkedin(),
+                "overflow_actual": pool.overflow(),
+            }
+
+pool_metrics = PoolMetrics()
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide cuánto espera cada checkout por una conexión libre"""
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.incr("timeouts")
+            raise
+        finally:
+            pool_metrics.record_wait(time.perf_counter() - start)
+
+# 2. Crear el motor de conexión
 # pool_pre_ping=True ayuda a reconectar si la BD cierra la conexión por inactividad
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+engine = create_engine(
+    settings.DATABASE_URL,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING
+)
+
+@event.listens_for(engine.pool, "checkout")
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_metrics.incr("checkouts")
+    if engine.pool.overflow() > 0:
+        pool_metrics.incr("overflow_checkouts")
+
+@event.listens_for(engine.pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    pool_metrics.incr("checkins")
+
+@event.listens_for(engine.pool, "connect")
+def _on_connect(dbapi_connection, connection_record):
+    pool_metrics.incr("connects")
 
-# 2. Crear la fábrica de sesiones
+@event.listens_for(engine.pool, "invalidate")
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    pool_metrics.incr("invalidations")
+
+@event.listens_for(engine, "handle_error")
+def _on_error(context):
+    if context.is_pre_ping:
+        pool_metrics.incr("pre_ping_failures")
+
+# 3. Crear la fábrica de sesiones
 # IMPORTANTE: expire_on_commit=False evita el error "Instance is not bound to a Session"
 # Esto permite seguir usando los objetos (leer sus IDs) después de hacer db.commit()
 SessionLocal = sessionmaker(
@@ -16,13 +122,246 @@ SessionLocal = sessionmaker(
     expire_on_commit=False 
 )
 
-# 3. DEFINIR LA BASE ÚNICA
+# 4. DEFINIR LA BASE ÚNICA
 Base = declarative_base()
 
-# 4. Función para obtener sesión (Dependency Injection)
+# 5. Función para obtener sesión (Dependency Injection)
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 6. Unidad de trabajo por rerun de Streamlit
+# Cada rerun de una página abre UNA conexión del pool y todos los helpers la comparten.
+# La sesión vive en una ContextVar: es propia del hilo del script (las sesiones no son thread-safe).
+_unit_of_work: contextvars.ContextVar = contextvars.ContextVar("unit_of_work", default=None)
+
+@contextmanager
+def unit_of_work():
+    """
+    Abre la sesión compartida del rerun. La sesión queda ligada a una única conexión,
+    así los commit() de los helpers no la devuelven al pool: un checkout por rerun.
+    Si ya hay una unidad de trabajo activa se reutiliza.
+    """
+    current = _unit_of_work.get()
+    if current is not None:
+        yield current
+        return
+
+    connection = engine.connect()
+    db = SessionLocal(bind=connection)
+    token = _unit_of_work.set(db)
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        # st.rerun() / st.stop() no heredan de Exception: lo ya confirmado por los helpers se conserva
+        _unit_of_work.reset(token)
+        db.close()
+        connection.close()
+
+def get_session():
+    """
+    Sesión para un helper: la del rerun si hay una unidad de trabajo activa,
+    o una sesión propia si se llama fuera de ella. Liberar con release_session().
+    """
+    current = _unit_of_work.get()
+    return current if current is not None else SessionLocal()
+
+def release_session(db):
+    """Cierra la sesión solo si no pertenece a la unidad de trabajo del rerun"""
+    if db is not _unit_of_work.get():
+        db.close()
+
+def get_pool_metrics() -> dict:
+    return pool_metrics.snapshot(engine.pool)
+
+# 7. Réplica de lectura (opcional)
+# Las lecturas que toleran unos segundos de atraso (dashboard, búsquedas, listados) se piden
+# con read_session() / get_read_session() y van a REPLICA_DATABASE_URL (un standby con
+# streaming replication). Escrituras y lecturas del flujo clínico siguen en el primario.
+# - Read-your-writes: tras una escritura confirmada en este proceso se toma el LSN del
+#   primario; la réplica solo vuelve a usarse cuando ya reprodujo el WAL hasta ese punto.
+# - Retraso: si la réplica no responde, no es un standby o se atrasa más de
+#   REPLICA_MAX_LAG_SECONDS, las lecturas vuelven al primario hasta la siguiente verificación.
+
+replica_engine = create_engine(
+    settings.REPLICA_DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING
+) if settings.REPLICA_DATABASE_URL else None
+
+ReplicaSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    bind=replica_engine,
+    expire_on_commit=False
+) if replica_engine is not None else None
+
+# Retraso 0 si ya reprodujo todo lo recibido (un primario sin escrituras no genera "atraso")
+REPLICA_STATUS_SQL = text("""
+    SELECT pg_is_in_recovery() AS standby,
+           CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END AS retraso
+""")
+PRIMARY_LSN_SQL = text("SELECT pg_current_wal_lsn()::text")
+REPLICA_CAUGHT_UP_SQL = text("SELECT pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)")
+
+class ReplicaRouter:
+    def __init__(self, replica, max_lag: float, check_interval: float):
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._fence_lock = threading.Lock()
+        self._checked_at = float("-inf")
+        self._healthy = False
+        self._lag: Optional[float] = None
+        self._reason = "sin réplica configurada" if replica is None else "sin verificar"
+        self._pending_write = False
+        self._fence: Optional[str] = None  # LSN del primario que la réplica debe haber reproducido
+        self.replica_reads = 0
+        self.primary_reads = 0
+
+    def mark_write(self):
+        """Llamado tras cada commit con escrituras (ver eventos de SessionLocal)"""
+        with self._lock:
+            self._pending_write = True
+
+    def _set_status(self, healthy: bool, reason: str, lag: Optional[float] = None):
+        with self._lock:
+            if self._healthy and not healthy:
+                logger.warning(f"Réplica deshabilitada: {reason}")
+            self._healthy, self._reason, self._lag = healthy, reason, lag
+
+    def _refresh_status(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now  # Un solo hilo verifica; el resto usa el estado anterior
+        try:
+            with self.replica.connect() as conn:
+                row = conn.execute(REPLICA_STATUS_SQL).one()
+        except Exception as e:
+            self._set_status(False, f"sin conexión ({e.__class__.__name__})")
+            return
+        lag = float(row.retraso or 0)
+        if not row.standby:
+            self._set_status(False, "el servidor no es un standby (pg_is_in_recovery = false)")
+        elif lag > self.max_lag:
+            self._set_status(False, f"retraso de {lag:.1f} s", lag)
+        else:
+            self._set_status(True, "en uso", lag)
+
+    def _caught_up(self) -> bool:
+        # Serializado: el fence publicado siempre cubre todas las escrituras ya marcadas
+        with self._fence_lock:
+            with self._lock:
+                pending, self._pending_write = self._pending_write, False
+            if pending:
+                db = get_session()
+                try:
+                    fence = db.execute(PRIMARY_LSN_SQL).scalar()
+                finally:
+                    release_session(db)
+                with self._lock:
+                    self._fence = fence
+            with self._lock:
+                fence = self._fence
+        if fence is None:
+            return True
+        with self.replica.connect() as conn:
+            caught_up = bool(conn.execute(REPLICA_CAUGHT_UP_SQL, {"lsn": fence}).scalar())
+        if caught_up:
+            with self._lock:
+                if self._fence == fence:
+                    self._fence = None
+        return caught_up
+
+    def use_replica(self) -> bool:
+        if self.replica is None:
+            return False
+        self._refresh_status()
+        with self._lock:
+            healthy = self._healthy
+        if not healthy:
+            return False
+        try:
+            return self._caught_up()
+        except Exception as e:
+            self._set_status(False, f"error verificando el LSN ({e.__class__.__name__})")
+            return False
+
+    def count(self, replica: bool):
+        with self._lock:
+            if replica:
+                self.replica_reads += 1
+            else:
+                self.primary_reads += 1
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "configurada": self.replica is not None,
+                "en_uso": self._healthy,
+                "estado": self._reason,
+                "retraso_s": self._lag,
+                "lecturas_replica": self.replica_reads,
+                "lecturas_primario": self.primary_reads,
+            }
+
+replica_router = ReplicaRouter(replica_engine, settings.REPLICA_MAX_LAG_SECONDS, settings.REPLICA_CHECK_INTERVAL)
+
+# Una sesión "escribió" si hizo flush de objetos o ejecutó INSERT / UPDATE / DELETE
+@event.listens_for(SessionLocal, "after_flush")
+def _on_flush(session, flush_context):
+    session.info["escribio"] = True
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _on_execute(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info["escribio"] = True
+
+@event.listens_for(SessionLocal, "after_commit")
+def _on_commit(session):
+    if session.info.pop("escribio", False):
+        replica_router.mark_write()
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _on_rollback(session):
+    session.info.pop("escribio", None)
+
+def get_read_session():
+    """
+    Sesión para lecturas que toleran la réplica. Si no corresponde usarla devuelve
+    la misma sesión que get_session(). Liberar con release_session().
+    """
+    if replica_router.use_replica():
+        replica_router.count(True)
+        return ReplicaSessionLocal()
+    replica_router.count(False)
+    return get_session()
+
+@contextmanager
+def read_session():
+    db = get_read_session()
+    try:
+        yield db
+    finally:
+        release_session(db)
+
+def get_replica_status() -> dict:
+    status = replica_router.status()
+    if replica_engine is not None:
+        status["pool_en_uso"] = replica_engine.pool.checkedout()
+    return status
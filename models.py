@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Boolean, Text, Float, UUID, JSON, ARRAY, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, Date, DateTime, Boolean, Text, Float, UUID, ARRAY, Enum, Index, DDL, event, text
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import JSONB, REAL
+from sqlalchemy.types import SmallInteger
 from sqlalchemy.sql import func
 from datetime import datetime
 import enum
@@ -23,6 +25,9 @@ class RolUsuario(str, enum.Enum):
     ENFERMERIA = "enfermeria"
     AUDITOR = "auditor"
 
+class RolExamen(str, enum.Enum):
+    TRIAJE = "triaje"  # Examen de la hoja de ruta donde Triaje registra los signos vitales
+
 class AptitudStatus(str, enum.Enum):
     APTO = "APTO"
     APTO_RESTRICCIONES = "APTO CON RESTRICCIONES"
@@ -32,6 +37,13 @@ class AptitudStatus(str, enum.Enum):
 
 class CatalogoExamenes(Base):
     __tablename__ = 'catalogo_examenes'
+    __table_args__ = (
+        # Faceta por categoría / estado y paginación por clave (nombre, id) dentro de ella
+        Index('ix_catalogo_examenes_categoria_activo', 'categoria', 'activo', 'nombre', 'id'),
+        Index('ix_catalogo_examenes_nombre_id', 'nombre', 'id'),
+        # Búsqueda por subcadena del nombre, sin distinguir tildes ni mayúsculas
+        Index('ix_catalogo_examenes_nombre_trgm', text('f_unaccent(lower(nombre)) gin_trgm_ops'), postgresql_using='gin'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     codigo_interno = Column(String(20), unique=True)
@@ -46,6 +58,10 @@ class CatalogoExamenes(Base):
 
 class Empresa(Base):
     __tablename__ = 'empresas'
+    __table_args__ = (
+        # Paginación por clave del listado de Configuración
+        Index('ix_empresas_razon_social_id', 'razon_social', 'id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     ruc = Column(String(11), unique=True, nullable=False)
@@ -86,6 +102,10 @@ class ProtocoloDetalle(Base):
 
 class Usuario(Base):
     __tablename__ = 'usuarios'
+    __table_args__ = (
+        # Directorio de Configuración: filtros por rol / estado y paginación por email
+        Index('ix_usuarios_rol_activo_email', 'rol', 'activo', 'email'),
+    )
     
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=func.gen_random_uuid())
     email = Column(String(255), unique=True, nullable=False)
@@ -96,11 +116,21 @@ class Usuario(Base):
     especialidad = Column(String(100))
     activo = Column(Boolean, default=True)
     hashed_password = Column(String(128), nullable=True) 
+    # Se incrementa al cerrar sesión: invalida los tokens de sesión emitidos antes
+    token_version = Column(Integer, nullable=False, default=0, server_default=text("0"))
     
     certificados = relationship("CertificadoAptitud", back_populates="medico")
 
 class Paciente(Base):
     __tablename__ = 'pacientes'
+    __table_args__ = (
+        # Búsqueda por subcadena (LIKE '%term%') sin distinguir tildes ni mayúsculas: ver patient_search.py
+        Index('ix_pacientes_numero_documento_trgm', text('lower(numero_documento) gin_trgm_ops'), postgresql_using='gin'),
+        Index('ix_pacientes_nombres_trgm', text('f_unaccent(lower(nombres)) gin_trgm_ops'), postgresql_using='gin'),
+        Index('ix_pacientes_apellidos_trgm', text('f_unaccent(lower(apellidos)) gin_trgm_ops'), postgresql_using='gin'),
+        # Sincronización incremental del índice de documentos en memoria (DocumentPrefixIndex.refresh)
+        Index('ix_pacientes_created_at', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     tipo_documento = Column(String(20), default='DNI')
@@ -124,6 +154,13 @@ class Paciente(Base):
 
 class Admision(Base):
     __tablename__ = 'admisiones'
+    __table_args__ = (
+        # Filtros del dashboard: rangos de fecha y conteos por estado
+        Index('ix_admisiones_fecha_ingreso', 'fecha_ingreso'),
+        Index('ix_admisiones_estado_global_fecha_ingreso', 'estado_global', 'fecha_ingreso'),
+        # Admisión activa de un paciente (Triaje / Evaluación)
+        Index('ix_admisiones_paciente_id_estado_global', 'paciente_id', 'estado_global'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     paciente_id = Column(Integer, ForeignKey('pacientes.id'))
@@ -144,6 +181,10 @@ class Admision(Base):
 
 class HojaRutaExamenes(Base):
     __tablename__ = 'hoja_ruta_examenes'
+    __table_args__ = (
+        Index('ix_hoja_ruta_examenes_estado_fecha_realizado', 'estado', 'fecha_realizado'),
+        Index('ix_hoja_ruta_examenes_admision_id_examen_id', 'admision_id', 'examen_id'),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     admision_id = Column(Integer, ForeignKey('admisiones.id'))
@@ -169,13 +210,34 @@ class AntecedenteOcupacional(Base):
     
     paciente = relationship("Paciente", back_populates="antecedentes")
 
+# Claves numéricas de datos_tecnicos (formularios de Triaje y Evaluación) con índice de expresión
+RESULT_INDEXED_KEYS = (
+    "imc", "pa_sistolica", "pa_diastolica",   # Triaje
+    "od_4000", "oi_4000",                     # Audiometría
+    "fev1_fvc",                               # Espirometría
+    "glucosa", "hemoglobina",                 # Laboratorio
+)
+
 class ResultadoClinico(Base):
     __tablename__ = 'resultados_clinicos'
+    __table_args__ = (
+        # Un resultado por examen de la admisión: destino del ON CONFLICT de clinical_results.upsert_result
+        Index('uq_resultados_clinicos_admision_examen', 'admision_id', 'examen_id', unique=True),
+        # Contención y jsonpath (datos_tecnicos @> '{"vision_colores": "Anormal"}')
+        Index('ix_resultados_clinicos_datos_tecnicos', 'datos_tecnicos',
+              postgresql_using='gin', postgresql_ops={'datos_tecnicos': 'jsonb_path_ops'}),
+        # Rangos sobre los valores numéricos más consultados (imc > 30, od_4000 > 40, ...)
+        *[
+            Index(f'ix_resultados_clinicos_{key}', text(f"f_jsonb_num(datos_tecnicos, '{key}')"),
+                  postgresql_where=text(f"datos_tecnicos ? '{key}'"))
+            for key in RESULT_INDEXED_KEYS
+        ],
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     admision_id = Column(Integer, ForeignKey('admisiones.id'))
     examen_id = Column(Integer, ForeignKey('catalogo_examenes.id'))
-    datos_tecnicos = Column(JSON)
+    datos_tecnicos = Column(JSONB)
     observaciones = Column(Text)
     archivos_adjuntos_url = Column(ARRAY(Text))
     conclusiones_examen = Column(String(255))
@@ -184,6 +246,49 @@ class ResultadoClinico(Base):
     admision = relationship("Admision", back_populates="resultados")
     examen = relationship("CatalogoExamenes", back_populates="resultados_clinicos")
 
+class SignosVitales(Base):
+    """
+    Signos vitales de Triaje en columnas tipadas (una fila por admisión), escritos en la
+    misma transacción que datos_tecnicos. Las estadísticas poblacionales se calculan
+    con agregados SQL o NumPy sin decodificar JSON fila por fila.
+    """
+    __tablename__ = 'signos_vitales'
+    __table_args__ = (
+        Index('ix_signos_vitales_fecha_registro', 'fecha_registro'),
+    )
+    
+    admision_id = Column(Integer, ForeignKey('admisiones.id', ondelete='CASCADE'), primary_key=True)
+    fecha_registro = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    registrado_por_id = Column(UUID(as_uuid=True), ForeignKey('usuarios.id'))
+    peso = Column(REAL)                       # kg
+    talla = Column(SmallInteger)              # cm
+    imc = Column(REAL)
+    temperatura = Column(REAL)                # °C
+    saturacion = Column(SmallInteger)         # %
+    pa_sistolica = Column(SmallInteger)       # mmHg
+    pa_diastolica = Column(SmallInteger)      # mmHg
+    frecuencia_cardiaca = Column(SmallInteger)
+    frecuencia_respiratoria = Column(SmallInteger)
+
+# Columnas de SignosVitales que se copian desde las claves homónimas de datos_tecnicos
+VITALS_COLUMNS = (
+    "peso", "talla", "imc", "temperatura", "saturacion",
+    "pa_sistolica", "pa_diastolica", "frecuencia_cardiaca", "frecuencia_respiratoria",
+)
+
+# Carga inicial desde los resultados de Triaje ya guardados (el más reciente por admisión)
+VITALS_BACKFILL = f"""
+INSERT INTO signos_vitales (admision_id, fecha_registro, {", ".join(VITALS_COLUMNS)})
+SELECT DISTINCT ON (r.admision_id)
+       r.admision_id, COALESCE(r.created_at, now()),
+       {", ".join(f"f_jsonb_num(r.datos_tecnicos, '{c}')" for c in VITALS_COLUMNS)}
+FROM resultados_clinicos r
+JOIN examen_roles er ON er.examen_id = r.examen_id AND er.rol = 'triaje'
+WHERE r.datos_tecnicos ? 'imc'
+ORDER BY r.admision_id, r.id DESC
+ON CONFLICT (admision_id) DO NOTHING
+"""
+
 class DiagnosticoAtencion(Base):
     __tablename__ = 'diagnosticos_atencion'
     
@@ -195,6 +300,30 @@ class DiagnosticoAtencion(Base):
     
     admision = relationship("Admision", back_populates="diagnosticos")
 
+class ExamenRol(Base):
+    """Exámenes del catálogo que cumplen un rol fijo en el circuito (ver RolExamen)"""
+    __tablename__ = 'examen_roles'
+    
+    rol = Column(String(30), primary_key=True)
+    examen_id = Column(Integer, ForeignKey('catalogo_examenes.id', ondelete='CASCADE'), primary_key=True)
+
+# Carga inicial: los exámenes que Triaje buscaba por nombre antes de existir el mapeo
+EXAM_ROLE_BACKFILL = """
+INSERT INTO examen_roles (rol, examen_id)
+SELECT 'triaje', id FROM catalogo_examenes
+WHERE nombre ILIKE ANY (ARRAY['%Triaje%', '%Medicina%', '%Musculo%'])
+ON CONFLICT DO NOTHING
+"""
+
+# Antes de crear el índice único: conserva el resultado más reciente de cada (admisión, examen)
+RESULT_DEDUPE = """
+DELETE FROM resultados_clinicos r
+USING resultados_clinicos newer
+WHERE newer.admision_id = r.admision_id
+  AND newer.examen_id = r.examen_id
+  AND newer.id > r.id
+"""
+
 class CertificadoAptitud(Base):
     __tablename__ = 'certificados_aptitud'
     
@@ -209,4 +338,119 @@ class CertificadoAptitud(Base):
     uuid_documento = Column(UUID(as_uuid=True), server_default=func.gen_random_uuid())
     
     admision = relationship("Admision", back_populates="certificados")
-    medico = relationship("Usuario", back_populates="certificados")
\ No newline at end of file
+    medico = relationship("Usuario", back_populates="certificados")
+
+# --- EXTENSIONES DE BÚSQUEDA ---
+# unaccent() no es IMMUTABLE y no puede usarse en un índice; f_unaccent la envuelve
+# fijando el diccionario. Requiere permisos para CREATE EXTENSION (pg_trgm, unaccent).
+SEARCH_EXTENSIONS = DDL("""
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text AS $$
+    SELECT public.unaccent('public.unaccent', $1)
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+""")
+
+# Debe existir antes de crear los índices de pacientes
+event.listen(Base.metadata, "before_create", SEARCH_EXTENSIONS)
+
+# --- FUNCIONES SOBRE DATOS TÉCNICOS (JSONB) ---
+# (datos_tecnicos->>'imc')::numeric falla con valores no numéricos ("", "20/20") y no puede
+# indexarse con seguridad. f_jsonb_num devuelve NULL en esos casos y es IMMUTABLE.
+JSONB_FUNCTIONS = DDL("""
+CREATE OR REPLACE FUNCTION f_jsonb_num(data jsonb, key text) RETURNS numeric AS $$
+    SELECT CASE WHEN jsonb_typeof(data -> key) = 'number' THEN (data ->> key)::numeric END
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+""")
+
+# Debe existir antes de crear los índices de expresión de resultados_clinicos
+event.listen(Base.metadata, "before_create", JSONB_FUNCTIONS)
+
+# --- ROLLUPS (DATOS DERIVADOS) ---
+
+class AdmisionStatsHourly(Base):
+    __tablename__ = 'admision_stats_hourly'
+    __table_args__ = (
+        Index('ix_admision_stats_hourly_hora', 'hora'),
+    )
+
+    # Conteo de admisiones por empresa / hora / estado, mantenido por trigger sobre admisiones.
+    # Sin FK: es data derivada y empresa_id = 0 representa admisiones sin empresa.
+    empresa_id = Column(Integer, primary_key=True)
+    hora = Column(DateTime(timezone=True), primary_key=True)
+    estado = Column(String(50), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+class AdmisionStatsEstado(Base):
+    __tablename__ = 'admision_stats_estado'
+
+    # Conteo histórico por estado (una fila por estado) para los widgets sin rango de fechas:
+    # su costo no crece con el historial. Lo mantiene el mismo trigger que el rollup horario.
+    estado = Column(String(50), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+
+# Trigger idempotente: cada INSERT / UPDATE / DELETE en admisiones ajusta su bucket horario
+# y el contador de su estado. Los buckets que quedan en 0 se eliminan.
+ADMISION_STATS_TRIGGER = DDL("""
+CREATE OR REPLACE FUNCTION admision_stats_hourly_sync() RETURNS trigger AS $$
+DECLARE
+    remaining integer;
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.fecha_ingreso IS NOT NULL THEN
+        UPDATE admision_stats_hourly SET total = total - 1
+        WHERE empresa_id = COALESCE(OLD.empresa_id, 0)
+          AND hora = date_trunc('hour', OLD.fecha_ingreso)
+          AND estado = COALESCE(OLD.estado_global, '')
+        RETURNING total INTO remaining;
+        IF remaining <= 0 THEN
+            DELETE FROM admision_stats_hourly
+            WHERE empresa_id = COALESCE(OLD.empresa_id, 0)
+              AND hora = date_trunc('hour', OLD.fecha_ingreso)
+              AND estado = COALESCE(OLD.estado_global, '')
+              AND total <= 0;
+        END IF;
+        UPDATE admision_stats_estado SET total = total - 1
+        WHERE estado = COALESCE(OLD.estado_global, '')
+        RETURNING total INTO remaining;
+        IF remaining <= 0 THEN
+            DELETE FROM admision_stats_estado WHERE estado = COALESCE(OLD.estado_global, '') AND total <= 0;
+        END IF;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.fecha_ingreso IS NOT NULL THEN
+        INSERT INTO admision_stats_hourly (empresa_id, hora, estado, total)
+        VALUES (COALESCE(NEW.empresa_id, 0), date_trunc('hour', NEW.fecha_ingreso), COALESCE(NEW.estado_global, ''), 1)
+        ON CONFLICT (empresa_id, hora, estado) DO UPDATE SET total = admision_stats_hourly.total + 1;
+        INSERT INTO admision_stats_estado (estado, total)
+        VALUES (COALESCE(NEW.estado_global, ''), 1)
+        ON CONFLICT (estado) DO UPDATE SET total = admision_stats_estado.total + 1;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_admision_stats_hourly ON admisiones;
+CREATE TRIGGER trg_admision_stats_hourly
+    AFTER INSERT OR DELETE OR UPDATE OF empresa_id, fecha_ingreso, estado_global ON admisiones
+    FOR EACH ROW EXECUTE FUNCTION admision_stats_hourly_sync();
+""")
+
+# Reconstrucción completa del rollup a partir de admisiones (bloquea escrituras mientras corre)
+ADMISION_STATS_BACKFILL = [
+    "LOCK TABLE admisiones IN SHARE MODE",
+    "DELETE FROM admision_stats_hourly",
+    "DELETE FROM admision_stats_estado",
+    """
+    INSERT INTO admision_stats_hourly (empresa_id, hora, estado, total)
+    SELECT COALESCE(empresa_id, 0), date_trunc('hour', fecha_ingreso), COALESCE(estado_global, ''), count(*)
+    FROM admisiones
+    WHERE fecha_ingreso IS NOT NULL
+    GROUP BY 1, 2, 3
+    """,
+    """
+    INSERT INTO admision_stats_estado (estado, total)
+    SELECT estado, sum(total) FROM admision_stats_hourly GROUP BY estado
+    """,
+]
+
+# El trigger se instala al crear el esquema desde cero (create_all)
+event.listen(Base.metadata, "after_create", ADMISION_STATS_TRIGGER)
@@ -1,10 +1,18 @@
 import streamlit as st
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
-from models import Paciente, Empresa, Protocolo, Admision, HojaRutaExamenes, ProtocoloDetalle, CatalogoExamenes
-from database import get_db, SessionLocal
+from models import Paciente, Admision, HojaRutaExamenes, CatalogoExamenes
+from database import get_db, get_session, get_read_session, release_session, unit_of_work
+from aggregate_cache import dashboard_cache, ADMISIONES
+from config import settings
+import async_database
+from session_auth import restore_session
+import patient_search
+import admission_intake
+from catalog_cache import catalog_cache
 from datetime import datetime, date
 import logging
+import hashlib
 import time
 import pandas as pd
 
@@ -16,7 +24,7 @@ logger = logging.getLogger(__name__)
 
 def get_recent_patients_db():
     """Obtiene los últimos 20 pacientes registrados"""
-    db = SessionLocal()
+    db = get_session()
     try:
         patients = db.query(Paciente).order_by(desc(Paciente.id)).limit(20).all()
         return patients
@@ -24,46 +32,51 @@ def get_recent_patients_db():
         logger.error(f"Error fetching recent patients: {e}")
         return []
     finally:
-        db.close()
+        release_session(db)
+
+async def _search_patients_async(value, fields):
+    async with async_database.async_session() as db:
+        return await patient_search.search_patients_async(db, value, fields, limit=20)
 
 def search_patients_db(criterion, value):
-    """Busca pacientes según el criterio seleccionado"""
-    db = SessionLocal()
+    """Busca pacientes según el criterio seleccionado (réplica de lectura si está disponible)"""
+    fields = patient_search.CRITERIOS.get(criterion)
+    if settings.ASYNC_DB_ENABLED and fields and fields != (patient_search.DOCUMENTO,):
+        # La búsqueda por subcadena corre en el loop de async_database. El prefijo de DNI
+        # sigue en la sesión síncrona: se resuelve en el índice en memoria del proceso.
+        try:
+            return async_database.run_sync(_search_patients_async(value, fields))
+        except Exception as e:
+            logger.error(f"Error buscando pacientes: {e}")
+            return []
+    db = get_read_session()
     try:
-        query = db.query(Paciente)
-        if criterion == "DNI":
-            results = query.filter(Paciente.numero_documento.ilike(f"%{value}%")).limit(20).all()
-        elif criterion == "Nombres":
-            results = query.filter(Paciente.nombres.ilike(f"%{value}%")).limit(20).all()
-        elif criterion == "Apellidos":
-            results = query.filter(Paciente.apellidos.ilike(f"%{value}%")).limit(20).all()
-        else:
-            results = []
-        return results
+        return patient_search.search_by_criterion(db, criterion, value, limit=20)
     except Exception as e:
         logger.error(f"Error buscando pacientes: {e}")
         return []
     finally:
-        db.close()
+        release_session(db)
 
 def save_new_patient(data):
     """Guarda un nuevo paciente"""
-    db = SessionLocal()
+    db = get_session()
     try:
         new_patient = Paciente(**data)
         db.add(new_patient)
         db.commit()
         db.refresh(new_patient)
+        patient_search.document_index.add(new_patient.numero_documento, new_patient.id)
         return new_patient
     except Exception as e:
         db.rollback()
         raise e
     finally:
-        db.close()
+        release_session(db)
 
 def register_admission_db(patient_id, company_id, protocol_id, user_id):
     """Crea la admisión y la hoja de ruta"""
-    db = SessionLocal()
+    db = get_session()
     try:
         new_admission = Admision(
             paciente_id=patient_id,
@@ -76,25 +89,39 @@ def register_admission_db(patient_id, company_id, protocol_id, user_id):
         db.add(new_admission)
         db.flush()
         
-        protocol_details = db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == protocol_id).all()
+        # Exámenes del protocolo desde la caché del catálogo (sin consulta en estado estable)
+        exam_ids = catalog_cache.exam_ids(db, protocol_id)
         
-        count_exams = 0
-        for detail in protocol_details:
-            exam_route = HojaRutaExamenes(
-                admision_id=new_admission.id,
-                examen_id=detail.examen_id,
-                estado="Pendiente"
-            )
-            db.add(exam_route)
-            count_exams += 1
+        db.add_all([
+            HojaRutaExamenes(admision_id=new_admission.id, examen_id=exam_id, estado="Pendiente")
+            for exam_id in exam_ids
+        ])
+        count_exams = len(exam_ids)
             
         db.commit()
+        dashboard_cache.invalidate(ADMISIONES)
         return new_admission, count_exams
     except Exception as e:
         db.rollback()
         raise e
     finally:
-        db.close()
+        release_session(db)
+
+def register_campaign_db(rows, company_id, protocol_id, user_id):
+    """Registra una campaña corporativa completa en una sola transacción"""
+    db = get_session()
+    try:
+        summary = admission_intake.bulk_register_admissions(db, rows, company_id, protocol_id, user_id)
+        db.commit()
+        for documento, patient_id in summary["pacientes_nuevos"]:
+            patient_search.document_index.add(documento, patient_id)
+        dashboard_cache.invalidate(ADMISIONES)
+        return summary
+    except Exception as e:
+        db.rollback()
+        raise e
+    finally:
+        release_session(db)
 
 # --- UTILS ---
 
@@ -205,14 +232,14 @@ def tab_new_patient():
 
 def section_admission_process(patient):
     st.markdown("### 🏥 Crear Admisión")
-    db = SessionLocal()
+    db = get_session()
     try:
-        companies = db.query(Empresa).all()
-        if not companies:
+        catalog = catalog_cache.get(db)
+        if not catalog.empresas:
             st.error("No hay empresas registradas.")
             return
 
-        comp_dict = {f"{c.razon_social}": c.id for c in companies}
+        comp_dict = {razon_social: c_id for c_id, razon_social in catalog.empresas}
         
         col1, col2 = st.columns(2)
         with col1:
@@ -220,9 +247,9 @@ def section_admission_process(patient):
             c_id = comp_dict[c_label]
         
         with col2:
-            protos = db.query(Protocolo).filter(Protocolo.empresa_id == c_id).all()
+            protos = catalog.protocolos_por_empresa.get(c_id, ())
             if protos:
-                p_dict = {p.nombre_protocolo: p.id for p in protos}
+                p_dict = {p.nombre: p.id for p in protos}
                 p_label = st.selectbox("Protocolo", list(p_dict.keys()))
                 p_id = p_dict[p_label]
             else:
@@ -241,19 +268,92 @@ def section_admission_process(patient):
                 st.rerun() # CORRECCIÓN: st.rerun()
             
     finally:
-        db.close()
+        release_session(db)
+
+def tab_bulk_intake():
+    st.header("📦 Carga Masiva de Campaña")
+    st.caption(
+        "Planilla CSV o XLSX con una fila por trabajador. Columnas obligatorias: "
+        + ", ".join(admission_intake.REQUIRED_COLUMNS)
+        + ". Opcionales: " + ", ".join(admission_intake.OPTIONAL_COLUMNS) + "."
+    )
+
+    db = get_session()
+    try:
+        catalog = catalog_cache.get(db)
+        if not catalog.empresas:
+            st.error("No hay empresas registradas.")
+            return
+        comp_dict = {razon_social: c_id for c_id, razon_social in catalog.empresas}
+
+        col1, col2 = st.columns(2)
+        with col1:
+            c_label = st.selectbox("Empresa", list(comp_dict.keys()), key="bulk_company")
+            c_id = comp_dict[c_label]
+        with col2:
+            protos = catalog.protocolos_por_empresa.get(c_id, ())
+            if not protos:
+                st.warning("Esta empresa no tiene protocolos activos.")
+                return
+            p_dict = {p.nombre: p.id for p in protos}
+            p_label = st.selectbox("Protocolo", list(p_dict.keys()), key="bulk_protocol")
+            p_id = p_dict[p_label]
+    finally:
+        release_session(db)
+
+    uploaded = st.file_uploader("Planilla de trabajadores", type=["csv", "xlsx"])
+    if not uploaded:
+        return
+
+    try:
+        rows, errors = admission_intake.parse_campaign(admission_intake.read_campaign_file(uploaded))
+    except Exception as e:
+        st.error(f"No se pudo leer la planilla: {e}")
+        return
+
+    c1, c2 = st.columns(2)
+    c1.metric("Trabajadores válidos", len(rows))
+    c2.metric("Filas con errores", len(errors))
+    if errors:
+        with st.expander("⚠️ Ver errores"):
+            st.write("\n".join(f"- {e}" for e in errors))
+    if rows:
+        st.dataframe(pd.DataFrame(rows).head(50), use_container_width=True, hide_index=True)
+
+        # La planilla sigue cargada tras registrarla: un segundo clic duplicaría la campaña
+        upload_key = f"{hashlib.sha256(uploaded.getvalue()).hexdigest()}:{c_id}:{p_id}"
+        registered = st.session_state.setdefault("registered_campaigns", set())
+        if upload_key in registered:
+            st.info("Esta planilla ya fue registrada para la empresa y protocolo seleccionados.")
+            return
+
+        if st.button(f"🚀 Registrar {len(rows)} admisiones", type="primary", use_container_width=True):
+            user_id = st.session_state.user['id'] if st.session_state.user else None
+            try:
+                summary = register_campaign_db(rows, c_id, p_id, user_id)
+                registered.add(upload_key)
+                st.success(
+                    f"Campaña registrada: {summary['admisiones']} admisiones, {summary['examenes']} exámenes asignados "
+                    f"({len(summary['pacientes_nuevos'])} pacientes nuevos, {summary['pacientes_actualizados']} actualizados)."
+                )
+            except Exception as e:
+                st.error(f"Error al registrar la campaña (no se guardó ningún registro): {e}")
 
 def main():
     st.title("Gestión de Admisiones")
-    tab1, tab2 = st.tabs(["🔍 Directorio", "➕ Nuevo"])
+    tab1, tab2, tab3 = st.tabs(["🔍 Directorio", "➕ Nuevo", "📦 Carga Masiva"])
     
     with tab1:
         tab_search_patient()
     with tab2:
         tab_new_patient()
+    with tab3:
+        tab_bulk_intake()
         
     if st.session_state.get('current_patient'):
         section_admission_process(st.session_state.current_patient)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    restore_session()
+    with unit_of_work():
+        main()
\ No newline at end of file
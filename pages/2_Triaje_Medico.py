@@ -1,8 +1,15 @@
 import streamlit as st
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, or_
-from models import Paciente, Admision, HojaRutaExamenes, CatalogoExamenes, ResultadoClinico, Usuario, EstadoExamen
-from database import get_db, SessionLocal
+from sqlalchemy import desc, and_
+from models import Admision, HojaRutaExamenes, ResultadoClinico, Usuario, EstadoExamen, RolExamen
+from database import get_db, get_session, get_read_session, release_session, unit_of_work
+from aggregate_cache import dashboard_cache, EXAMENES
+from catalog_cache import catalog_cache
+from clinical_results import upsert_result, upsert_vitals
+from session_auth import restore_session
+from config import settings
+import async_database
+import patient_search
 from datetime import datetime
 import logging
 import time
@@ -14,24 +21,23 @@ logger = logging.getLogger(__name__)
 
 # --- FUNCIONES DE LÓGICA Y BD ---
 
+async def _search_patient_triage_async(search_term):
+    async with async_database.async_session() as db:
+        return await patient_search.search_patients_async(db, search_term, limit=10)
+
 def search_patient_triage(search_term):
-    """Busca pacientes por DNI o Nombre"""
-    db = SessionLocal()
+    """Busca pacientes por DNI o Nombre (réplica de lectura si está disponible)"""
+    if settings.ASYNC_DB_ENABLED:
+        return async_database.run_sync(_search_patient_triage_async(search_term))
+    db = get_read_session()
     try:
-        patients = db.query(Paciente).filter(
-            or_(
-                Paciente.numero_documento.ilike(f"%{search_term}%"),
-                Paciente.nombres.ilike(f"%{search_term}%"),
-                Paciente.apellidos.ilike(f"%{search_term}%")
-            )
-        ).limit(10).all()
-        return patients
+        return patient_search.search_patients(db, search_term, limit=10)
     finally:
-        db.close()
+        release_session(db)
 
 def get_patient_active_admission(patient_id):
     """Busca la admisión activa del paciente"""
-    db = SessionLocal()
+    db = get_session()
     try:
         admission = db.query(Admision).filter(
             Admision.paciente_id == patient_id,
@@ -39,80 +45,56 @@ def get_patient_active_admission(patient_id):
         ).order_by(desc(Admision.fecha_ingreso)).first()
         return admission
     finally:
-        db.close()
+        release_session(db)
+
+def get_triage_target(db: Session, admission_id):
+    """
+    Examen de la hoja de ruta que recibe los signos vitales y su resultado (si existe),
+    en una sola consulta. Se prefieren los exámenes con rol Triaje (mapeo cacheado);
+    si la admisión no tiene ninguno se usa su primer examen.
+    """
+    targets = catalog_cache.exam_ids_for_role(db, RolExamen.TRIAJE.value)
+    return db.query(HojaRutaExamenes, ResultadoClinico).outerjoin(
+        ResultadoClinico, and_(
+            ResultadoClinico.admision_id == HojaRutaExamenes.admision_id,
+            ResultadoClinico.examen_id == HojaRutaExamenes.examen_id
+        )
+    ).filter(
+        HojaRutaExamenes.admision_id == admission_id
+    ).order_by(
+        HojaRutaExamenes.examen_id.in_(targets).desc(), HojaRutaExamenes.id
+    ).first()
 
 def get_existing_triage_data(admission_id):
     """Recupera los datos de triaje guardados previamente para mostrarlos en el formulario"""
-    db = SessionLocal()
+    db = get_session()
     try:
-        # Buscar cualquier examen que parezca de triaje/medicina
-        target_exam = db.query(HojaRutaExamenes).join(CatalogoExamenes).filter(
-            HojaRutaExamenes.admision_id == admission_id,
-            (CatalogoExamenes.nombre.ilike("%Triaje%")) | 
-            (CatalogoExamenes.nombre.ilike("%Medicina%")) |
-            (CatalogoExamenes.nombre.ilike("%Musculo%"))
-        ).first()
-
-        # Fallback si no encuentra examen específico
-        if not target_exam:
-            target_exam = db.query(HojaRutaExamenes).filter(
-                HojaRutaExamenes.admision_id == admission_id
-            ).first()
-
-        if target_exam:
-            result = db.query(ResultadoClinico).filter(
-                ResultadoClinico.admision_id == admission_id,
-                ResultadoClinico.examen_id == target_exam.examen_id
-            ).first()
-            
-            if result and result.datos_tecnicos:
-                return result.datos_tecnicos
-                
+        target = get_triage_target(db, admission_id)
+        if target and target.ResultadoClinico and target.ResultadoClinico.datos_tecnicos:
+            return target.ResultadoClinico.datos_tecnicos
         return {} # Retorna vacío si no hay datos
     finally:
-        db.close()
+        release_session(db)
 
 def save_vital_signs(admission_id, vitals_data, user_id):
     """Guarda los signos vitales en la base de datos"""
-    db = SessionLocal()
+    db = get_session()
     try:
-        # 1. Buscar examen destino
-        target_exam = db.query(HojaRutaExamenes).join(CatalogoExamenes).filter(
-            HojaRutaExamenes.admision_id == admission_id,
-            (CatalogoExamenes.nombre.ilike("%Triaje%")) | 
-            (CatalogoExamenes.nombre.ilike("%Medicina%")) |
-            (CatalogoExamenes.nombre.ilike("%Musculo%"))
-        ).first()
-
-        if not target_exam:
-            target_exam = db.query(HojaRutaExamenes).filter(
-                HojaRutaExamenes.admision_id == admission_id
-            ).first()
-
-        if not target_exam:
+        # 1. Buscar examen destino (con su resultado previo, misma consulta)
+        target = get_triage_target(db, admission_id)
+        if not target:
             return False, "Error crítico: No hay exámenes asociados a esta admisión."
-
-        # 2. Crear o Actualizar Resultado
-        existing_result = db.query(ResultadoClinico).filter(
-            ResultadoClinico.admision_id == admission_id,
-            ResultadoClinico.examen_id == target_exam.examen_id
-        ).first()
-
-        if existing_result:
-            current_data = existing_result.datos_tecnicos or {}
-            current_data.update(vitals_data)
-            existing_result.datos_tecnicos = current_data
-            existing_result.conclusiones_examen = f"Triaje actualizado. IMC: {vitals_data.get('imc')}"
-        else:
-            new_result = ResultadoClinico(
-                admision_id=admission_id,
-                examen_id=target_exam.examen_id,
-                datos_tecnicos=vitals_data,
-                observaciones="Signos vitales registrados en módulo de Triaje.",
-                conclusiones_examen=f"Evaluado. IMC: {vitals_data.get('imc')}",
-                created_at=datetime.now()
-            )
-            db.add(new_result)
+        target_exam = target.HojaRutaExamenes
+
+        # 2. Crear o Actualizar Resultado (upsert con mezcla de datos en el servidor)
+        upsert_result(
+            db, admission_id, target_exam.examen_id, vitals_data,
+            conclusiones=f"Evaluado. IMC: {vitals_data.get('imc')}",
+            observaciones="Signos vitales registrados en módulo de Triaje.",
+            conclusiones_update=f"Triaje actualizado. IMC: {vitals_data.get('imc')}",
+            preserve_observaciones=True
+        )
+        upsert_vitals(db, admission_id, vitals_data, user_id)
 
         # 3. Marcar como Realizado
         target_exam.estado = EstadoExamen.REALIZADO
@@ -120,13 +102,14 @@ def save_vital_signs(admission_id, vitals_data, user_id):
         target_exam.medico_evaluador_id = user_id
 
         db.commit()
+        dashboard_cache.invalidate(EXAMENES)
         return True, "Signos vitales guardados correctamente."
 
     except Exception as e:
         db.rollback()
         return False, f"Error: {str(e)}"
     finally:
-        db.close()
+        release_session(db)
 
 # --- UI ---
 
@@ -223,6 +206,7 @@ def render_triage_dashboard(patient, admission):
                 st.error(msg)
 
 def main():
+    restore_session()
     if 'user' not in st.session_state or not st.session_state.authenticated:
         st.warning("🔒 Inicie sesión para acceder.")
         st.stop()
@@ -263,4 +247,5 @@ def main():
             st.info("Vaya al módulo **Admisiones** para registrarlo.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with unit_of_work():
+        main()
\ No newline at end of file
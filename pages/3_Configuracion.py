@@ -1,12 +1,23 @@
 import streamlit as st
 from sqlalchemy.orm import Session
 from sqlalchemy import or_, func
+from sqlalchemy.exc import IntegrityError
 from models import (
     Empresa, Protocolo, CatalogoExamenes, ProtocoloDetalle,
-    Usuario, RolUsuario
+    Usuario, RolUsuario, ExamenRol, RolExamen,
+    CertificadoAptitud, Admision, Paciente
 )
-from database import get_db, SessionLocal
-from datetime import datetime
+from database import get_db, pool_metrics, get_pool_metrics, get_replica_status, unit_of_work, read_session
+from config import settings
+from aggregate_cache import dashboard_cache, EMPRESAS, EXAMENES, USUARIOS
+from catalog_cache import catalog_cache
+from pagination import KeysetPager, keyset_page, estimated_count
+from patient_search import normalize
+from security import hash_password
+from session_auth import restore_session
+from certificates import write_certificates_zip
+from datetime import datetime, timedelta
+import tempfile
 import logging
 import time
 
@@ -14,14 +25,21 @@ import time
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+COMPANIES_PAGE_SIZE = 25
+EXAMS_PAGE_SIZE = 50
+EXAM_CATEGORIES = ["Laboratorio", "Imagenología", "Medicina", "Audiología", "Oftalmología", "Psicología", "Otros"]
+EXAM_STATUS = {"Todos": None, "Activos": True, "Inactivos": False}
+USERS_PAGE_SIZE = 50
+USER_ROLES = ["admin", "medico", "admision", "enfermeria"]
+
 # --- GESTIÓN DE EMPRESAS ---
 def manage_companies(db: Session):
     st.header("🏢 Empresas y Clientes")
     
-    # Métricas
-    total = db.query(Empresa).count()
+    # Métricas (estimación de las estadísticas de Postgres, cacheada)
+    total = estimated_count(db, Empresa, tags=(EMPRESAS,))
     col_metric, col_space = st.columns([1, 3])
-    col_metric.metric("Total de Empresas", total)
+    col_metric.metric("Total de Empresas (aprox.)", f"{total:,}")
     st.divider()
 
     # 1. CREAR NUEVA
@@ -49,65 +67,88 @@ def manage_companies(db: Session):
                         )
                         db.add(new_company)
                         db.commit()
+                        dashboard_cache.invalidate(EMPRESAS)
+                        catalog_cache.invalidate()
                         st.success(f"Empresa {razon_social} creada!")
                         time.sleep(1)
                         st.rerun()
                     except Exception as e:
+                        db.rollback()
                         st.error(f"Error: {e}")
 
-    # 2. LISTADO Y EDICIÓN
+    # 2. LISTADO Y EDICIÓN (paginado por clave, un solo formulario de edición)
     st.subheader("Listado de Empresas")
     search = st.text_input("🔍 Buscar empresa por nombre o RUC:", "")
     
-    query = db.query(Empresa)
-    if search:
-        query = query.filter(or_(
-            Empresa.razon_social.ilike(f"%{search}%"),
-            Empresa.ruc.ilike(f"%{search}%")
-        ))
-    
-    companies = query.order_by(Empresa.razon_social).all()
+    pager = KeysetPager("companies", reset_token=search)
+    with read_session() as read_db:
+        query = read_db.query(Empresa)
+        if search:
+            query = query.filter(or_(
+                Empresa.razon_social.ilike(f"%{search}%"),
+                Empresa.ruc.ilike(f"%{search}%")
+            ))
+        companies, has_next = keyset_page(query, (Empresa.razon_social, Empresa.id), pager.cursor, COMPANIES_PAGE_SIZE)
 
     if not companies:
         st.info("No se encontraron empresas.")
         return
 
-    for comp in companies:
-        with st.expander(f"🏢 {comp.razon_social} (RUC: {comp.ruc})"):
-            with st.form(f"edit_company_{comp.id}"):
-                c1, c2 = st.columns(2)
-                with c1:
-                    new_rs = st.text_input("Razón Social", comp.razon_social)
-                    new_ruc = st.text_input("RUC", comp.ruc)
-                with c2:
-                    new_rubro = st.text_input("Rubro", comp.rubro)
-                    new_mail = st.text_input("Email", comp.contacto_email)
-                
-                new_dir = st.text_area("Dirección", comp.direccion)
-                
-                col_save, col_del = st.columns([1, 1])
-                with col_save:
-                    if st.form_submit_button("Actualizar Datos", use_container_width=True):
-                        comp.razon_social = new_rs
-                        comp.ruc = new_ruc
-                        comp.rubro = new_rubro
-                        comp.contacto_email = new_mail
-                        comp.direccion = new_dir
-                        db.commit()
-                        st.success("Actualizado!")
-                        time.sleep(0.5)
-                        st.rerun()
-                
-                with col_del:
-                    st.markdown("") # Espaciador
+    st.dataframe(
+        [{"RUC": c.ruc, "Razón Social": c.razon_social, "Rubro": c.rubro, "Email": c.contacto_email} for c in companies],
+        use_container_width=True, hide_index=True
+    )
+    last = companies[-1]
+    pager.controls((last.razon_social, last.id), has_next)
+
+    # Solo se construye el formulario de la empresa seleccionada
+    options = {f"🏢 {c.razon_social} (RUC: {c.ruc})": c.id for c in companies}
+    selected = st.selectbox("✏️ Editar empresa:", ["—"] + list(options.keys()), key="edit_company_select")
+    if selected == "—":
+        return
+
+    comp = db.get(Empresa, options[selected])
+    with st.form(f"edit_company_{comp.id}"):
+        c1, c2 = st.columns(2)
+        with c1:
+            new_rs = st.text_input("Razón Social", comp.razon_social)
+            new_ruc = st.text_input("RUC", comp.ruc)
+        with c2:
+            new_rubro = st.text_input("Rubro", comp.rubro)
+            new_mail = st.text_input("Email", comp.contacto_email)
+        
+        new_dir = st.text_area("Dirección", comp.direccion)
+        
+        if st.form_submit_button("Actualizar Datos", use_container_width=True):
+            comp.razon_social = new_rs
+            comp.ruc = new_ruc
+            comp.rubro = new_rubro
+            comp.contacto_email = new_mail
+            comp.direccion = new_dir
+            db.commit()
+            dashboard_cache.invalidate(EMPRESAS)
+            catalog_cache.invalidate()
+            st.success("Actualizado!")
+            time.sleep(0.5)
+            st.rerun()
 
 # --- GESTIÓN DE EXÁMENES ---
+def get_exam_facets(db: Session):
+    """Conteo por categoría (GROUP BY resuelto con el índice (categoria, activo, ...)), cacheado hasta que cambie el catálogo"""
+    def load():
+        rows = db.query(
+            CatalogoExamenes.categoria, func.count(CatalogoExamenes.id)
+        ).group_by(CatalogoExamenes.categoria).all()
+        return {categoria or "Sin categoría": total for categoria, total in rows}
+
+    return dashboard_cache.get_or_load("examenes:facetas", load, tags=(EXAMENES,))
+
 def manage_exams(db: Session):
     st.header("🧪 Catálogo de Exámenes")
     
-    total = db.query(CatalogoExamenes).count()
+    total = estimated_count(db, CatalogoExamenes, tags=(EXAMENES,))
     col_m, _ = st.columns([1,3])
-    col_m.metric("Exámenes en Catálogo", total)
+    col_m.metric("Exámenes en Catálogo (aprox.)", f"{total:,}")
     st.divider()
 
     # CREAR
@@ -122,7 +163,7 @@ def manage_exams(db: Session):
             with c3:
                 precio = st.number_input("Precio Base (S/.)", min_value=0.0)
             
-            categoria = st.selectbox("Categoría", ["Laboratorio", "Imagenología", "Medicina", "Audiología", "Oftalmología", "Psicología", "Otros"])
+            categoria = st.selectbox("Categoría", EXAM_CATEGORIES)
             
             if st.form_submit_button("💾 Guardar Examen", type="primary", use_container_width=True):
                 if codigo and nombre:
@@ -133,58 +174,141 @@ def manage_exams(db: Session):
                         )
                         db.add(new_ex)
                         db.commit()
+                        dashboard_cache.invalidate(EXAMENES)
+                        catalog_cache.invalidate()
                         st.success("Examen creado.")
                         time.sleep(1)
                         st.rerun()
                     except Exception as e:
+                        db.rollback()
                         st.error(f"Error: {e}")
                 else:
                     st.error("Faltan datos.")
 
-    # LISTAR
+    # LISTAR (paginado en el servidor, tabla de solo lectura)
     st.subheader("Listado de Exámenes")
-    search = st.text_input("🔍 Buscar examen:", "")
+    with read_session() as read_db:
+        facets = get_exam_facets(read_db)
+    col_s, col_c, col_a = st.columns([2, 1, 1])
+    with col_s:
+        search = st.text_input("🔍 Buscar examen:", "")
+    with col_c:
+        cat_labels = {f"Todas ({sum(facets.values())})": None}
+        cat_labels.update({f"{cat} ({n})": cat for cat, n in sorted(facets.items())})
+        sel_cat = cat_labels[st.selectbox("Categoría", list(cat_labels.keys()))]
+    with col_a:
+        sel_status = EXAM_STATUS[st.selectbox("Estado", list(EXAM_STATUS.keys()))]
     
-    query = db.query(CatalogoExamenes)
-    if search:
-        query = query.filter(CatalogoExamenes.nombre.ilike(f"%{search}%"))
-    
-    exams = query.order_by(CatalogoExamenes.nombre).all()
-
-    for ex in exams:
-        status_icon = "🟢" if ex.activo else "🔴"
-        with st.expander(f"{status_icon} {ex.nombre} ({ex.codigo_interno}) - S/ {ex.precio_base}"):
-            with st.form(f"edit_exam_{ex.id}"):
-                c1, c2 = st.columns(2)
-                with c1:
-                    n_nom = st.text_input("Nombre", ex.nombre)
-                    n_cat = st.selectbox("Categoría", ["Laboratorio", "Imagenología", "Medicina", "Audiología", "Oftalmología", "Psicología", "Otros"], index=0)
-                with c2:
-                    n_pre = st.number_input("Precio", value=float(ex.precio_base))
-                    n_act = st.checkbox("Activo", value=ex.activo)
-                
-                if st.form_submit_button("Actualizar Examen", use_container_width=True):
-                    ex.nombre = n_nom
-                    ex.categoria = n_cat
-                    ex.precio_base = n_pre
-                    ex.activo = n_act
-                    db.commit()
-                    st.success("Examen actualizado")
-                    time.sleep(0.5)
-                    st.rerun()
+    pager = KeysetPager("exams", reset_token=(search, sel_cat, sel_status))
+    with read_session() as read_db:
+        query = read_db.query(CatalogoExamenes)
+        if sel_cat == "Sin categoría":
+            query = query.filter(CatalogoExamenes.categoria.is_(None))
+        elif sel_cat is not None:
+            query = query.filter(CatalogoExamenes.categoria == sel_cat)
+        if sel_status is not None:
+            query = query.filter(CatalogoExamenes.activo == sel_status)
+        if search:
+            # Misma expresión que el índice trigram ix_catalogo_examenes_nombre_trgm
+            query = query.filter(func.f_unaccent(func.lower(CatalogoExamenes.nombre)).contains(normalize(search), autoescape=True))
+        exams, has_next = keyset_page(query, (CatalogoExamenes.nombre, CatalogoExamenes.id), pager.cursor, EXAMS_PAGE_SIZE)
+
+    if not exams:
+        st.info("No se encontraron exámenes.")
+        return
+
+    st.dataframe(
+        [{
+            "Estado": "🟢" if ex.activo else "🔴",
+            "Código": ex.codigo_interno,
+            "Examen": ex.nombre,
+            "Categoría": ex.categoria,
+            "Precio Base": ex.precio_base
+        } for ex in exams],
+        use_container_width=True, hide_index=True
+    )
+    last = exams[-1]
+    pager.controls((last.nombre, last.id), has_next)
+
+    # Solo se construye el formulario del examen seleccionado
+    options = {f"{ex.nombre} ({ex.codigo_interno})": ex.id for ex in exams}
+    selected = st.selectbox("✏️ Editar examen:", ["—"] + list(options.keys()), key="edit_exam_select")
+    if selected == "—":
+        return
+
+    ex = db.get(CatalogoExamenes, options[selected])
+    es_triaje = ex.id in catalog_cache.exam_ids_for_role(db, RolExamen.TRIAJE.value)
+    with st.form(f"edit_exam_{ex.id}"):
+        c1, c2 = st.columns(2)
+        with c1:
+            n_nom = st.text_input("Nombre", ex.nombre)
+            cat_index = EXAM_CATEGORIES.index(ex.categoria) if ex.categoria in EXAM_CATEGORIES else len(EXAM_CATEGORIES) - 1
+            n_cat = st.selectbox("Categoría", EXAM_CATEGORIES, index=cat_index)
+        with c2:
+            n_pre = st.number_input("Precio", value=float(ex.precio_base or 0))
+            n_act = st.checkbox("Activo", value=ex.activo)
+            n_triaje = st.checkbox("Recibe los signos vitales de Triaje", value=es_triaje)
+        
+        if st.form_submit_button("Actualizar Examen", use_container_width=True):
+            ex.nombre = n_nom
+            ex.categoria = n_cat
+            ex.precio_base = n_pre
+            ex.activo = n_act
+            if n_triaje and not es_triaje:
+                db.add(ExamenRol(rol=RolExamen.TRIAJE.value, examen_id=ex.id))
+            elif es_triaje and not n_triaje:
+                db.query(ExamenRol).filter(
+                    ExamenRol.rol == RolExamen.TRIAJE.value, ExamenRol.examen_id == ex.id
+                ).delete()
+            db.commit()
+            dashboard_cache.invalidate(EXAMENES)
+            catalog_cache.invalidate()
+            st.success("Examen actualizado")
+            time.sleep(0.5)
+            st.rerun()
 
 # --- GESTIÓN DE PROTOCOLOS ---
+def get_protocol_tree(db: Session, empresa_id=None):
+    """Protocolos con su empresa y exámenes en UNA sola consulta (sin lazy loads por fila)"""
+    query = db.query(
+        Protocolo.id,
+        Protocolo.nombre_protocolo,
+        Protocolo.perfil_riesgo,
+        Empresa.razon_social,
+        CatalogoExamenes.nombre.label("examen"),
+        ProtocoloDetalle.precio_acordado
+    ).outerjoin(Empresa, Protocolo.empresa_id == Empresa.id).outerjoin(
+        ProtocoloDetalle, ProtocoloDetalle.protocolo_id == Protocolo.id
+    ).outerjoin(
+        CatalogoExamenes, ProtocoloDetalle.examen_id == CatalogoExamenes.id
+    )
+    if empresa_id is not None:
+        query = query.filter(Protocolo.empresa_id == empresa_id)
+
+    tree = {}
+    for row in query.order_by(Protocolo.id, ProtocoloDetalle.id).all():
+        node = tree.setdefault(row.id, {
+            "id": row.id,
+            "nombre": row.nombre_protocolo,
+            "riesgo": row.perfil_riesgo,
+            "empresa": row.razon_social,
+            "examenes": []
+        })
+        if row.examen is not None:
+            node["examenes"].append({"Examen": row.examen, "Precio Acordado": f"S/ {row.precio_acordado}"})
+    return list(tree.values())
+
 def manage_protocols(db: Session):
     st.header("📋 Protocolos Médicos")
     st.info("Los protocolos definen qué exámenes se aplican a los trabajadores de una empresa.")
 
     # Filtro Principal
-    companies = db.query(Empresa).all()
+    companies = catalog_cache.get(db).empresas
     if not companies:
         st.warning("Primero registre empresas.")
         return
         
-    comp_opts = {c.razon_social: c.id for c in companies}
+    comp_opts = {razon_social: c_id for c_id, razon_social in companies}
     
     # CREAR NUEVO
     with st.expander("➕ Crear Nuevo Protocolo", expanded=False):
@@ -239,6 +363,7 @@ def manage_protocols(db: Session):
                                 db.add(det)
                             
                             db.commit()
+                            catalog_cache.invalidate()
                             st.success("Protocolo Creado!")
                             time.sleep(1)
                             st.rerun()
@@ -254,37 +379,51 @@ def manage_protocols(db: Session):
     
     sel_comp_filter = st.selectbox("Filtrar por Empresa:", ["Todas"] + list(comp_opts.keys()))
     
-    q_prot = db.query(Protocolo)
-    if sel_comp_filter != "Todas":
-        q_prot = q_prot.filter(Protocolo.empresa_id == comp_opts[sel_comp_filter])
-    
-    protocols = q_prot.all()
+    empresa_id = comp_opts[sel_comp_filter] if sel_comp_filter != "Todas" else None
+    with read_session() as read_db:
+        protocols = get_protocol_tree(read_db, empresa_id)
     
     if not protocols:
         st.info("No hay protocolos registrados.")
     
     for p in protocols:
-        with st.expander(f"📄 {p.nombre_protocolo} - {p.empresa.razon_social}"):
-            st.write(f"**Riesgo:** {p.perfil_riesgo}")
+        with st.expander(f"📄 {p['nombre']} - {p['empresa']}"):
+            st.write(f"**Riesgo:** {p['riesgo']}")
+            st.table(p["examenes"])
             
-            details = db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == p.id).all()
-            data = []
-            for d in details:
-                data.append({"Examen": d.examen.nombre, "Precio Acordado": f"S/ {d.precio_acordado}"})
-            st.table(data)
-            
-            if st.button(f"🗑️ Eliminar Protocolo {p.id}", key=f"del_p_{p.id}"):
+            if st.button(f"🗑️ Eliminar Protocolo {p['id']}", key=f"del_p_{p['id']}"):
                 try:
-                    db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == p.id).delete()
-                    db.delete(p)
+                    db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == p["id"]).delete()
+                    db.query(Protocolo).filter(Protocolo.id == p["id"]).delete()
                     db.commit()
+                    catalog_cache.invalidate()
                     st.warning("Protocolo eliminado.")
                     time.sleep(1)
                     st.rerun()
-                except Exception as e:
+                except Exception:
+                    db.rollback()
                     st.error("No se puede eliminar (posiblemente ya tiene admisiones vinculadas).")
 
 # --- GESTIÓN DE USUARIOS ---
+def get_user_page(db: Session, rol=None, activo=None, after=None):
+    """Una página del directorio como filas planas (cacheables entre sesiones)"""
+    def load():
+        query = db.query(Usuario.email, Usuario.nombre_completo, Usuario.rol, Usuario.activo)
+        if rol is not None:
+            query = query.filter(Usuario.rol == rol)
+        if activo is not None:
+            query = query.filter(Usuario.activo == activo)
+        rows, has_next = keyset_page(query, (Usuario.email,), after, USERS_PAGE_SIZE)
+        return [{
+            "Nombre": u.nombre_completo,
+            "Email": u.email,
+            "Rol": u.rol,
+            "Estado": "✅ Activo" if u.activo else "❌ Inactivo"
+        } for u in rows], has_next
+
+    key = f"usuarios:{rol}:{activo}:{after}"
+    return dashboard_cache.get_or_load(key, load, tags=(USUARIOS,))
+
 def manage_users(db: Session):
     st.header("👥 Usuarios del Sistema")
     
@@ -298,42 +437,184 @@ def manage_users(db: Session):
                 u_pass = st.text_input("Contraseña *", type="password")
             with c2:
                 u_name = st.text_input("Nombre Completo")
-                u_rol = st.selectbox("Rol", ["admin", "medico", "admision", "enfermeria"])
+                u_rol = st.selectbox("Rol", USER_ROLES)
             
             if st.form_submit_button("Crear Usuario", type="primary", use_container_width=True):
                 if u_email and u_pass:
                     try:
-                        hashed = f"hashed_{u_pass}" if not u_pass.startswith("hashed_") else u_pass
                         new_u = Usuario(
-                            email=u_email, hashed_password=hashed,
+                            email=u_email, hashed_password=hash_password(u_pass),
                             nombre_completo=u_name, rol=u_rol, activo=True
                         )
                         db.add(new_u)
                         db.commit()
+                        dashboard_cache.invalidate(USUARIOS)
                         st.success("Usuario creado")
                         time.sleep(1)
                         st.rerun()
-                    except:
+                    except IntegrityError:
+                        db.rollback()
                         st.error("Error: El correo ya existe.")
+                    except Exception as e:
+                        db.rollback()
+                        st.error(f"Error: {e}")
     
-    # LISTAR
-    users = db.query(Usuario).order_by(Usuario.email).all()
-    
+    # LISTAR (filtros en SQL, páginas cacheadas hasta que se cree un usuario)
     st.markdown("### Directorio")
-    for u in users:
-        with st.container():
-            c1, c2, c3, c4 = st.columns([3, 2, 1, 1])
-            c1.write(f"**{u.nombre_completo}**")
-            c2.caption(u.email)
-            c3.write(f"`{u.rol}`")
-            # Mostrar estado sin checkbox editable para simplificar
-            status = "✅ Activo" if u.activo else "❌ Inactivo"
-            c4.write(status)
-            st.divider()
+    total = estimated_count(db, Usuario, tags=(USUARIOS,))
+    col_r, col_a, col_t = st.columns([1, 1, 2])
+    with col_r:
+        sel_rol = st.selectbox("Filtrar por rol", ["Todos"] + USER_ROLES)
+    with col_a:
+        sel_status = EXAM_STATUS[st.selectbox("Estado", list(EXAM_STATUS.keys()), key="user_status_filter")]
+    col_t.metric("Usuarios (aprox.)", f"{total:,}")
+
+    pager = KeysetPager("users", reset_token=(sel_rol, sel_status))
+    with read_session() as read_db:
+        users, has_next = get_user_page(read_db, None if sel_rol == "Todos" else sel_rol, sel_status, pager.cursor)
+
+    if not users:
+        st.info("No se encontraron usuarios.")
+        return
+
+    st.dataframe(users, use_container_width=True, hide_index=True)
+    pager.controls((users[-1]["Email"],), has_next)
+
+# --- MONITOREO DEL POOL DE CONEXIONES ---
+def show_pool_metrics():
+    st.header("🗄️ Pool de Conexiones")
+    m = get_pool_metrics()
+    st.caption(
+        f"Proceso {m['pid']} · contadores desde {datetime.fromtimestamp(m['desde']).strftime('%d/%m/%Y %H:%M:%S')} · "
+        f"pool_size={settings.DB_POOL_SIZE}, max_overflow={settings.DB_MAX_OVERFLOW}, "
+        f"timeout={settings.DB_POOL_TIMEOUT}s, recycle={settings.DB_POOL_RECYCLE}s, pre_ping={settings.DB_POOL_PRE_PING}"
+    )
+
+    st.markdown("##### Estado actual")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("En uso", m["en_uso"])
+    c2.metric("Libres", m["libres"])
+    c3.metric("Overflow actual", m["overflow_actual"])
+    c4.metric("Tamaño del pool", m["pool_size"])
+
+    st.markdown("##### Acumulado")
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Checkouts", m["checkouts"])
+    c2.metric("Espera promedio", f"{m['espera_promedio_ms']:.2f} ms")
+    c3.metric("Espera máxima", f"{m['espera_max_ms']:.1f} ms")
+    c4.metric("Conexiones nuevas", m["conexiones_nuevas"])
+
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Checkouts en overflow", m["checkouts_en_overflow"])
+    c2.metric("Timeouts", m["timeouts"])
+    c3.metric("Fallos de pre-ping", m["fallos_pre_ping"])
+    c4.metric("Invalidaciones", m["invalidaciones"])
+
+    if m["timeouts"] or m["checkouts_en_overflow"] > m["checkouts"] * 0.1:
+        st.warning("El pool se satura con frecuencia: considere aumentar DB_POOL_SIZE / DB_MAX_OVERFLOW.")
+
+    st.markdown("##### Réplica de lectura")
+    r = get_replica_status()
+    if not r["configurada"]:
+        st.caption("Sin réplica configurada (REPLICA_DATABASE_URL): todas las lecturas van al primario.")
+    else:
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("Estado", "🟢 En uso" if r["en_uso"] else "🔴 Primario")
+        c2.metric("Retraso", f"{r['retraso_s']:.2f} s" if r["retraso_s"] is not None else "—")
+        c3.metric("Lecturas en réplica", r["lecturas_replica"])
+        c4.metric("Lecturas en primario", r["lecturas_primario"])
+        if not r["en_uso"]:
+            st.warning(f"Lecturas redirigidas al primario: {r['estado']}.")
+
+    if st.button("🔄 Reiniciar contadores"):
+        pool_metrics.reset()
+        st.rerun()
+
+# --- EMISIÓN MASIVA DE CERTIFICADOS ---
+def get_certificate_rows(db: Session, empresa_id: int, start: datetime, end: datetime):
+    """Una sola consulta con todo lo que imprime el certificado, como filas planas (ver certificates.py)"""
+    rows = db.query(
+        CertificadoAptitud.uuid_documento, CertificadoAptitud.aptitud_status,
+        CertificadoAptitud.restricciones, CertificadoAptitud.recomendaciones,
+        CertificadoAptitud.fecha_emision, CertificadoAptitud.fecha_vencimiento,
+        (Paciente.apellidos + ", " + Paciente.nombres).label("paciente"),
+        Paciente.tipo_documento, Paciente.numero_documento, Paciente.fecha_nacimiento,
+        Empresa.razon_social.label("empresa"), Empresa.ruc,
+        Admision.puesto_postula, Admision.fecha_ingreso,
+        Usuario.nombre_completo.label("medico"), Usuario.cmp_colegiatura,
+    ).join(Admision, CertificadoAptitud.admision_id == Admision.id)\
+     .join(Paciente, Admision.paciente_id == Paciente.id)\
+     .join(Empresa, Admision.empresa_id == Empresa.id)\
+     .outerjoin(Usuario, CertificadoAptitud.medico_firmante_id == Usuario.id)\
+     .filter(
+        Admision.empresa_id == empresa_id,
+        CertificadoAptitud.fecha_emision >= start,
+        CertificadoAptitud.fecha_emision < end,
+     ).order_by(Paciente.apellidos, Paciente.nombres).all()
+    return [dict(r._mapping) for r in rows]
+
+def manage_certificates():
+    """
+    Se ejecuta fuera de la unidad de trabajo del rerun: las lecturas usan sesiones cortas que
+    se devuelven al pool antes del render, así la conexión no queda "idle in transaction"
+    (con sus locks y frenando el vacuum) mientras el pool de procesos arma los PDF.
+    """
+    st.header("📜 Emisión Masiva de Certificados")
+    st.caption("Genera en un ZIP todos los Certificados de Aptitud de una empresa en un rango de fechas (cierre de campaña).")
+
+    with read_session() as db:
+        empresas = catalog_cache.get(db).empresas
+    if not empresas:
+        st.info("No hay empresas registradas.")
+        return
+
+    col1, col2 = st.columns([2, 2])
+    with col1:
+        empresa_id = st.selectbox(
+            "Empresa", [e[0] for e in empresas],
+            format_func=dict(empresas).get, key="cert_empresa"
+        )
+    with col2:
+        today = datetime.now().date()
+        dates = st.date_input("Fecha de emisión", (today - timedelta(days=30), today), key="cert_fechas")
+    if len(dates) != 2:
+        st.info("Seleccione fecha de inicio y fin.")
+        return
+    start = datetime.combine(dates[0], datetime.min.time())
+    end = datetime.combine(dates[1], datetime.min.time()) + timedelta(days=1)
+
+    if st.button("📦 Generar ZIP de Certificados", type="primary"):
+        with read_session() as db:
+            rows = get_certificate_rows(db, empresa_id, start, end)
+        if not rows:
+            st.warning("No hay certificados emitidos en ese rango.")
+            return
+        bar = st.progress(0.0, text=f"Generando {len(rows):,} certificados...")
+
+        def progress(done, total):
+            bar.progress(done / total, text=f"Certificados generados: {done:,} / {total:,}")
+
+        t0 = time.perf_counter()
+        # El ZIP se escribe a un temporal anónimo en disco a medida que llegan los PDF. Se lee
+        # una sola vez, en este mismo rerun, para entregarlo al botón de descarga, y se cierra
+        # (el sistema libera el archivo): nada queda en la sesión ni se relee en otros reruns.
+        with tempfile.TemporaryFile() as out:
+            count = write_certificates_zip(rows, out, workers=settings.CERTIFICATE_WORKERS, progress=progress)
+            elapsed = time.perf_counter() - t0
+            out.seek(0)
+            st.success(f"✅ {count:,} certificados en {elapsed:.1f} s ({count / elapsed:,.0f} cert/s).")
+            st.download_button(
+                "📥 Descargar ZIP",
+                data=out.read(),
+                file_name=f"Certificados_{dict(empresas)[empresa_id]}_{dates[0]:%Y%m%d}_{dates[1]:%Y%m%d}.zip",
+                mime="application/zip",
+            )
+        st.caption("El ZIP se descarta al interactuar con la página: descárguelo antes de continuar.")
 
 # --- MAIN ---
 def main():
     # Validar Admin
+    restore_session()
     if 'user' not in st.session_state or not st.session_state.authenticated:
         st.warning("Acceso restringido.")
         return
@@ -345,10 +626,9 @@ def main():
     st.title("⚙️ Configuración")
     
     # NAVEGACIÓN POR PESTAÑAS
-    tab1, tab2, tab3, tab4 = st.tabs(["🏢 Empresas", "📋 Protocolos", "🧪 Exámenes", "👥 Usuarios"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🏢 Empresas", "📋 Protocolos", "🧪 Exámenes", "👥 Usuarios", "📜 Certificados", "🗄️ Base de Datos"])
     
-    db = SessionLocal()
-    try:
+    with unit_of_work() as db:
         with tab1:
             manage_companies(db)
         with tab2:
@@ -357,8 +637,11 @@ def main():
             manage_exams(db)
         with tab4:
             manage_users(db)
-    finally:
-        db.close()
+    # Fuera de la unidad de trabajo: la emisión masiva puede tardar minutos
+    with tab5:
+        manage_certificates()
+    with tab6:
+        show_pool_metrics()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
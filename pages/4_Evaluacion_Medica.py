@@ -1,15 +1,21 @@
 import streamlit as st
 from sqlalchemy.orm import Session
-from sqlalchemy import select, and_, or_
+from sqlalchemy import select, update, and_
 from models import (
-    Paciente, Admision, HojaRutaExamenes, 
-    ResultadoClinico, CatalogoExamenes, Usuario
+    Paciente, HojaRutaExamenes, 
+    ResultadoClinico, Usuario
 )
-from database import SessionLocal
+from database import get_session, get_read_session, release_session, unit_of_work
+from aggregate_cache import dashboard_cache, EXAMENES
+from clinical_results import upsert_result, query_pending_exams, query_pending_exams_async
+from config import settings
+import async_database
+from session_auth import restore_session
+import patient_search
 from datetime import datetime
 import json
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 
 # Configuración de logs
 logging.basicConfig(level=logging.INFO)
@@ -25,16 +31,10 @@ def search_patient() -> Optional[Paciente]:
     )
     
     if search_term:
-        db = SessionLocal()
+        db = get_read_session()
         try:
-            # Search by document number or name
-            patients = db.query(Paciente).filter(
-                or_(
-                    Paciente.numero_documento.ilike(f"%{search_term}%"),
-                    Paciente.nombres.ilike(f"%{search_term}%"),
-                    Paciente.apellidos.ilike(f"%{search_term}%")
-                )
-            ).limit(10).all()
+            # Search by document number or name (trigram index, accent-insensitive)
+            patients = patient_search.search_patients(db, search_term, limit=10)
             
             if patients:
                 if len(patients) == 1:
@@ -59,43 +59,34 @@ def search_patient() -> Optional[Paciente]:
             logger.exception("Error searching for patient:")
             return None
         finally:
-            db.close()
+            release_session(db)
     return None
 
-def get_pending_exams(patient_id: int) -> list:
-    """Get pending exams for a patient's active admission"""
-    db = SessionLocal()
+async def _pending_exams_async(patient_id: int) -> Tuple[Optional[int], list]:
+    async with async_database.async_session() as db:
+        return await query_pending_exams_async(db, patient_id)
+
+def get_pending_exams(patient_id: int) -> Optional[Tuple[Optional[int], list]]:
+    """(id de la admisión activa, exámenes pendientes (HojaRutaExamenes, nombre)); None si la consulta falla"""
+    if settings.ASYNC_DB_ENABLED:
+        # Las dos lecturas corren en el loop de async_database, fuera de la sesión del rerun
+        try:
+            return async_database.run_sync(_pending_exams_async(patient_id))
+        except Exception as e:
+            st.error(f"Error al obtener exámenes pendientes: {str(e)}")
+            logger.exception("Error getting pending exams:")
+            return None
+    db = get_session()
     try:
-        # Get active admission
-        admission = db.query(Admision).filter(
-            Admision.paciente_id == patient_id,
-            Admision.estado_global == "En Circuito"
-        ).order_by(Admision.fecha_ingreso.desc()).first()
-        
-        if not admission:
-            st.warning("No se encontró una admisión activa para este paciente")
-            return []
-        
-        # Get pending exams
-        exams = db.query(
-            HojaRutaExamenes,
-            CatalogoExamenes.nombre
-        ).join(
-            CatalogoExamenes,
-            HojaRutaExamenes.examen_id == CatalogoExamenes.id
-        ).filter(
-            HojaRutaExamenes.admision_id == admission.id,
-            HojaRutaExamenes.estado != "Realizado"
-        ).all()
-        
-        return exams
-        
+        # Active admission + pending route-sheet exams (shared with the async engine)
+        return query_pending_exams(db, patient_id)
     except Exception as e:
+        db.rollback()
         st.error(f"Error al obtener exámenes pendientes: {str(e)}")
         logger.exception("Error getting pending exams:")
-        return []
+        return None
     finally:
-        db.close()
+        release_session(db)
 
 def show_exam_form(exam_route_id: int, exam_name: str, admission_id: int):
     """Show the appropriate form based on exam type"""
@@ -107,7 +98,7 @@ def show_exam_form(exam_route_id: int, exam_name: str, admission_id: int):
     conclusion = ""
     
     # Get existing result if it exists
-    db = SessionLocal()
+    db = get_session()
     try:
         existing_result = db.query(ResultadoClinico).filter(
             ResultadoClinico.admision_id == admission_id,
@@ -121,7 +112,7 @@ def show_exam_form(exam_route_id: int, exam_name: str, admission_id: int):
     except Exception as e:
         st.error(f"Error al cargar resultados previos: {str(e)}")
     finally:
-        db.close()
+        release_session(db)
     
     # Show appropriate form based on exam name
     if "audiometr" in exam_name.lower():
@@ -229,35 +220,24 @@ def show_exam_form(exam_route_id: int, exam_name: str, admission_id: int):
 
 def save_exam_result(exam_route_id: int, exam_name: str, admission_id: int, form_data: Dict[str, Any], conclusion: str):
     """Save exam results to the database"""
-    db = SessionLocal()
+    db = get_session()
     try:
-        exam_route = db.query(HojaRutaExamenes).get(exam_route_id)
-        if not exam_route:
+        # Marca el examen y obtiene su examen_id en la misma ida y vuelta
+        examen_id = db.execute(
+            update(HojaRutaExamenes).where(HojaRutaExamenes.id == exam_route_id).values(
+                estado="Realizado",
+                fecha_realizado=datetime.now(),
+                medico_evaluador_id=st.session_state.user["id"]
+            ).returning(HojaRutaExamenes.examen_id)
+        ).scalar()
+        if examen_id is None:
             st.error("No se encontró la ruta del examen")
             return
         
-        result = db.query(ResultadoClinico).filter(
-            ResultadoClinico.admision_id == admission_id,
-            ResultadoClinico.examen_id == exam_route.examen_id
-        ).first()
-        
-        if not result:
-            result = ResultadoClinico(
-                admision_id=admission_id,
-                examen_id=exam_route.examen_id,
-                datos_tecnicos=form_data,
-                conclusiones_examen=conclusion,
-            )
-            db.add(result)
-        else:
-            result.datos_tecnicos = form_data
-            result.conclusiones_examen = conclusion
-        
-        exam_route.estado = "Realizado"
-        exam_route.fecha_realizado = datetime.now()
-        exam_route.medico_evaluador_id = st.session_state.user["id"]
+        upsert_result(db, admission_id, examen_id, form_data, conclusiones=conclusion)
         
         db.commit()
+        dashboard_cache.invalidate(EXAMENES)
         st.success("¡Resultado guardado exitosamente!")
         st.balloons()
         st.rerun()
@@ -267,11 +247,12 @@ def save_exam_result(exam_route_id: int, exam_name: str, admission_id: int, form
         st.error(f"Error al guardar el resultado: {str(e)}")
         logger.exception("Error saving exam result:")
     finally:
-        db.close()
+        release_session(db)
 
 def main():
     st.title("👩‍⚕️ Módulo de Evaluación Médica")
     
+    restore_session()
     if 'user' not in st.session_state or not st.session_state.authenticated:
         st.warning("Por favor inicie sesión para acceder a esta página.")
         return
@@ -300,62 +281,40 @@ def main():
                 del st.session_state.current_patient
                 st.rerun()
         
-        db = SessionLocal()
-        try:
-            admission = db.query(Admision).filter(
-                Admision.paciente_id == patient["id"],
-                Admision.estado_global == "En Circuito"
-            ).order_by(Admision.fecha_ingreso.desc()).first()
-            
-            if not admission:
-                st.warning("El paciente no tiene una admisión 'En Circuito'.")
-                return
-            
-            # --- CORRECCIÓN DEL ERROR AQUÍ ---
-            # Obtenemos la tupla (ObjetoHojaRuta, NombreString)
-            pending_exams = db.query(
-                HojaRutaExamenes,
-                CatalogoExamenes.nombre
-            ).join(
-                CatalogoExamenes,
-                HojaRutaExamenes.examen_id == CatalogoExamenes.id
-            ).filter(
-                HojaRutaExamenes.admision_id == admission.id,
-                HojaRutaExamenes.estado != "Realizado"
-            ).all()
-            
-            if not pending_exams:
-                st.info("✅ ¡Todos los exámenes han sido completados!")
-                return
-                
-            # Desempaquetamos correctamente la tupla en el bucle
-            exam_options = {}
-            for hoja_ruta, nombre_examen in pending_exams:
-                key = f"{nombre_examen} ({hoja_ruta.estado})"
-                exam_options[key] = hoja_ruta.id
+        pending = get_pending_exams(patient["id"])
+        if pending is None:
+            return
+        admission_id, pending_exams = pending
+        if admission_id is None:
+            st.warning("El paciente no tiene una admisión 'En Circuito'.")
+            return
+        if not pending_exams:
+            st.info("✅ ¡Todos los exámenes han sido completados!")
+            return
 
-            selected_label = st.selectbox(
-                "Seleccione un examen pendiente:",
-                options=list(exam_options.keys())
+        # Cada fila es la tupla (ObjetoHojaRuta, NombreString)
+        exam_options = {}
+        for hoja_ruta, nombre_examen in pending_exams:
+            key = f"{nombre_examen} ({hoja_ruta.estado})"
+            exam_options[key] = hoja_ruta.id
+
+        selected_label = st.selectbox(
+            "Seleccione un examen pendiente:",
+            options=list(exam_options.keys())
+        )
+
+        if selected_label:
+            exam_route_id = exam_options[selected_label]
+            # Extraemos solo el nombre para saber qué form mostrar
+            exam_name = selected_label.split(" (")[0]
+
+            st.markdown("---")
+            show_exam_form(
+                exam_route_id=exam_route_id,
+                exam_name=exam_name,
+                admission_id=admission_id
             )
-            
-            if selected_label:
-                exam_route_id = exam_options[selected_label]
-                # Extraemos solo el nombre para saber qué form mostrar
-                exam_name = selected_label.split(" (")[0]
-                
-                st.markdown("---")
-                show_exam_form(
-                    exam_route_id=exam_route_id,
-                    exam_name=exam_name,
-                    admission_id=admission.id
-                )
-                
-        except Exception as e:
-            st.error(f"Error: {str(e)}")
-            logger.exception("Error in main evaluation function:")
-        finally:
-            db.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with unit_of_work():
+        main()
\ No newline at end of file
@@ -0,0 +1,71 @@
+import streamlit as st
+from sqlalchemy import tuple_, text, func, select
+from sqlalchemy.orm import Query, Session
+from typing import Any, List, Optional, Sequence, Tuple
+from aggregate_cache import dashboard_cache
+
+# --- PAGINACIÓN POR CLAVE (KEYSET) ---
+# En lugar de OFFSET (que recorre todas las filas anteriores) cada página arranca
+# estrictamente después de la última fila vista: WHERE (a, b) > (:a, :b) ORDER BY a, b.
+# Con un índice sobre (a, b) el costo de cualquier página es el mismo.
+
+def keyset_page(query: Query, order_columns: Sequence, after: Optional[Tuple] = None, limit: int = 25) -> Tuple[List[Any], bool]:
+    """Devuelve (filas de la página, hay_siguiente)"""
+    if after is not None:
+        query = query.filter(tuple_(*order_columns) > tuple_(*after))
+    rows = query.order_by(*order_columns).limit(limit + 1).all()
+    return rows[:limit], len(rows) > limit
+
+# Por debajo de este estimado el count(*) exacto es barato; en tablas chicas reltuples
+# puede estar muy desfasado (p. ej. 0 hasta el primer autovacuum / ANALYZE)
+EXACT_COUNT_THRESHOLD = 10_000
+
+def estimated_count(db: Session, model, tags: Sequence[str] = ()) -> int:
+    """
+    Conteo aproximado desde las estadísticas del planificador (pg_class.reltuples),
+    cacheado en memoria. Si la tabla nunca fue analizada o el estimado es menor que
+    EXACT_COUNT_THRESHOLD se hace un count(*) exacto.
+    """
+    table = model.__tablename__
+
+    def load():
+        estimate = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:t)"), {"t": table}
+        ).scalar()
+        if estimate is None or estimate < EXACT_COUNT_THRESHOLD:
+            estimate = db.execute(select(func.count()).select_from(model)).scalar()
+        return int(estimate)
+
+    return dashboard_cache.get_or_load(f"estimado:{table}", load, tags)
+
+class KeysetPager:
+    """Estado de navegación (pila de cursores) guardado en st.session_state"""
+
+    def __init__(self, key: str, reset_token: Any = None):
+        state = st.session_state.setdefault(f"pager_{key}", {"token": reset_token, "cursors": [None]})
+        # Un filtro distinto invalida la navegación: se vuelve a la primera página
+        if state["token"] != reset_token:
+            state["token"] = reset_token
+            state["cursors"] = [None]
+        self.key = key
+        self.state = state
+
+    @property
+    def cursor(self) -> Optional[Tuple]:
+        return self.state["cursors"][-1]
+
+    @property
+    def page_number(self) -> int:
+        return len(self.state["cursors"])
+
+    def controls(self, next_cursor: Optional[Tuple], has_next: bool):
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if st.button("◀ Anterior", key=f"{self.key}_prev", disabled=self.page_number == 1, use_container_width=True):
+                self.state["cursors"].pop()
+                st.rerun()
+        col_page.markdown(f"<p style='text-align: center;'>Página {self.page_number}</p>", unsafe_allow_html=True)
+        with col_next:
+            if st.button("Siguiente ▶", key=f"{self.key}_next", disabled=not has_next, use_container_width=True):
+                self.state["cursors"].append(next_cursor)
+                st.rerun()
@@ -0,0 +1,290 @@
+import re
+import time
+import bisect
+import logging
+import threading
+import unicodedata
+from array import array
+from datetime import datetime, timedelta
+from sqlalchemy import func, or_, and_, literal, select
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Callable, List, Optional, Sequence, Tuple
+from models import Paciente
+
+logger = logging.getLogger(__name__)
+
+# --- SERVICIO COMPARTIDO DE BÚSQUEDA DE PACIENTES ---
+# Todas las pantallas (Admisión, Triaje, Evaluación) buscan por aquí. Cada campo
+# se compara normalizado (minúsculas, sin tildes) con LIKE '%term%', que Postgres
+# resuelve con los índices trigram (pg_trgm) declarados en models.Paciente.
+
+DOCUMENTO = "documento"
+NOMBRES = "nombres"
+APELLIDOS = "apellidos"
+TODOS = (DOCUMENTO, NOMBRES, APELLIDOS)
+
+# Criterios tal como aparecen en el selector de la pantalla de Admisión
+CRITERIOS = {
+    "DNI": (DOCUMENTO,),
+    "Nombres": (NOMBRES,),
+    "Apellidos": (APELLIDOS,),
+}
+
+def normalize(value: str) -> str:
+    """Minúsculas, sin tildes y con espacios colapsados ("  José  PÉREZ" -> "jose perez")"""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", stripped).strip().lower()
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _field_expression(field: str):
+    # Debe coincidir exactamente con la expresión de los índices trigram
+    if field == DOCUMENTO:
+        return func.lower(Paciente.numero_documento)
+    column = Paciente.nombres if field == NOMBRES else Paciente.apellidos
+    return func.f_unaccent(func.lower(column))
+
+def search_statement(term: str, fields: Sequence[str] = TODOS, limit: int = 20):
+    """
+    SELECT de pacientes cuyo documento / nombres / apellidos contengan el término, o None
+    si el término está vacío. Con varias palabras, cada palabra debe aparecer en alguno de
+    los campos ("perez juan" encuentra a "Juan Pérez"). Se ordena por similitud.
+    """
+    normalized = normalize(term)
+    tokens = normalized.split(" ") if normalized else []
+    if not tokens:
+        return None
+
+    expressions = [_field_expression(f) for f in fields]
+    conditions = [
+        or_(*[expr.like(f"%{_escape_like(token)}%", escape="\\") for expr in expressions])
+        for token in tokens
+    ]
+
+    # Ranking: mejor similitud trigram del término completo contra cualquiera de los campos
+    term_literal = literal(normalized)
+    rank = func.greatest(*[func.similarity(expr, term_literal) for expr in expressions]) if len(expressions) > 1 \
+        else func.similarity(expressions[0], term_literal)
+
+    return select(Paciente).where(and_(*conditions)).order_by(
+        rank.desc(), Paciente.apellidos, Paciente.nombres
+    ).limit(limit)
+
+def search_patients(db: Session, term: str, fields: Sequence[str] = TODOS, limit: int = 20) -> List[Paciente]:
+    statement = search_statement(term, fields, limit)
+    if statement is None:
+        return []
+    return db.execute(statement).scalars().all()
+
+async def search_patients_async(db: AsyncSession, term: str, fields: Sequence[str] = TODOS, limit: int = 20) -> List[Paciente]:
+    """Misma búsqueda sobre el motor asíncrono (ver async_database.py)"""
+    statement = search_statement(term, fields, limit)
+    if statement is None:
+        return []
+    return (await db.execute(statement)).scalars().all()
+
+# --- ÍNDICE EN MEMORIA DE DOCUMENTOS (TYPEAHEAD DE DNI) ---
+
+class DocumentPrefixIndex:
+    """
+    Índice ordenado numero_documento -> id en memoria del proceso. Responde prefijos
+    con bisect en microsegundos; la BD solo se consulta para hidratar las filas finales.
+    Documentos y ids se guardan en estructuras paralelas compactas (list[str] + array('q')).
+
+    Sincronización con las altas de otros procesos / workers:
+    - refresh() lee los pacientes con created_at desde la última marca menos `overlap`
+      segundos. created_at es la hora de inicio de la transacción: una alta que confirma
+      tarde queda con una marca anterior, y la superposición la vuelve a cubrir.
+    - Cada `reconcile_interval` se recarga todo: cubre transacciones más largas que la
+      superposición, documentos corregidos y pacientes eliminados.
+
+    Las altas se acumulan en un búfer ordenado pequeño que prefix() también consulta, y se
+    fusionan con el índice principal por lotes (O(n + k) cada `merge_threshold` altas en
+    lugar de un list.insert O(n) por alta).
+    """
+
+    def __init__(self, refresh_interval: float = 30.0, reconcile_interval: float = 600.0,
+                 overlap: float = 300.0, merge_threshold: int = 512):
+        self.refresh_interval = refresh_interval
+        self.reconcile_interval = reconcile_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.merge_threshold = merge_threshold
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._docs: List[str] = []
+        self._ids = array('q')
+        self._pending_docs: List[str] = []
+        self._pending_ids: List[int] = []
+        self._high_water: Optional[datetime] = None
+        self._loaded = False
+        self._warming = False
+        self._last_load = 0.0
+        self._last_refresh = 0.0
+
+    @staticmethod
+    def _key(documento: str) -> str:
+        return (documento or "").strip().upper()
+
+    def __len__(self):
+        # Aproximado: un documento reasignado cuenta dos veces hasta la próxima fusión
+        return len(self._docs) + len(self._pending_docs)
+
+    def _rows_statement(self, since: Optional[datetime] = None):
+        stmt = select(Paciente.numero_documento, Paciente.id, Paciente.created_at)
+        if since is not None:
+            stmt = stmt.where(Paciente.created_at >= since - self.overlap)
+        return stmt
+
+    def load(self, db: Session):
+        """
+        Carga completa. La consulta y el armado de las estructuras ocurren fuera del candado
+        (se ordena en Python: la collation de la BD puede ordenar distinto); bajo el candado
+        solo se reemplazan las referencias.
+        """
+        rows = db.execute(self._rows_statement()).all()
+        pairs = sorted((self._key(doc), pid) for doc, pid, _ in rows)
+        docs = [doc for doc, _ in pairs]
+        ids = array('q', (pid for _, pid in pairs))
+        high_water = max((created for _, _, created in rows if created is not None), default=None)
+        with self._lock:
+            # El búfer se conserva: puede tener altas confirmadas después de la lectura
+            self._docs, self._ids = docs, ids
+            self._high_water = high_water
+            self._loaded = True
+            self._last_load = self._last_refresh = time.monotonic()
+        logger.info(f"Índice de documentos cargado: {len(pairs)} pacientes")
+
+    def refresh(self, db: Session):
+        """Agrega los pacientes creados desde la última sincronización (con superposición)"""
+        with self._lock:
+            since = self._high_water
+        rows = db.execute(self._rows_statement(since)).all()
+        with self._lock:
+            for doc, pid, created in rows:
+                self._add_locked(self._key(doc), pid)
+                if created is not None and (self._high_water is None or created > self._high_water):
+                    self._high_water = created
+            self._last_refresh = time.monotonic()
+
+    def ensure_fresh(self, db: Session):
+        now = time.monotonic()
+        with self._lock:
+            must_load = not self._loaded or now - self._last_load > self.reconcile_interval
+            stale = now - self._last_refresh > self.refresh_interval
+        if must_load:
+            with self._load_lock:
+                # Otra sesión pudo haber recargado mientras esperábamos el candado
+                if not self._loaded or time.monotonic() - self._last_load > self.reconcile_interval:
+                    self.load(db)
+        elif stale:
+            self.refresh(db)
+
+    def warm_up(self, session_factory: Callable[[], Session]):
+        """Carga el índice en segundo plano para que la primera búsqueda no espere"""
+        with self._lock:
+            if self._loaded or self._warming:
+                return
+            self._warming = True
+
+        def run():
+            db = session_factory()
+            try:
+                self.ensure_fresh(db)
+            except Exception as e:
+                logger.error(f"Error cargando índice de documentos: {e}")
+            finally:
+                db.close()
+                with self._lock:
+                    self._warming = False
+
+        threading.Thread(target=run, name="document-index-warmup", daemon=True).start()
+
+    def add(self, documento: str, patient_id: int):
+        """Mantiene el índice al día tras save_new_patient / la carga masiva"""
+        with self._lock:
+            self._add_locked(self._key(documento), patient_id)
+
+    def _add_locked(self, key: str, patient_id: int):
+        pos = bisect.bisect_left(self._docs, key)
+        if pos < len(self._docs) and self._docs[pos] == key and self._ids[pos] == patient_id:
+            return  # ya indexado (p. ej. filas de la ventana de superposición)
+        pos = bisect.bisect_left(self._pending_docs, key)
+        if pos < len(self._pending_docs) and self._pending_docs[pos] == key:
+            self._pending_ids[pos] = patient_id
+        else:
+            self._pending_docs.insert(pos, key)
+            self._pending_ids.insert(pos, patient_id)
+        if len(self._pending_docs) >= self.merge_threshold:
+            self._merge_pending()
+
+    def _merge_pending(self):
+        """Fusiona el búfer con el índice principal en una pasada; ante el mismo documento gana el búfer"""
+        docs, ids = self._docs, self._ids
+        merged_docs: List[str] = []
+        merged_ids = array('q')
+        i = 0
+        for key, pid in zip(self._pending_docs, self._pending_ids):
+            end = bisect.bisect_left(docs, key, i)
+            merged_docs.extend(docs[i:end])
+            merged_ids.extend(ids[i:end])
+            merged_docs.append(key)
+            merged_ids.append(pid)
+            i = end + 1 if end < len(docs) and docs[end] == key else end
+        merged_docs.extend(docs[i:])
+        merged_ids.extend(ids[i:])
+        self._docs, self._ids = merged_docs, merged_ids
+        self._pending_docs, self._pending_ids = [], []
+
+    @staticmethod
+    def _range(docs, ids, key: str, limit: int) -> List[Tuple[str, int]]:
+        start = bisect.bisect_left(docs, key)
+        found = []
+        for pos in range(start, min(start + limit, len(docs))):
+            if not docs[pos].startswith(key):
+                break
+            found.append((docs[pos], ids[pos]))
+        return found
+
+    def prefix(self, prefix: str, limit: int = 20) -> List[int]:
+        """Ids de los primeros `limit` documentos que empiezan con `prefix` (orden de documento)"""
+        key = self._key(prefix)
+        if not key:
+            return []
+        with self._lock:
+            found = self._range(self._docs, self._ids, key, limit)
+            pending = self._range(self._pending_docs, self._pending_ids, key, limit)
+        if not pending:
+            return [pid for _, pid in found]
+        by_doc = dict(found)
+        by_doc.update(pending)
+        return [by_doc[doc] for doc in sorted(by_doc)[:limit]]
+
+# Instancia única del proceso
+document_index = DocumentPrefixIndex()
+
+def search_by_document_prefix(db: Session, prefix: str, limit: int = 20) -> List[Paciente]:
+    """Typeahead de DNI: prefijo resuelto en memoria, una sola consulta por id para hidratar"""
+    document_index.ensure_fresh(db)
+    ids = document_index.prefix(prefix, limit)
+    if not ids:
+        return []
+    key = DocumentPrefixIndex._key(prefix)
+    by_id = {p.id: p for p in db.query(Paciente).filter(Paciente.id.in_(ids)).all()}
+    # Se descartan filas cuyo documento cambió desde que se indexó
+    return [by_id[i] for i in ids if i in by_id and DocumentPrefixIndex._key(by_id[i].numero_documento).startswith(key)]
+
+def search_by_criterion(db: Session, criterion: str, term: str, limit: int = 20) -> List[Paciente]:
+    """Atajo para el selector "Buscar por" de Admisión"""
+    fields = CRITERIOS.get(criterion)
+    if not fields:
+        return []
+    if fields == (DOCUMENTO,):
+        # Recepción digita el DNI desde el inicio: prefijo en memoria; si no hay
+        # coincidencias por prefijo se cae a la búsqueda por subcadena.
+        results = search_by_document_prefix(db, term, limit)
+        if results:
+            return results
+    return search_patients(db, term, fields, limit)
@@ -0,0 +1,298 @@
+import time
+import logging
+import threading
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from fpdf import FPDF
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from config import settings
+from database import SessionLocal
+from models import Admision, Empresa, Paciente
+import dashboard_queries
+
+logger = logging.getLogger(__name__)
+
+# --- MOTOR DE REPORTES PDF DEL PANEL GERENCIAL ---
+# El PDF se arma fuera del hilo del script de Streamlit, en un pool de workers:
+#   - los datos se leen y se limpian por columnas (sin iterrows ni un encode por celda)
+#   - cada trabajo publica su avance para la barra de progreso
+#   - el resultado se cachea por (tipo, rango de fechas, versión de datos); dos usuarios
+#     que piden el mismo reporte a la vez comparten un solo trabajo
+
+RESUMEN = "resumen"
+DETALLE = "detalle"
+REPORT_TYPES = {
+    RESUMEN: "Resumen del día",
+    DETALLE: "Detalle de admisiones",
+}
+
+ProgressCallback = Callable[[float], None]
+
+class ReportTable(NamedTuple):
+    """Tabla en formato columnar: un arreglo por columna, todos del mismo largo"""
+    title: str
+    columns: Dict[str, Sequence[Any]]
+
+    @property
+    def row_count(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+def _clean_column(values: Sequence[Any], max_chars: int) -> List[str]:
+    """Texto imprimible en latin-1 (fuentes base de FPDF) para toda la columna de una vez"""
+    series = pd.Series(values, dtype=object).fillna("").astype(str).str.slice(0, max_chars)
+    return series.str.encode("latin-1", "replace").str.decode("latin-1").tolist()
+
+# --- CLASE PARA GENERAR PDF ---
+class PDFReport(FPDF):
+    def header(self):
+        # Título
+        self.set_font('Helvetica', 'B', 15)
+        self.cell(0, 10, 'SisoAI - Reporte Gerencial', 0, 1, 'C')
+        self.ln(5)
+
+        # Fecha del reporte
+        self.set_font('Helvetica', 'I', 10)
+        self.cell(0, 10, f'Generado el: {datetime.now().strftime("%d/%m/%Y %H:%M")}', 0, 1, 'R')
+        self.line(10, 30, 200, 30)
+        self.ln(10)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('Helvetica', 'I', 8)
+        self.cell(0, 10, f'Pagina {self.page_no()}', 0, 0, 'C')
+
+    def chapter_title(self, label):
+        self.set_font('Helvetica', 'B', 12)
+        self.set_fill_color(230, 230, 230)
+        self.cell(0, 10, label, 0, 1, 'L', fill=True)
+        self.ln(4)
+
+    def kpi_grid(self, kpis):
+        self.set_font('Helvetica', '', 10)
+        # Fila 1
+        self.cell(90, 10, f"Total Admisiones Hoy: {kpis['total_admisiones_hoy']}", 1)
+        self.cell(90, 10, f"Pacientes en Circuito: {kpis['atenciones_circuito']}", 1)
+        self.ln()
+        # Fila 2
+        self.cell(90, 10, f"Empresas Activas: {kpis['total_empresas']}", 1)
+        self.cell(90, 10, f"Examenes Realizados Hoy: {kpis['examenes_hoy']}", 1)
+        self.ln(10)
+
+    def _table_header(self, headers, col_width, row_height):
+        self.set_font('Helvetica', 'B', 9)
+        for header_text in headers:
+            self.cell(col_width, row_height, header_text, 1, 0, 'C')
+        self.ln()
+        self.set_font('Helvetica', '', 8)
+
+    def add_table(self, table: ReportTable, row_height: float = 7, max_chars: int = 25,
+                  progress: Optional[ProgressCallback] = None):
+        self.chapter_title(table.title)
+        if not table.columns or table.row_count == 0:
+            self.set_font('Helvetica', 'I', 10)
+            self.cell(0, 10, "Sin datos para mostrar", 1, 1, 'C')
+            self.ln(5)
+            return
+
+        col_width = 190 / len(table.columns)
+        headers = _clean_column(list(table.columns.keys()), max_chars)
+        cells = [_clean_column(values, max_chars) for values in table.columns.values()]
+        self._table_header(headers, col_width, row_height)
+
+        total = table.row_count
+        for i, row in enumerate(zip(*cells), start=1):
+            # Salto de página manual para repetir el encabezado de la tabla
+            if self.get_y() + row_height > self.page_break_trigger:
+                self.add_page()
+                self._table_header(headers, col_width, row_height)
+            for text in row:
+                self.cell(col_width, row_height, text, 1, 0, 'C')
+            self.ln()
+            if progress and i % 500 == 0:
+                progress(i / total)
+        self.ln(10)
+
+# --- DATOS DE CADA REPORTE ---
+
+def admissions_detail_statement(start: datetime, end: datetime):
+    """Admisiones del rango [start, end) con paciente y empresa (usa ix_admisiones_fecha_ingreso)"""
+    return select(
+        func.to_char(Admision.fecha_ingreso, 'DD/MM/YYYY HH24:MI').label("Fecha"),
+        Paciente.numero_documento.label("Documento"),
+        (Paciente.apellidos + ", " + Paciente.nombres).label("Paciente"),
+        Empresa.razon_social.label("Empresa"),
+        Admision.puesto_postula.label("Puesto"),
+        Admision.estado_global.label("Estado"),
+    ).join(Paciente, Admision.paciente_id == Paciente.id).outerjoin(
+        Empresa, Admision.empresa_id == Empresa.id
+    ).where(
+        Admision.fecha_ingreso >= start, Admision.fecha_ingreso < end
+    ).order_by(Admision.fecha_ingreso, Admision.id)
+
+def fetch_columns(db: Session, stmt) -> Dict[str, Tuple[Any, ...]]:
+    """Ejecuta y transpone a columnas (una tupla por columna)"""
+    result = db.execute(stmt)
+    keys = list(result.keys())
+    rows = result.all()
+    if not rows:
+        return {k: () for k in keys}
+    return dict(zip(keys, zip(*rows)))
+
+def data_version(db: Session, start: datetime, end: datetime) -> Tuple[int, int]:
+    """
+    Huella barata de los datos del rango (index-only scan sobre fecha_ingreso): cambia con
+    cada admisión nueva o eliminada. Los cambios de estado los cubre el TTL de la caché.
+    """
+    row = db.execute(
+        select(func.count(Admision.id), func.coalesce(func.max(Admision.id), 0)).where(
+            Admision.fecha_ingreso >= start, Admision.fecha_ingreso < end
+        )
+    ).one()
+    return int(row[0]), int(row[1])
+
+def render_summary(data: Dict[str, Any], progress: Optional[ProgressCallback] = None) -> bytes:
+    pdf = PDFReport()
+    pdf.add_page()
+
+    # 1. KPIs
+    pdf.chapter_title("1. Indicadores del Dia (KPIs)")
+    pdf.kpi_grid(data["kpis"])
+
+    # 2. Tabla Top Empresas
+    empresas = data["top_empresas"]
+    if empresas:
+        pdf.add_table(ReportTable("2. Top Empresas del Mes", {
+            "Empresa": [r["empresa"] for r in empresas],
+            "Admisiones": [r["admisiones"] for r in empresas],
+        }), row_height=10)
+    else:
+        pdf.chapter_title("2. Top Empresas")
+        pdf.set_font('Helvetica', 'I', 10)
+        pdf.cell(0, 10, "No hay datos registrados este mes.", 0, 1)
+        pdf.ln(5)
+
+    # 3. Tabla Últimos Ingresos
+    ultimos = data["ultimos"]
+    if ultimos:
+        pdf.add_table(ReportTable("3. Registro de Ultimos Ingresos", {
+            "Paciente": [r["paciente"] for r in ultimos],
+            "Empresa": [r["empresa"] for r in ultimos],
+            "Hora": [r["hora"] for r in ultimos],
+        }), row_height=10)
+    if progress:
+        progress(1.0)
+    return bytes(pdf.output())
+
+def render_detail(columns: Dict[str, Sequence[Any]], start: datetime, end: datetime,
+                  progress: Optional[ProgressCallback] = None) -> bytes:
+    pdf = PDFReport()
+    pdf.add_page()
+    last_day = (end - timedelta(days=1)).strftime('%d/%m/%Y')
+    table = ReportTable(f"Admisiones del {start.strftime('%d/%m/%Y')} al {last_day}", columns)
+    pdf.set_font('Helvetica', '', 10)
+    pdf.cell(0, 8, f"Total de admisiones: {table.row_count:,}", 0, 1)
+    pdf.add_table(table, progress=progress)
+    return bytes(pdf.output())
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+
+class ReportJob:
+    def __init__(self, key: Tuple, file_name: str):
+        self.key = key
+        self.file_name = file_name
+        self.progress = 0.0
+        self.stage = "En cola"
+        self.started_at = time.monotonic()
+        self.elapsed: Optional[float] = None
+        self.result: Optional[bytes] = None
+        self.error: Optional[str] = None
+        self.done = threading.Event()
+
+    def update(self, progress: float, stage: Optional[str] = None):
+        self.progress = max(self.progress, min(progress, 1.0))
+        if stage:
+            self.stage = stage
+
+    def finish(self, result: Optional[bytes] = None, error: Optional[str] = None):
+        self.result = result
+        self.error = error
+        self.elapsed = time.monotonic() - self.started_at
+        self.progress = 1.0
+        self.stage = "Listo" if error is None else "Error"
+        self.done.set()
+
+class ReportEngine:
+    def __init__(self, workers: int, cache_size: int = 16, cache_ttl: float = 600.0):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-pdf")
+        self._lock = threading.Lock()
+        self._jobs: Dict[Tuple, ReportJob] = {}
+        self._cache: "OrderedDict[Tuple, Tuple[float, ReportJob]]" = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+
+    def _cached(self, key: Tuple) -> Optional[ReportJob]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        stored_at, job = entry
+        if time.monotonic() - stored_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return job
+
+    def request(self, db: Session, report_type: str, start: date, end: date) -> ReportJob:
+        """
+        Devuelve el trabajo del reporte [start, end] (fechas inclusive): desde la caché,
+        uno en curso con la misma clave o uno nuevo encolado en el pool.
+        """
+        if report_type not in REPORT_TYPES:
+            raise ValueError(f"Tipo de reporte desconocido: {report_type}")
+        range_start, _ = dashboard_queries.day_range(start)
+        _, range_end = dashboard_queries.day_range(end)
+        key = (report_type, start, end, data_version(db, range_start, range_end))
+
+        with self._lock:
+            job = self._cached(key) or self._jobs.get(key)
+            if job is not None:
+                return job
+            suffix = start.strftime('%Y%m%d') if start == end else f"{start.strftime('%Y%m%d')}_{end.strftime('%Y%m%d')}"
+            job = ReportJob(key, f"Reporte_SisoAI_{report_type}_{suffix}.pdf")
+            self._jobs[key] = job
+        self._pool.submit(self._run, job, report_type, start, range_start, range_end)
+        return job
+
+    def _run(self, job: ReportJob, report_type: str, day: date, range_start: datetime, range_end: datetime):
+        db = SessionLocal()
+        try:
+            job.update(0.02, "Consultando datos")
+            if report_type == RESUMEN:
+                data = dashboard_queries.query_dashboard(db, day)
+                db.close()
+                job.update(0.3, "Generando PDF")
+                result = render_summary(data, lambda p: job.update(0.3 + 0.7 * p))
+            else:
+                columns = fetch_columns(db, admissions_detail_statement(range_start, range_end))
+                db.close()
+                job.update(0.1, "Generando PDF")
+                result = render_detail(columns, range_start, range_end, lambda p: job.update(0.1 + 0.85 * p))
+            job.finish(result=result)
+            logger.info(f"Reporte {job.file_name}: {len(result):,} bytes en {job.elapsed:.1f} s")
+        except Exception as e:
+            logger.exception("Error generando reporte PDF:")
+            job.finish(error=str(e))
+        finally:
+            db.close()
+            with self._lock:
+                self._jobs.pop(job.key, None)
+                if job.error is None:
+                    self._cache[job.key] = (time.monotonic(), job)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+
+# Instancia única del proceso
+report_engine = ReportEngine(workers=settings.REPORT_WORKERS, cache_ttl=settings.REPORT_CACHE_TTL)
@@ -0,0 +1,142 @@
+import hmac
+import time
+import hashlib
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+from jose import jwt, JWTError
+from passlib.context import CryptContext
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- HASHING DE CONTRASEÑAS ---
+# bcrypt con costo configurable (BCRYPT_ROUNDS). Si el costo sube, los hashes viejos se
+# marcan como obsoletos y se regeneran en el siguiente login exitoso (rehash-on-login).
+# bcrypt corre en el hilo del script (no hay otro trabajo del login con el cual solaparlo),
+# pero bajo un semáforo: en el cambio de turno 100 logins simultáneos no ocupan 100 CPUs sino
+# HASH_CONCURRENCY (PASSWORD_HASH_WORKERS, dejando siempre un núcleo libre), y el resto del
+# servidor sigue respondiendo. Los re-ingresos no pagan bcrypt (VerificationCache).
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS,
+)
+
+HASH_CONCURRENCY = max(1, min(settings.PASSWORD_HASH_WORKERS, (os.cpu_count() or 1) - 1))
+_hash_slots = threading.BoundedSemaphore(HASH_CONCURRENCY)
+
+def _is_legacy(stored: str) -> bool:
+    # Usuarios creados antes del hashing: texto plano o "hashed_<clave>"
+    return pwd_context.identify(stored) is None
+
+def _verify_legacy(password: str, stored: str) -> bool:
+    candidate = stored[len("hashed_"):] if stored.startswith("hashed_") else stored
+    return hmac.compare_digest(candidate.encode(), password.encode())
+
+class VerificationCache:
+    """
+    Recuerda verificaciones EXITOSAS por unos minutos (re-login tras una reconexión).
+    La clave es un HMAC de (hash almacenado, contraseña): no guarda la contraseña y
+    queda obsoleta sola si el hash cambia. Un intento fallido nunca se cachea, así que
+    adivinar contraseñas sigue pagando el costo completo de bcrypt.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[bytes, float] = {}
+
+    def _key(self, password: str, stored: str) -> bytes:
+        message = stored.encode() + b"\0" + password.encode()
+        return hmac.new(settings.SECRET_KEY.encode(), message, hashlib.sha256).digest()
+
+    def hit(self, password: str, stored: str) -> bool:
+        key = self._key(password, stored)
+        with self._lock:
+            expires = self._entries.get(key)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False
+            return True
+
+    def remember(self, password: str, stored: str):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._entries) > 10000:
+                self._entries = {k: exp for k, exp in self._entries.items() if exp >= now}
+            self._entries[self._key(password, stored)] = now + self.ttl
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+verification_cache = VerificationCache(settings.PASSWORD_VERIFY_CACHE_TTL)
+
+def _verify(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    # Se llama con un cupo de _hash_slots tomado
+    if not stored:
+        # Usuario inexistente o sin clave: mismo costo que una verificación real (no revela qué emails existen)
+        pwd_context.dummy_verify()
+        return False, None
+    if _is_legacy(stored):
+        if not _verify_legacy(password, stored):
+            return False, None
+        return True, pwd_context.hash(password)
+    return pwd_context.verify_and_update(password, stored)
+
+def hash_password(password: str) -> str:
+    """Hash bcrypt (espera un cupo de hashing)"""
+    with _hash_slots:
+        return pwd_context.hash(password)
+
+def verify_password(password: str, stored: Optional[str]) -> Tuple[bool, Optional[str]]:
+    """
+    Devuelve (válida, nuevo_hash). nuevo_hash no es None cuando el hash almacenado
+    es legado u obsoleto (costo distinto): el llamador debe guardarlo.
+    """
+    if stored and not _is_legacy(stored) and verification_cache.hit(password, stored):
+        return True, None
+    with _hash_slots:
+        valid, new_hash = _verify(password, stored)
+    if valid:
+        verification_cache.remember(password, new_hash or stored)
+    return valid, new_hash
+
+# --- TOKENS DE SESIÓN (JWT) ---
+# El token firmado lleva los datos que las páginas necesitan (id, email, rol, nombre) y la
+# versión de credenciales del usuario (Usuario.token_version): al subirla en la BD (logout)
+# todos los tokens emitidos antes dejan de valer. Ver session_auth.restore_session.
+
+def create_access_token(user: Dict[str, Any], expires_minutes: Optional[int] = None) -> str:
+    now = datetime.now(timezone.utc)
+    expire = now + timedelta(minutes=expires_minutes or settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+    claims = {
+        "sub": user["id"],
+        "email": user["email"],
+        "rol": user["rol"],
+        "nombre": user["nombre"],
+        "ver": user.get("token_version", 0),
+        "iat": now,
+        "exp": expire,
+    }
+    return jwt.encode(claims, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
+
+def decode_access_token(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Datos del usuario si el token es válido y no expiró; None en otro caso"""
+    if not token:
+        return None
+    try:
+        claims = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError as e:
+        logger.info(f"Token de sesión rechazado: {e}")
+        return None
+    return {
+        "id": claims["sub"], "email": claims["email"], "rol": claims["rol"], "nombre": claims["nombre"],
+        "token_version": claims.get("ver", 0), "iat": claims["iat"],
+    }
@@ -0,0 +1,112 @@
+import time
+import logging
+import streamlit as st
+from typing import Any, Dict, Optional
+from config import settings
+from database import get_session, release_session
+from models import Usuario
+from security import create_access_token, decode_access_token
+
+logger = logging.getLogger(__name__)
+
+# --- SESIÓN PERSISTENTE ---
+# st.session_state se pierde al refrescar la página o si se corta el websocket.
+# El JWT de la sesión viaja en la URL (?session=...): al volver, cualquier página
+# reconstruye el usuario sin pedir login.
+#
+# Una URL se copia, queda en el historial y en los logs del proxy, así que el token es de
+# vida corta (ACCESS_TOKEN_EXPIRE_MINUTES) y se renueva mientras la sesión se usa. Al
+# restaurar desde la URL, y cada SESSION_RECHECK_SECONDS dentro de la sesión, se recarga el
+# usuario: si está inactivo o su token_version cambió (logout) el token se rechaza.
+
+TOKEN_PARAM = "session"
+
+def _url_token():
+    return st.experimental_get_query_params().get(TOKEN_PARAM, [None])[0]
+
+def _set_url_token(token):
+    params = st.experimental_get_query_params()
+    if token:
+        params[TOKEN_PARAM] = token
+    else:
+        params.pop(TOKEN_PARAM, None)
+    st.experimental_set_query_params(**params)
+
+def _issue_token(user: Dict[str, Any]):
+    token = create_access_token(user)
+    st.session_state.authenticated = True
+    st.session_state.user = user
+    st.session_state.token = token
+    st.session_state.token_checked_at = time.monotonic()
+    _set_url_token(token)
+
+def _current_user(claims: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Datos vigentes del usuario del token; None si no existe, está inactivo o el token es de una versión anterior"""
+    db = get_session()
+    try:
+        row = db.query(
+            Usuario.id, Usuario.email, Usuario.rol, Usuario.nombre_completo,
+            Usuario.activo, Usuario.token_version,
+        ).filter(Usuario.id == claims["id"]).first()
+    finally:
+        release_session(db)
+    if row is None or not row.activo or row.token_version != claims["token_version"]:
+        logger.info(f"Token de sesión revocado para el usuario {claims['id']}")
+        return None
+    return {
+        "id": str(row.id), "email": row.email, "rol": row.rol,
+        "nombre": row.nombre_completo, "token_version": row.token_version,
+    }
+
+def _clear_session():
+    st.session_state.authenticated = False
+    st.session_state.user = None
+    st.session_state.pop("token", None)
+    st.session_state.pop("token_checked_at", None)
+    _set_url_token(None)
+
+def start_session(user: Dict[str, Any]):
+    """Emite el token tras un login exitoso (user incluye token_version)"""
+    _issue_token(user)
+
+def restore_session() -> bool:
+    """Llamar al inicio de cada página. Devuelve True si hay un usuario autenticado."""
+    in_session = bool(st.session_state.get("authenticated") and st.session_state.get("token"))
+    token = st.session_state.token if in_session else _url_token()
+    claims = decode_access_token(token)
+    if claims is None:
+        if in_session or token:
+            _clear_session()
+        return False
+
+    elapsed = time.monotonic() - st.session_state.get("token_checked_at", 0.0)
+    if not in_session or elapsed >= settings.SESSION_RECHECK_SECONDS:
+        user = _current_user(claims)
+        if user is None:
+            _clear_session()
+            return False
+        # Rotación: el token de la URL se reemplaza por uno nuevo con los datos vigentes
+        _issue_token(user)
+        return True
+
+    # La navegación entre páginas puede descartar la URL: se vuelve a fijar el token
+    if _url_token() != token:
+        _set_url_token(token)
+    return True
+
+def end_session():
+    """Cierra la sesión y revoca todos los tokens emitidos para el usuario (también las URLs copiadas)"""
+    user = st.session_state.get("user")
+    if user:
+        db = get_session()
+        try:
+            db.query(Usuario).filter(Usuario.id == user["id"]).update(
+                {Usuario.token_version: Usuario.token_version + 1}, synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"No se pudo revocar la sesión de {user['id']}: {e}")
+        finally:
+            release_session(db)
+    _clear_session()
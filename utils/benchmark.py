@@ -0,0 +1,1021 @@
+import sys
+import asyncio
+import time
+import random
+import importlib.util
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+
+# Configuración de rutas para importar models y database
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from sqlalchemy import event, text, func, and_, or_, extract, select
+from database import SessionLocal, engine, Base, unit_of_work, replica_engine, replica_router, read_session
+from models import Admision, Empresa, HojaRutaExamenes, Paciente, ProtocoloDetalle, Protocolo, CatalogoExamenes, ResultadoClinico
+import dashboard_queries
+from aggregate_cache import dashboard_cache
+import patient_search
+import admission_intake
+import security
+import clinical_results
+import report_engine
+import async_database
+import certificates
+
+# --- INSTRUMENTACIÓN ---
+
+class Counter:
+    """Cuenta sentencias enviadas al servidor y conexiones tomadas del pool"""
+    def __init__(self):
+        self.statements = 0
+        self.checkouts = 0
+
+    def on_execute(self, *args, **kwargs):
+        self.statements += 1
+
+    def on_checkout(self, *args, **kwargs):
+        self.checkouts += 1
+
+@contextmanager
+def counting():
+    counter = Counter()
+    event.listen(engine, "before_cursor_execute", counter.on_execute)
+    event.listen(engine.pool, "checkout", counter.on_checkout)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", counter.on_execute)
+        event.remove(engine.pool, "checkout", counter.on_checkout)
+
+def measure(label, fn, repeat):
+    """Ejecuta fn `repeat` veces e imprime latencia p50/p99, sentencias y checkouts por ejecución"""
+    fn()  # Calentamiento (caché de planes y del pool)
+    timings = []
+    with counting() as counter:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - t0) * 1000)
+    timings.sort()
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    print(
+        f"{label:<28} p50={statistics.median(timings):8.2f} ms  p99={p99:8.2f} ms  "
+        f"sentencias={counter.statements / repeat:.1f}  checkouts={counter.checkouts / repeat:.1f}"
+    )
+    return timings
+
+# --- DATA SINTÉTICA ---
+
+def seed_large(admisiones: int, empresas: int = 200):
+    """Genera data sintética masiva directamente en el servidor (generate_series)"""
+    print(f"🏭 Generando {admisiones:,} admisiones sintéticas...")
+    Base.metadata.create_all(bind=engine)
+    pacientes = max(admisiones // 2, 1)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO empresas (ruc, razon_social, rubro)
+            SELECT lpad((30000000000 + g)::text, 11, '0'), 'Empresa Bench ' || g, 'Benchmark'
+            FROM generate_series(1, :n) g
+            ON CONFLICT (ruc) DO NOTHING
+        """), {"n": empresas})
+        conn.execute(text("""
+            INSERT INTO catalogo_examenes (codigo_interno, nombre, categoria, precio_base, activo)
+            SELECT 'BENCH-' || g, 'Examen Bench ' || g, 'Benchmark', 50, true
+            FROM generate_series(1, 10) g
+            ON CONFLICT (codigo_interno) DO NOTHING
+        """))
+        conn.execute(text("""
+            INSERT INTO pacientes (numero_documento, nombres, apellidos, fecha_nacimiento)
+            SELECT lpad((90000000 + g)::text, 8, '0') || 'B', 'Nombre' || g, 'Apellido' || (g % 5000),
+                   date '1970-01-01' + (g % 15000)
+            FROM generate_series(1, :n) g
+            ON CONFLICT (numero_documento) DO NOTHING
+        """), {"n": pacientes})
+        conn.execute(text("""
+            INSERT INTO admisiones (paciente_id, empresa_id, fecha_ingreso, estado_global)
+            SELECT p.id, e.id,
+                   now() - (random() * interval '365 days'),
+                   (ARRAY['En Circuito', 'Auditoria', 'Cerrado', 'Cerrado', 'Anulado'])[1 + (g % 5)]
+            FROM generate_series(1, :n) g
+            JOIN (SELECT id, row_number() OVER () AS rn FROM pacientes WHERE numero_documento LIKE '%B') p
+              ON p.rn = 1 + (g % :p)
+            JOIN (SELECT id, row_number() OVER () AS rn FROM empresas WHERE rubro = 'Benchmark') e
+              ON e.rn = 1 + (g % :e)
+        """), {"n": admisiones, "p": pacientes, "e": empresas})
+        conn.execute(text("""
+            INSERT INTO hoja_ruta_examenes (admision_id, examen_id, estado, fecha_realizado)
+            SELECT a.id, c.id,
+                   CASE WHEN random() < 0.6 THEN 'Realizado' ELSE 'Pendiente' END,
+                   a.fecha_ingreso + interval '2 hours'
+            FROM admisiones a
+            CROSS JOIN LATERAL (
+                SELECT id FROM catalogo_examenes WHERE codigo_interno LIKE 'BENCH-%' ORDER BY id LIMIT 3
+            ) c
+            WHERE NOT EXISTS (SELECT 1 FROM hoja_ruta_examenes h WHERE h.admision_id = a.id)
+        """))
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE"))
+    print("✅ Data sintética generada.")
+
+NOMBRES = ["José", "María", "Jesús", "Ángel", "Sofía", "Andrés", "Lucía", "Martín", "Inés", "Raúl", "Rocío", "Iván"]
+APELLIDOS = ["Pérez", "Gómez", "Ñahui", "Quispe", "Mamani", "Rodríguez", "Sánchez", "Díaz", "Álvarez", "Ramírez",
+             "Huamán", "Flores", "Chávez", "Vásquez", "Núñez", "Castañeda"]
+
+def seed_patients(pacientes: int):
+    """Genera pacientes con nombres y apellidos con tildes para el benchmark de búsqueda"""
+    print(f"🧑 Generando {pacientes:,} pacientes sintéticos...")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO pacientes (numero_documento, nombres, apellidos, fecha_nacimiento)
+            SELECT lpad((10000000 + g)::text, 8, '0'),
+                   (:nombres)[1 + (g % array_length(:nombres, 1))],
+                   (:apellidos)[1 + (g % array_length(:apellidos, 1))] || ' ' ||
+                   (:apellidos)[1 + ((g / 7) % array_length(:apellidos, 1))] || ' ' || (g % 997),
+                   date '1970-01-01' + (g % 15000)
+            FROM generate_series(1, :n) g
+            ON CONFLICT (numero_documento) DO NOTHING
+        """), {"n": pacientes, "nombres": NOMBRES, "apellidos": APELLIDOS})
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE pacientes"))
+    print("✅ Pacientes generados.")
+
+BENCH_RESULT_EXAMS = {
+    "BENCH-TRIAJE": "Triaje (bench)",
+    "BENCH-AUDIO": "Audiometría (bench)",
+    "BENCH-ESPIRO": "Espirometría (bench)",
+}
+
+def seed_results(resultados: int):
+    """Un resultado clínico por admisión (requiere `seed`): triaje, audiometría o espirometría según el id"""
+    print(f"🧾 Generando {resultados:,} resultados clínicos sintéticos...")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for codigo, nombre in BENCH_RESULT_EXAMS.items():
+            conn.execute(text("""
+                INSERT INTO catalogo_examenes (codigo_interno, nombre, categoria, precio_base, activo)
+                VALUES (:codigo, :nombre, 'Otros', 0, false)
+                ON CONFLICT (codigo_interno) DO NOTHING
+            """), {"codigo": codigo, "nombre": nombre})
+        conn.execute(text("""
+            WITH ex AS (
+                SELECT array_agg(id ORDER BY array_position(ARRAY['BENCH-TRIAJE', 'BENCH-AUDIO', 'BENCH-ESPIRO'], codigo_interno)) AS ids
+                FROM catalogo_examenes WHERE codigo_interno IN ('BENCH-TRIAJE', 'BENCH-AUDIO', 'BENCH-ESPIRO')
+            ), adm AS (
+                SELECT id, id % 3 AS tipo, random() AS r FROM admisiones ORDER BY id LIMIT :n
+            )
+            INSERT INTO resultados_clinicos (admision_id, examen_id, datos_tecnicos)
+            SELECT adm.id, ex.ids[adm.tipo + 1],
+                   CASE adm.tipo
+                       WHEN 0 THEN jsonb_build_object(
+                           'imc', round((17 + adm.r * 23)::numeric, 2),
+                           'pa_sistolica', 95 + (adm.id % 70), 'pa_diastolica', 60 + (adm.id % 40))
+                       WHEN 1 THEN jsonb_build_object(
+                           'od_4000', (adm.r * 90)::int, 'oi_4000', (adm.id % 91))
+                       ELSE jsonb_build_object(
+                           'fev1_fvc', 40 + (adm.r * 55)::int, 'fvc', round((2 + adm.r * 3)::numeric, 1))
+                   END
+            FROM adm, ex
+            ON CONFLICT (admision_id, examen_id) DO NOTHING
+        """), {"n": resultados})
+        # Copia tipada de los triajes sintéticos (lo que hace upsert_vitals al guardar)
+        conn.execute(text("""
+            INSERT INTO signos_vitales (admision_id, fecha_registro, imc, pa_sistolica, pa_diastolica)
+            SELECT r.admision_id, a.fecha_ingreso, f_jsonb_num(r.datos_tecnicos, 'imc'),
+                   f_jsonb_num(r.datos_tecnicos, 'pa_sistolica'), f_jsonb_num(r.datos_tecnicos, 'pa_diastolica')
+            FROM resultados_clinicos r
+            JOIN admisiones a ON a.id = r.admision_id
+            JOIN catalogo_examenes e ON e.id = r.examen_id AND e.codigo_interno = 'BENCH-TRIAJE'
+            ON CONFLICT (admision_id) DO NOTHING
+        """))
+    with engine.connect() as conn:
+        conn.execute(text("ANALYZE resultados_clinicos"))
+        conn.execute(text("ANALYZE signos_vitales"))
+    print("✅ Resultados generados.")
+
+# --- ESCENARIOS ---
+
+def legacy_dashboard():
+    """Reproduce el patrón anterior: 8 consultas repartidas en 5 sesiones"""
+    today = time.strftime("%Y-%m-%d")
+    db = SessionLocal()
+    try:
+        db.query(func.count(Admision.id)).filter(func.date(Admision.fecha_ingreso) == today).scalar()
+        db.query(func.count(Admision.id)).filter(Admision.estado_global == "En Circuito").scalar()
+        db.query(func.count(Empresa.id)).scalar()
+        db.query(func.count(HojaRutaExamenes.id)).filter(and_(
+            HojaRutaExamenes.estado == "Realizado",
+            func.date(HojaRutaExamenes.fecha_realizado) == today
+        )).scalar()
+    finally:
+        db.close()
+    for widget in (
+        lambda db: db.query(Empresa.razon_social, func.count(Admision.id)).join(
+            Admision, Empresa.id == Admision.empresa_id
+        ).filter(
+            extract('month', Admision.fecha_ingreso) == int(today[5:7]),
+            extract('year', Admision.fecha_ingreso) == int(today[:4])
+        ).group_by(Empresa.razon_social).order_by(func.count(Admision.id).desc()).limit(5).all(),
+        lambda db: db.query(Admision.estado_global, func.count(Admision.id)).group_by(Admision.estado_global).all(),
+        lambda db: db.query(func.extract('hour', Admision.fecha_ingreso).label('hora'), func.count(Admision.id)).filter(
+            func.date(Admision.fecha_ingreso) == today
+        ).group_by('hora').all(),
+        lambda db: db.query(Paciente.nombres, Empresa.razon_social, Admision.fecha_ingreso).join(
+            Admision, Paciente.id == Admision.paciente_id
+        ).join(Empresa, Admision.empresa_id == Empresa.id).order_by(Admision.fecha_ingreso.desc()).limit(10).all(),
+    ):
+        db = SessionLocal()
+        try:
+            widget(db)
+        finally:
+            db.close()
+
+def search_terms():
+    """Términos como los escribe recepción: DNI parcial, apellidos sin tilde, nombre + apellido"""
+    return [
+        str(random.randint(100, 999999)),
+        random.choice(APELLIDOS).lower().replace("é", "e").replace("í", "i").replace("á", "a"),
+        f"{random.choice(NOMBRES)} {random.choice(APELLIDOS)}",
+    ]
+
+def legacy_search(term):
+    db = SessionLocal()
+    try:
+        db.query(Paciente).filter(or_(
+            Paciente.numero_documento.ilike(f"%{term}%"),
+            Paciente.nombres.ilike(f"%{term}%"),
+            Paciente.apellidos.ilike(f"%{term}%")
+        )).limit(10).all()
+    finally:
+        db.close()
+
+def service_search(term):
+    db = SessionLocal()
+    try:
+        patient_search.search_patients(db, term, limit=10)
+    finally:
+        db.close()
+
+def bench_search(repeat: int):
+    print("🔍 Búsqueda de pacientes: ILIKE vs. trigram")
+    random.seed(42)
+    terms = [t for _ in range(repeat) for t in search_terms()]
+    legacy_iter, service_iter = iter(terms * 2), iter(terms * 2)
+    measure("legacy ILIKE", lambda: legacy_search(next(legacy_iter)), len(terms))
+    measure("patient_search (pg_trgm)", lambda: service_search(next(service_iter)), len(terms))
+
+def consolidated_dashboard():
+    """Ruta del reporte resumen: todas las métricas en una sola sentencia"""
+    db = SessionLocal()
+    try:
+        dashboard_queries.query_dashboard(db)
+    finally:
+        db.close()
+
+def sequential_widgets():
+    """Caché fría: los cinco widgets uno tras otro con la sesión del rerun (DASHBOARD_WORKERS=0)"""
+    dashboard_cache.clear()
+    with unit_of_work():
+        return list(dashboard_queries.stream_widgets(parallel=False))
+
+def parallel_widgets():
+    """Caché fría: los cinco widgets en el pool del dashboard (carga por defecto)"""
+    dashboard_cache.clear()
+    with unit_of_work():
+        return list(dashboard_queries.stream_widgets())
+
+def bench_dashboard(repeat: int):
+    print("📊 Dashboard: antes vs. después")
+    measure("legacy (8 consultas)", legacy_dashboard, repeat)
+    measure("consolidado (reporte)", consolidated_dashboard, repeat)
+    measure("widgets secuenciales", sequential_widgets, repeat)
+    measure("widgets en paralelo", parallel_widgets, repeat)
+    for r in parallel_widgets():
+        print(f"  {r.widget:<14} {r.elapsed_ms:8.2f} ms" + (f"  ❌ {r.error}" if r.error else ""))
+
+# --- MOTOR ASÍNCRONO ---
+
+def sequential_searches(terms):
+    db = SessionLocal()
+    try:
+        for term in terms:
+            patient_search.search_patients(db, term, limit=10)
+    finally:
+        db.close()
+
+async def concurrent_searches(terms):
+    async def one(term):
+        async with async_database.async_session() as db:
+            return await patient_search.search_patients_async(db, term, limit=10)
+    return await asyncio.gather(*(one(t) for t in terms))
+
+def bench_async(repeat: int):
+    print("⚡ Motor síncrono vs. asíncrono (asyncpg)")
+    measure("widgets secuenciales", sequential_widgets, repeat)
+    measure("widgets async (gather)", lambda: async_database.run_sync(dashboard_queries.load_widgets_async()), repeat)
+    random.seed(42)
+    terms = [t for _ in range(5) for t in search_terms()]
+    measure(f"{len(terms)} búsquedas secuenciales", lambda: sequential_searches(terms), repeat)
+    measure(f"{len(terms)} búsquedas async", lambda: async_database.run_sync(concurrent_searches(terms)), repeat)
+
+# --- RÉPLICA DE LECTURA ---
+
+def served_by_replica(db) -> bool:
+    return bool(db.execute(text("SELECT pg_is_in_recovery()")).scalar())
+
+def write_company(ruc: str):
+    db = SessionLocal()
+    try:
+        db.add(Empresa(ruc=ruc, razon_social=f"BENCH-REPLICA {ruc}"))
+        db.commit()
+    finally:
+        db.close()
+
+def read_company(ruc: str):
+    """(encontrada, leída en la réplica)"""
+    with read_session() as db:
+        found = db.query(Empresa.id).filter(Empresa.ruc == ruc).first() is not None
+        return found, served_by_replica(db)
+
+def check_replica(escrituras: int):
+    """Enrutamiento a la réplica, read-your-writes y vuelta al primario con la réplica pausada"""
+    if replica_engine is None:
+        print("Configure REPLICA_DATABASE_URL con un standby (ver README, Réplica de lectura).")
+        sys.exit(1)
+    print("🪞 Verificando la réplica de lectura...")
+    replica_router._checked_at = float("-inf")
+    replica_router.use_replica()
+    status = replica_router.status()
+    print(f"   estado={status['estado']}  retraso={status['retraso_s']}")
+    if not status["en_uso"]:
+        print("❌ La réplica no está disponible")
+        sys.exit(1)
+
+    failures = []
+    prefix = f"9{random.randint(0, 99):02d}"
+    rucs = [f"{prefix}{i:08d}" for i in range(escrituras + 1)]
+    try:
+        # 1. Lecturas sin escrituras previas: deben ir a la réplica
+        with read_session() as db:
+            if not served_by_replica(db):
+                failures.append("una lectura sin escrituras pendientes no fue a la réplica")
+
+        # 2. Read-your-writes: cada lectura inmediata ve la escritura recién confirmada
+        on_replica = 0
+        for ruc in rucs[:-1]:
+            write_company(ruc)
+            found, replica = read_company(ruc)
+            on_replica += replica
+            if not found:
+                failures.append(f"la lectura no vio la escritura {ruc}")
+        print(f"   read-your-writes: {escrituras} escrituras, {on_replica} lecturas en réplica, "
+              f"{escrituras - on_replica} en primario")
+
+        # 3. Réplica atrasada (replay en pausa): la lectura debe volver al primario
+        try:
+            with replica_engine.connect() as conn:
+                conn.execute(text("SELECT pg_wal_replay_pause()"))
+                conn.commit()
+        except Exception as e:
+            print(f"   ⚠️ No se pudo pausar el replay ({e.__class__.__name__}): se omite la prueba de retraso")
+        else:
+            try:
+                write_company(rucs[-1])
+                found, replica = read_company(rucs[-1])
+                if not found or replica:
+                    failures.append("con el replay en pausa la lectura no volvió al primario")
+                else:
+                    print("   réplica en pausa: la lectura fue al primario y vio la escritura")
+            finally:
+                with replica_engine.connect() as conn:
+                    conn.execute(text("SELECT pg_wal_replay_resume()"))
+                    conn.commit()
+    finally:
+        with engine.begin() as conn:
+            conn.execute(Empresa.__table__.delete().where(Empresa.ruc.in_(rucs)))
+
+    if failures:
+        for f in failures:
+            print(f"❌ {f}")
+        sys.exit(1)
+    print("✅ Réplica: enrutamiento, read-your-writes y vuelta al primario correctos")
+
+# --- CARGA MASIVA ---
+
+def campaign_rows(n: int):
+    return [{
+        "numero_documento": f"C{i:09d}",
+        "nombres": random.choice(NOMBRES),
+        "apellidos": f"{random.choice(APELLIDOS)} {random.choice(APELLIDOS)}",
+        "fecha_nacimiento": date(1980 + i % 25, 1 + i % 12, 1 + i % 28),
+        "puesto_postula": "Operario",
+    } for i in range(n)]
+
+def legacy_intake(db, rows, company_id, protocol_id):
+    """Patrón anterior: un paciente, una admisión y una hoja de ruta por fila"""
+    for r in rows:
+        patient = Paciente(**{k: v for k, v in r.items() if k != "puesto_postula"})
+        db.add(patient)
+        db.flush()
+        admission = Admision(paciente_id=patient.id, empresa_id=company_id, protocolo_id=protocol_id,
+                             fecha_ingreso=datetime.now(), estado_global="En Circuito")
+        db.add(admission)
+        db.flush()
+        for detail in db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == protocol_id).all():
+            db.add(HojaRutaExamenes(admision_id=admission.id, examen_id=detail.examen_id, estado="Pendiente"))
+        db.flush()
+
+def bench_intake(admisiones: int, legacy_sample: int):
+    """Se ejecuta dentro de una transacción que se revierte: no deja datos"""
+    print(f"📦 Carga masiva de {admisiones:,} admisiones (transacción revertida)")
+    random.seed(7)
+    db = SessionLocal()
+    try:
+        detail = db.query(ProtocoloDetalle).first()
+        if not detail:
+            print("No hay protocolos con exámenes (ejecute utils/seed_real.py).")
+            sys.exit(1)
+        protocol_id = detail.protocolo_id
+        company_id = detail.protocolo.empresa_id
+        exams_per_admission = db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == protocol_id).count()
+    finally:
+        db.close()
+
+    for label, n, run in (
+        ("legacy (fila por fila)", legacy_sample, lambda db, rows: legacy_intake(db, rows, company_id, protocol_id)),
+        ("bulk_register_admissions", admisiones,
+         lambda db, rows: admission_intake.bulk_register_admissions(db, rows, company_id, protocol_id)),
+    ):
+        rows = campaign_rows(n)
+        db = SessionLocal()
+        try:
+            with counting() as counter:
+                t0 = time.perf_counter()
+                summary = run(db, rows)
+                elapsed = time.perf_counter() - t0
+        finally:
+            db.rollback()
+            db.close()
+        print(f"{label:<28} {n:>7,} filas  {elapsed:8.2f} s  {n / elapsed:10,.0f} adm/s  sentencias={counter.statements}")
+        # La hoja de ruta debe ser exactamente admisiones x exámenes del protocolo
+        if summary and summary["examenes"] != n * exams_per_admission:
+            print(f"❌ Hoja de ruta: {summary['examenes']} exámenes, se esperaban {n * exams_per_admission}")
+            sys.exit(1)
+
+# --- N+1 EN EL LISTADO DE PROTOCOLOS ---
+
+def legacy_protocol_listing(db, empresa_id):
+    """
+    Patrón anterior (filtrado por empresa): 1 consulta de protocolos + P de detalles, más las
+    cargas perezosas de empresa y examen. Estas pasan por el identity map: solo la primera
+    vez que aparece cada empresa / examen llegan a la BD, así que son 1 + E y no P + D.
+    """
+    for p in db.query(Protocolo).filter(Protocolo.empresa_id == empresa_id).all():
+        p.empresa.razon_social
+        for d in db.query(ProtocoloDetalle).filter(ProtocoloDetalle.protocolo_id == p.id).all():
+            d.examen.nombre
+
+def check_protocol_queries(protocolos: int, examenes: int):
+    """Siembra P protocolos x E exámenes en una transacción revertida y cuenta consultas del listado"""
+    print(f"📋 Listado de protocolos con {protocolos} protocolos x {examenes} exámenes (transacción revertida)")
+    configuracion = load_page("3_Configuracion.py", "configuracion")
+    db = SessionLocal()
+    try:
+        empresa = Empresa(ruc="39999999999", razon_social="Empresa Bench Protocolos")
+        exams = [CatalogoExamenes(codigo_interno=f"BPROT-{i}", nombre=f"Examen Protocolo {i}", precio_base=10.0)
+                 for i in range(examenes)]
+        db.add(empresa)
+        db.add_all(exams)
+        db.flush()
+        for i in range(protocolos):
+            proto = Protocolo(empresa_id=empresa.id, nombre_protocolo=f"Protocolo {i}", perfil_riesgo="Bench")
+            db.add(proto)
+            db.flush()
+            db.add_all([ProtocoloDetalle(protocolo_id=proto.id, examen_id=e.id, precio_acordado=9.0) for e in exams])
+        db.flush()
+
+        # Se captura antes de expire_all(): leer empresa.id después dispararía un refresh contado
+        empresa_id = empresa.id
+        results = {}
+        for label, run in (
+            ("legacy (lazy loads)", lambda: legacy_protocol_listing(db, empresa_id)),
+            ("get_protocol_tree", lambda: configuracion.get_protocol_tree(db, empresa_id)),
+        ):
+            db.expire_all()
+            with counting() as counter:
+                t0 = time.perf_counter()
+                run()
+                elapsed = (time.perf_counter() - t0) * 1000
+            results[label] = counter.statements
+            print(f"{label:<22} consultas={counter.statements:>6}  {elapsed:8.1f} ms")
+    finally:
+        db.rollback()
+        db.close()
+
+    expected_legacy = 1 + protocolos + 1 + examenes
+    print(f"{'legacy esperado':<22} consultas={expected_legacy:>6}  (1 + P + 1 empresa + E exámenes)")
+    if results["legacy (lazy loads)"] != expected_legacy:
+        print("⚠️ El patrón legado no coincide con el modelo 1 + P + 1 + E")
+    if results["get_protocol_tree"] != 1:
+        print("❌ Regresión: el listado de protocolos debe resolverse con una sola consulta")
+        sys.exit(1)
+    print("✅ Una sola consulta para el árbol de protocolos")
+
+# --- REGRESIÓN DE PLANES (EXPLAIN) ---
+
+def plan_nodes(plan):
+    """Recorre el árbol de EXPLAIN (FORMAT JSON) devolviendo (tipo de nodo, tabla)"""
+    yield plan["Node Type"], plan.get("Relation Name")
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def explain(conn, stmt):
+    compiled = stmt.compile(dialect=engine.dialect)
+    result = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params)
+    return result.scalar()[0]["Plan"]
+
+def check_plans():
+    """Falla si alguna consulta del dashboard recorre secuencialmente las tablas grandes"""
+    print("🔎 Verificando planes de ejecución (ejecutar sobre data sembrada con `seed`)...")
+    today = date.today()
+    statements = {
+        "kpis": dashboard_queries.kpis_statement(today),
+        "top_empresas": dashboard_queries.top_empresas_statement(today),
+        "estados": dashboard_queries.estados_statement(),
+        "flujo": dashboard_queries.flujo_statement(today),
+        "ultimos": dashboard_queries.ultimos_statement(),
+        "consolidado": dashboard_queries.dashboard_statement(today),
+    }
+    # admision_stats_estado es diminuta (una fila por estado): recorrerla es lo esperado
+    watched = {"admisiones", "hoja_ruta_examenes", "admision_stats_hourly"}
+    failures = []
+    with engine.connect() as conn:
+        for name, stmt in statements.items():
+            nodes = list(plan_nodes(explain(conn, stmt)))
+            seq = [table for node, table in nodes if node == "Seq Scan" and table in watched]
+            scans = sorted({f"{node} on {table}" for node, table in nodes if table in watched})
+            status = "❌" if seq else "✅"
+            print(f"{status} {name:<14} {', '.join(scans)}")
+            if seq:
+                failures.append(name)
+    if failures:
+        print(f"Regresión: Seq Scan en {', '.join(failures)}")
+        sys.exit(1)
+
+# --- CHECKOUTS POR RERUN ---
+
+def load_page(filename: str, name: str):
+    """Importa una página de Streamlit como módulo (sin ejecutar su main)"""
+    spec = importlib.util.spec_from_file_location(name, Path(project_root) / "pages" / filename)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def check_checkouts():
+    """Simula los helpers de BD de un rerun de Triaje y de Evaluación: debe haber un solo checkout"""
+    print("🔌 Verificando checkouts del pool por rerun...")
+    db = SessionLocal()
+    try:
+        admision = db.query(Admision).filter(Admision.estado_global == "En Circuito").first()
+    finally:
+        db.close()
+    if not admision:
+        print("No hay admisiones 'En Circuito' (ejecute utils/seed_real.py).")
+        sys.exit(1)
+
+    triaje = load_page("2_Triaje_Medico.py", "triaje_medico")
+    evaluacion = load_page("4_Evaluacion_Medica.py", "evaluacion_medica")
+
+    def triaje_render():
+        with unit_of_work():
+            adm = triaje.get_patient_active_admission(admision.paciente_id)
+            triaje.get_existing_triage_data(adm.id)
+
+    def evaluacion_render():
+        with unit_of_work():
+            evaluacion.get_pending_exams(admision.paciente_id)
+
+    failures = []
+    for label, render in (("Triaje", triaje_render), ("Evaluación", evaluacion_render)):
+        with counting() as counter:
+            render()
+        status = "✅" if counter.checkouts == 1 else "❌"
+        print(f"{status} {label:<12} checkouts={counter.checkouts} sentencias={counter.statements}")
+        if counter.checkouts != 1:
+            failures.append(label)
+    if failures:
+        sys.exit(1)
+
+# --- FILTROS POR VALORES TÉCNICOS (JSONB) ---
+
+TECHNICAL_FILTERS = [
+    [("imc", ">", 30)],
+    [("od_4000", ">", 40)],
+    [("fev1_fvc", "<", 70)],
+    [("imc", ">", 30), ("pa_sistolica", ">=", 140)],
+]
+
+def legacy_technical_count(conditions):
+    """Patrón anterior: traer todos los datos_tecnicos y filtrar en Python"""
+    db = SessionLocal()
+    try:
+        total = 0
+        for (datos,) in db.query(ResultadoClinico.datos_tecnicos).yield_per(10_000):
+            datos = datos or {}
+            if all(isinstance(datos.get(k), (int, float)) and clinical_results.OPERATORS[op](datos[k], v)
+                   for k, op, v in conditions):
+                total += 1
+        return total
+    finally:
+        db.close()
+
+def bench_technical(repeat: int):
+    print("🧪 Filtros por valores técnicos: Python vs. índices JSONB")
+    db = SessionLocal()
+    try:
+        total = db.query(func.count(ResultadoClinico.id)).scalar()
+    finally:
+        db.close()
+    print(f"resultados_clinicos: {total:,} filas")
+    failures = []
+    for conditions in TECHNICAL_FILTERS:
+        label = " y ".join(f"{k} {op} {v}" for k, op, v in conditions)
+        print(f"--- {label}")
+        t0 = time.perf_counter()
+        expected = legacy_technical_count(conditions)
+        print(f"{'legacy (Python)':<28} {(time.perf_counter() - t0) * 1000:10.1f} ms  coincidencias={expected:,}")
+
+        def run():
+            db = SessionLocal()
+            try:
+                return clinical_results.count_results(db, conditions)
+            finally:
+                db.close()
+
+        if run() != expected:
+            failures.append(label)
+        measure("count_results (JSONB)", run, repeat)
+
+        stmt = select(func.count(ResultadoClinico.id)).where(
+            *[clinical_results.technical_condition(*c) for c in conditions]
+        )
+        with engine.connect() as conn:
+            nodes = {node for node, table in plan_nodes(explain(conn, stmt)) if table or "Bitmap" in node}
+        print(f"{'plan':<28} {', '.join(sorted(nodes))}")
+    if failures:
+        print(f"❌ Conteos distintos a la referencia: {failures}")
+        sys.exit(1)
+
+# --- ESTADÍSTICAS DE SIGNOS VITALES ---
+
+def legacy_vitals_stats():
+    """Patrón anterior: decodificar el JSON de cada triaje y promediar en Python"""
+    db = SessionLocal()
+    try:
+        imcs = [datos["imc"] for (datos,) in db.query(ResultadoClinico.datos_tecnicos).filter(
+            ResultadoClinico.datos_tecnicos.has_key("imc")
+        ).yield_per(10_000) if isinstance(datos.get("imc"), (int, float))]
+        return sum(imcs) / len(imcs) if imcs else None, sum(1 for i in imcs if i >= 30)
+    finally:
+        db.close()
+
+def bench_vitals(repeat: int):
+    print("❤️  Estadísticas de signos vitales: JSON fila por fila vs. columnas tipadas")
+    start, end = datetime(2000, 1, 1), datetime(2100, 1, 1)
+
+    def summary():
+        db = SessionLocal()
+        try:
+            return clinical_results.vitals_summary(db, start, end)
+        finally:
+            db.close()
+
+    def numpy_columns():
+        db = SessionLocal()
+        try:
+            cols = clinical_results.vitals_columns(db, start, end, ("imc",))
+            return float(np.nanmean(cols["imc"])), int(np.count_nonzero(cols["imc"] >= 30))
+        finally:
+            db.close()
+
+    t0 = time.perf_counter()
+    legacy = legacy_vitals_stats()
+    print(f"{'legacy (JSON en Python)':<28} {(time.perf_counter() - t0) * 1000:10.1f} ms  imc_promedio={legacy[0]}  obesidad={legacy[1]:,}")
+    result = summary()
+    print(f"{'vitals_summary (SQL)':<28} evaluados={result['evaluados']:,}  imc_promedio={result['imc_promedio']}  obesidad={result['obesidad']:,}")
+    measure("vitals_summary (SQL)", summary, repeat)
+    measure("vitals_columns (NumPy)", numpy_columns, repeat)
+
+# --- REPORTES PDF ---
+
+def report_columns(n: int):
+    random.seed(3)
+    return {
+        "Fecha": [f"{1 + i % 28:02d}/05/2024 {8 + i % 10:02d}:{i % 60:02d}" for i in range(n)],
+        "Documento": [f"{10000000 + i}" for i in range(n)],
+        "Paciente": [f"{random.choice(APELLIDOS)}, {random.choice(NOMBRES)}" for _ in range(n)],
+        "Empresa": [f"Empresa Ñandú {i % 200} S.A.C." for i in range(n)],
+        "Puesto": ["Operario de Planta"] * n,
+        "Estado": ["En Circuito" if i % 3 else "Cerrado" for i in range(n)],
+    }
+
+def legacy_report(columns):
+    """Patrón anterior: DataFrame.iterrows() y un encode latin-1 por celda"""
+    df = pd.DataFrame(columns)
+    pdf = report_engine.PDFReport()
+    pdf.add_page()
+    pdf.chapter_title("Detalle")
+    col_width = 190 / len(df.columns)
+    pdf.set_font('Helvetica', '', 9)
+    for _, row in df.iterrows():
+        for col in df.columns:
+            clean_text = str(row[col]).encode('latin-1', 'replace').decode('latin-1')
+            pdf.cell(col_width, 10, clean_text[:25], 1, 0, 'C')
+        pdf.ln()
+    return bytes(pdf.output())
+
+def bench_report(filas: int):
+    print(f"📄 Reporte PDF de detalle hasta {filas:,} filas (sin BD)")
+    start, end = datetime(2024, 5, 1), datetime(2024, 6, 1)
+    sizes = sorted({max(filas // 10, 1), max(filas // 2, 1), filas})
+    per_row = []
+    for n in sizes:
+        columns = report_columns(n)
+        t0 = time.perf_counter()
+        size = len(report_engine.render_detail(columns, start, end))
+        elapsed = time.perf_counter() - t0
+        per_row.append(elapsed / n)
+        print(f"{'render_detail':<16} {n:>8,} filas  {elapsed:8.2f} s  {n / elapsed:10,.0f} filas/s  {size / 1024:10,.0f} KB")
+    columns = report_columns(sizes[0])
+    t0 = time.perf_counter()
+    legacy_report(columns)
+    elapsed = time.perf_counter() - t0
+    print(f"{'legacy iterrows':<16} {sizes[0]:>8,} filas  {elapsed:8.2f} s  {sizes[0] / elapsed:10,.0f} filas/s")
+    growth = per_row[-1] / per_row[0]
+    status = "✅" if growth < 1.5 else "⚠️"
+    print(f"{status} costo por fila {sizes[-1]:,} vs {sizes[0]:,} filas: x{growth:.2f} (lineal ≈ 1)")
+
+# --- CERTIFICADOS DE APTITUD ---
+
+def certificate_rows(n: int):
+    random.seed(5)
+    status = ["APTO", "APTO", "APTO CON RESTRICCIONES", "NO APTO"]
+    return [{
+        "uuid_documento": f"{i:08x}-0000-4000-8000-000000000000",
+        "aptitud_status": status[i % len(status)],
+        "restricciones": "Uso obligatorio de protección auditiva." if i % 4 == 2 else None,
+        "recomendaciones": "Control anual de presión arterial y dieta balanceada.",
+        "fecha_emision": datetime(2024, 5, 1 + i % 28, 10),
+        "fecha_vencimiento": date(2025, 5, 1 + i % 28),
+        "paciente": f"{random.choice(APELLIDOS)}, {random.choice(NOMBRES)}",
+        "tipo_documento": "DNI",
+        "numero_documento": f"{10000000 + i}",
+        "fecha_nacimiento": date(1970 + i % 35, 1 + i % 12, 1 + i % 28),
+        "empresa": f"Empresa Ñandú {i % 20} S.A.C.",
+        "ruc": f"20{100000000 + i % 20}",
+        "puesto_postula": "Operario de Planta",
+        "fecha_ingreso": datetime(2024, 5, 1 + i % 28, 8),
+        "medico": "Dra. Ana Peña Díaz",
+        "cmp_colegiatura": "045678",
+    } for i in range(n)]
+
+def bench_certificates(cantidad: int, workers: list):
+    print(f"📜 Emisión de {cantidad:,} certificados en ZIP (sin BD)")
+    rows = certificate_rows(cantidad)
+    for w in workers:
+        if w > 0:
+            # Arranque del pool (spawn + plantilla por worker) fuera de la medición: un lote por worker
+            with tempfile.TemporaryFile() as warmup:
+                certificates.write_certificates_zip(rows[:w * 25], warmup, workers=w, chunk_size=25)
+        with tempfile.TemporaryFile() as out:
+            t0 = time.perf_counter()
+            count = certificates.write_certificates_zip(rows, out, workers=w)
+            elapsed = time.perf_counter() - t0
+            size = out.tell()
+        label = "en proceso" if w == 0 else f"{w} procesos"
+        print(f"{label:<12} {count:>8,} cert  {elapsed:8.2f} s  {count / elapsed:8,.0f} cert/s  {size / 1024 / 1024:8.1f} MB")
+
+# --- ESCRITURAS CONCURRENTES DE RESULTADOS ---
+
+def legacy_save_result(db, admision_id, examen_id, datos):
+    """Patrón anterior: SELECT y luego INSERT o UPDATE con la mezcla hecha en Python"""
+    result = db.query(ResultadoClinico).filter(
+        ResultadoClinico.admision_id == admision_id,
+        ResultadoClinico.examen_id == examen_id
+    ).first()
+    if result:
+        result.datos_tecnicos = {**(result.datos_tecnicos or {}), **datos}
+    else:
+        db.add(ResultadoClinico(admision_id=admision_id, examen_id=examen_id, datos_tecnicos=datos))
+
+def check_concurrent_upserts(writers: int):
+    """
+    `writers` hilos guardan a la vez claves distintas del mismo (admisión, examen).
+    Correcto = una sola fila con las claves de todos y ningún error. Usa un examen
+    temporal que se elimina al terminar.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from threading import Barrier
+    from sqlalchemy import create_engine
+    from sqlalchemy.pool import NullPool
+    from config import settings
+    print(f"✍️  {writers} escrituras concurrentes sobre el mismo resultado clínico")
+    # Motor sin pool: cada escritor tiene su propia conexión y todos escriben a la vez
+    writers_engine = create_engine(settings.DATABASE_URL, poolclass=NullPool)
+    db = SessionLocal()
+    try:
+        admision = db.query(Admision).first()
+        if not admision:
+            print("No hay admisiones (ejecute utils/seed_real.py).")
+            sys.exit(1)
+        exam = CatalogoExamenes(codigo_interno="BENCH-UPSERT", nombre="Examen Bench Upsert", precio_base=0.0)
+        db.add(exam)
+        db.commit()
+        admision_id, examen_id = admision.id, exam.id
+    finally:
+        db.close()
+
+    def run(save):
+        barrier = Barrier(writers)
+
+        def writer(i):
+            session = SessionLocal(bind=writers_engine)
+            try:
+                session.connection()
+                barrier.wait()  # Todos los hilos conectados: escriben al mismo tiempo
+                save(session, i)
+                session.commit()
+                return None
+            except Exception as e:
+                session.rollback()
+                return type(e).__name__
+            finally:
+                session.close()
+
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            errors = [e for e in pool.map(writer, range(writers)) if e]
+        check = SessionLocal()
+        try:
+            rows = check.query(ResultadoClinico).filter(
+                ResultadoClinico.admision_id == admision_id, ResultadoClinico.examen_id == examen_id
+            ).all()
+            keys = set().union(*[(r.datos_tecnicos or {}).keys() for r in rows]) if rows else set()
+            check.query(ResultadoClinico).filter(
+                ResultadoClinico.admision_id == admision_id, ResultadoClinico.examen_id == examen_id
+            ).delete()
+            check.commit()
+        finally:
+            check.close()
+        return len(rows), len(keys), errors
+
+    failed = False
+    try:
+        for label, save, must_pass in (
+            ("legacy (select + insert/update)", lambda s, i: legacy_save_result(s, admision_id, examen_id, {f"k{i}": i}), False),
+            ("upsert_result", lambda s, i: clinical_results.upsert_result(s, admision_id, examen_id, {f"k{i}": i}), True),
+        ):
+            rows, keys, errors = run(save)
+            ok = rows == 1 and keys == writers and not errors
+            status = "✅" if ok else "❌"
+            print(f"{status} {label:<34} filas={rows}  claves={keys}/{writers}  errores={len(errors)} {sorted(set(errors))}")
+            failed |= must_pass and not ok
+    finally:
+        db = SessionLocal()
+        try:
+            db.query(CatalogoExamenes).filter(CatalogoExamenes.id == examen_id).delete()
+            db.commit()
+        finally:
+            db.close()
+        writers_engine.dispose()
+    if failed:
+        sys.exit(1)
+
+# --- LOGINS CONCURRENTES (CAMBIO DE TURNO) ---
+
+def bench_logins(usuarios: int):
+    """N sesiones verifican su clave a la vez; cada una en su propio hilo, como los scripts de Streamlit"""
+    from concurrent.futures import ThreadPoolExecutor
+    rounds = security.settings.BCRYPT_ROUNDS
+    print(f"🔐 {usuarios} logins simultáneos · bcrypt rounds={rounds} · cupos bcrypt={security.HASH_CONCURRENCY}")
+    stored = security.pwd_context.hash("clave-turno")
+
+    def login():
+        t0 = time.perf_counter()
+        valid, _ = security.verify_password("clave-turno", stored)
+        assert valid
+        return (time.perf_counter() - t0) * 1000
+
+    for label in ("primer ingreso", "re-ingreso (caché)"):
+        if label == "primer ingreso":
+            security.verification_cache.clear()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=usuarios) as sessions:
+            timings = sorted(sessions.map(lambda _: login(), range(usuarios)))
+        wall = time.perf_counter() - t0
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        print(
+            f"{label:<20} total={wall * 1000:8.1f} ms  {usuarios / wall:7.1f} logins/s  "
+            f"p50={statistics.median(timings):8.2f} ms  p99={p99:8.2f} ms"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de SisoAI")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_seed = sub.add_parser("seed", help="Genera data sintética masiva")
+    p_seed.add_argument("--admisiones", type=int, default=1_000_000)
+
+    p_dash = sub.add_parser("dashboard", help="Consultas del Panel Gerencial")
+    p_dash.add_argument("--repeat", type=int, default=20)
+
+    sub.add_parser("explain", help="Verifica que el dashboard use índices")
+
+    p_seed_pac = sub.add_parser("seed-patients", help="Genera pacientes sintéticos")
+    p_seed_pac.add_argument("--pacientes", type=int, default=1_000_000)
+
+    p_search = sub.add_parser("search", help="Búsqueda de pacientes (p50/p99)")
+    p_search.add_argument("--repeat", type=int, default=100)
+
+    sub.add_parser("checkouts", help="Verifica un checkout del pool por rerun de página")
+
+    p_prot = sub.add_parser("protocols", help="Cuenta consultas del listado de protocolos")
+    p_prot.add_argument("--protocolos", type=int, default=500)
+    p_prot.add_argument("--examenes", type=int, default=15)
+
+    p_intake = sub.add_parser("intake", help="Carga masiva de admisiones")
+    p_intake.add_argument("--admisiones", type=int, default=10_000)
+    p_intake.add_argument("--legacy-sample", type=int, default=500)
+
+    p_logins = sub.add_parser("logins", help="Logins concurrentes con bcrypt (no usa la BD)")
+    p_logins.add_argument("--usuarios", type=int, default=100)
+
+    p_upserts = sub.add_parser("upserts", help="Escrituras concurrentes del mismo resultado clínico")
+    p_upserts.add_argument("--writers", type=int, default=50)
+
+    p_seed_res = sub.add_parser("seed-results", help="Genera resultados clínicos sintéticos (requiere seed)")
+    p_seed_res.add_argument("--resultados", type=int, default=1_000_000)
+
+    p_tech = sub.add_parser("technical", help="Filtros por valores técnicos de resultados (p50/p99)")
+    p_tech.add_argument("--repeat", type=int, default=20)
+
+    p_vitals = sub.add_parser("vitals", help="Estadísticas de signos vitales (requiere seed-results)")
+    p_vitals.add_argument("--repeat", type=int, default=10)
+
+    p_report = sub.add_parser("report", help="Generación del PDF de detalle (escalamiento por filas)")
+    p_report.add_argument("--filas", type=int, default=100_000)
+
+    p_replica = sub.add_parser("replica", help="Verifica el enrutamiento a la réplica de lectura")
+    p_replica.add_argument("--escrituras", type=int, default=50)
+
+    p_async = sub.add_parser("async", help="Lecturas calientes: motor síncrono vs. asyncpg")
+    p_async.add_argument("--repeat", type=int, default=20)
+
+    p_cert = sub.add_parser("certificates", help="Emisión masiva de certificados (ZIP, pool de procesos)")
+    p_cert.add_argument("--cantidad", type=int, default=1000)
+    p_cert.add_argument("--workers", type=int, nargs="+", default=[0, 1, 2, 4])
+
+    args = parser.parse_args()
+    if args.command == "seed":
+        seed_large(args.admisiones)
+    elif args.command == "dashboard":
+        bench_dashboard(args.repeat)
+    elif args.command == "explain":
+        check_plans()
+    elif args.command == "seed-patients":
+        seed_patients(args.pacientes)
+    elif args.command == "search":
+        bench_search(args.repeat)
+    elif args.command == "checkouts":
+        check_checkouts()
+    elif args.command == "protocols":
+        check_protocol_queries(args.protocolos, args.examenes)
+    elif args.command == "intake":
+        bench_intake(args.admisiones, args.legacy_sample)
+    elif args.command == "seed-results":
+        seed_results(args.resultados)
+    elif args.command == "technical":
+        bench_technical(args.repeat)
+    elif args.command == "vitals":
+        bench_vitals(args.repeat)
+    elif args.command == "report":
+        bench_report(args.filas)
+    elif args.command == "replica":
+        check_replica(args.escrituras)
+    elif args.command == "async":
+        bench_async(args.repeat)
+    elif args.command == "certificates":
+        bench_certificates(args.cantidad, args.workers)
+    elif args.command == "upserts":
+        check_concurrent_upserts(args.writers)
+    elif args.command == "logins":
+        bench_logins(args.usuarios)
+
+if __name__ == "__main__":
+    main()
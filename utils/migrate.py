@@ -0,0 +1,166 @@
+import sys
+import argparse
+from pathlib import Path
+import logging
+
+# Add project root to path
+project_root = str(Path(__file__).parent.parent)
+sys.path.append(project_root)
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex, CreateColumn
+from sqlalchemy.dialects.postgresql import JSONB
+from database import engine, Base
+import models
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Migraciones idempotentes para bases de datos ya existentes.
+# create_all() solo crea tablas nuevas: no agrega índices ni columnas a tablas
+# que ya existen, por eso cada paso verifica el esquema actual antes de actuar.
+
+def install_extensions():
+    """Extensiones y funciones SQL que usan los índices de búsqueda"""
+    logger.info("Installing search extensions...")
+    with engine.begin() as conn:
+        conn.execute(models.SEARCH_EXTENSIONS)
+        conn.execute(models.JSONB_FUNCTIONS)
+
+def create_tables():
+    """Crea las tablas que aún no existen"""
+    logger.info("Creating missing tables...")
+    Base.metadata.create_all(bind=engine)
+
+def add_missing_columns():
+    """Agrega las columnas declaradas en models.py que falten en tablas ya existentes"""
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            # Con server_default las filas existentes reciben el valor y NOT NULL se cumple
+            ddl = str(CreateColumn(column).compile(dialect=engine.dialect))
+            logger.info(f"Adding column {table.name}.{column.name}...")
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {ddl}")
+
+def sync_indexes():
+    """Crea los índices declarados en models.py que falten (CONCURRENTLY, sin bloquear escrituras)"""
+    inspector = inspect(engine)
+    # CREATE INDEX CONCURRENTLY no puede ejecutarse dentro de una transacción
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                ddl = str(CreateIndex(index, if_not_exists=True).compile(dialect=engine.dialect))
+                ddl = ddl.replace("INDEX ", "INDEX CONCURRENTLY ", 1)
+                logger.info(f"Creating index {index.name} on {table.name}...")
+                conn.exec_driver_sql(ddl)
+
+def convert_jsonb_columns():
+    """
+    json -> jsonb en las columnas declaradas como JSONB. Reescribe la tabla bajo
+    ACCESS EXCLUSIVE: ejecutar en una ventana de mantenimiento si la tabla es grande.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        current = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if not isinstance(column.type, JSONB) or isinstance(current.get(column.name), JSONB):
+                continue
+            logger.info(f"Converting {table.name}.{column.name} to jsonb...")
+            with engine.begin() as conn:
+                conn.exec_driver_sql(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE jsonb USING {column.name}::jsonb"
+                )
+
+def dedupe_results():
+    """Elimina resultados clínicos duplicados para poder crear el índice único"""
+    inspector = inspect(engine)
+    if not inspector.has_table(models.ResultadoClinico.__tablename__):
+        return
+    if "uq_resultados_clinicos_admision_examen" in {ix["name"] for ix in inspector.get_indexes(models.ResultadoClinico.__tablename__)}:
+        return
+    logger.info("Removing duplicated resultados_clinicos...")
+    with engine.begin() as conn:
+        removed = conn.execute(text(models.RESULT_DEDUPE)).rowcount
+    logger.info(f"Duplicated results removed: {removed}.")
+
+def install_triggers():
+    """(Re)instala los triggers que mantienen los rollups"""
+    logger.info("Installing rollup triggers...")
+    with engine.begin() as conn:
+        conn.execute(models.ADMISION_STATS_TRIGGER)
+
+def backfill_rollups():
+    """Reconstruye admision_stats_hourly y admision_stats_estado desde admisiones en una sola transacción"""
+    logger.info("Backfilling admision_stats_hourly / admision_stats_estado...")
+    with engine.begin() as conn:
+        for statement in models.ADMISION_STATS_BACKFILL:
+            conn.execute(text(statement))
+        total = conn.execute(text("SELECT count(*) FROM admision_stats_hourly")).scalar()
+    logger.info(f"Rollup rebuilt: {total} buckets.")
+
+def backfill_exam_roles():
+    """Asigna el rol de Triaje a los exámenes que antes se detectaban por nombre"""
+    logger.info("Backfilling examen_roles...")
+    with engine.begin() as conn:
+        inserted = conn.execute(text(models.EXAM_ROLE_BACKFILL)).rowcount
+    logger.info(f"Exam roles assigned: {inserted}.")
+
+def backfill_vitals():
+    """Copia a signos_vitales los signos de Triaje guardados antes de existir la tabla"""
+    logger.info("Backfilling signos_vitales...")
+    with engine.begin() as conn:
+        inserted = conn.execute(text(models.VITALS_BACKFILL)).rowcount
+    logger.info(f"Vital signs rows copied: {inserted}.")
+
+def upgrade():
+    inspector = inspect(engine)
+    rollup_missing = not inspector.has_table(models.AdmisionStatsHourly.__tablename__) \
+        or not inspector.has_table(models.AdmisionStatsEstado.__tablename__)
+    exam_roles_missing = not inspector.has_table(models.ExamenRol.__tablename__)
+    vitals_missing = not inspector.has_table(models.SignosVitales.__tablename__)
+    install_extensions()
+    create_tables()
+    add_missing_columns()
+    convert_jsonb_columns()
+    dedupe_results()
+    sync_indexes()
+    install_triggers()
+    if rollup_missing:
+        backfill_rollups()
+    if exam_roles_missing:
+        backfill_exam_roles()
+    if vitals_missing:
+        backfill_vitals()
+
+def main():
+    parser = argparse.ArgumentParser(description="Migraciones de esquema de SisoAI")
+    parser.add_argument(
+        "command", nargs="?", default="upgrade", choices=["upgrade", "backfill-rollups"],
+        help="upgrade: tablas, índices y triggers faltantes; backfill-rollups: reconstruye los rollups"
+    )
+    args = parser.parse_args()
+    try:
+        logger.info("Starting database migration...")
+        if args.command == "upgrade":
+            upgrade()
+        elif args.command == "backfill-rollups":
+            backfill_rollups()
+        logger.info("Database migration completed successfully!")
+    except Exception as e:
+        logger.error(f"Error during database migration: {str(e)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
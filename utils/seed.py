@@ -13,6 +13,7 @@ from models import (
     Usuario, Paciente, Empresa, CatalogoExamenes, 
     Protocolo, ProtocoloDetalle, RolUsuario
 )
+from security import hash_password
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -34,7 +35,7 @@ def seed_admin_user():
         if not admin:
             admin = Usuario(
                 email="admin@sisoai.com",
-                hashed_password="hashed_admin123",  # In production, use proper password hashing
+                hashed_password=hash_password("admin123"),
                 rol=RolUsuario.ADMIN,
                 especialidad="Administración"
             )
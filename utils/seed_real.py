@@ -16,8 +16,10 @@ from models import (
     Usuario, CatalogoExamenes, Empresa, Protocolo, ProtocoloDetalle,
     Paciente, Admision, HojaRutaExamenes, ResultadoClinico, 
     CertificadoAptitud, AntecedenteOcupacional, 
-    EstadoExamen, EstadoAdmision, RolUsuario, AptitudStatus
+    EstadoExamen, EstadoAdmision, RolUsuario, AptitudStatus, EXAM_ROLE_BACKFILL
 )
+from sqlalchemy import text
+from security import hash_password
 
 # Configurar Faker en español
 fake = Faker(['es_ES', 'es_MX']) # Mezcla para variedad de apellidos latinos
@@ -66,12 +68,13 @@ def create_users(db: Session):
         nombre_completo="Administrador Principal",
         rol=RolUsuario.ADMIN,
         activo=True,
-        hashed_password="admin123"
+        hashed_password=hash_password("admin123")
     )
     db.add(admin)
 
-    # Médicos
+    # Médicos (un solo hash compartido: bcrypt es lento a propósito)
     medicos = []
+    medico_hash = hash_password("medico123")
     especialidades = ["Neumología", "Medicina Ocupacional", "Cardiología", "Medicina General"]
     for _ in range(5):
         m = Usuario(
@@ -81,7 +84,7 @@ def create_users(db: Session):
             cmp_colegiatura=str(random.randint(10000, 99999)),
             especialidad=random.choice(especialidades),
             activo=True,
-            hashed_password="medico123"
+            hashed_password=medico_hash
         )
         db.add(m)
         medicos.append(m)
@@ -264,6 +267,8 @@ def main():
     db = SessionLocal()
     try:
         exams = create_catalog(db)
+        db.execute(text(EXAM_ROLE_BACKFILL))  # Rol de Triaje para el examen musculoesquelético
+        db.commit()
         admin_user, medicos = create_users(db)
         companies, protocols = create_companies_and_protocols(db, exams)
         generate_patients_flow(db, protocols, medicos, admin_user)